@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark for participants.py.
+
+用 synthetic_clinical_data.py 生成 1×、10×、100× 真实队列规模（545 名受试者）的合成数据，
+对每个规模分别计时 participants.py 的各处理阶段：
+
+    scan_sessions        get_participants_and_sessions（遍历合成的 BIDS session 目录树）
+    index_tables         六个工作簿的 ClinicalTable 建表（日期标准化 + ID 索引）
+    participant_id ... education
+                         各 process_*_field 函数
+
+临床表直接以 DataFrame 注册到表注册中心（ClinicalTableRegistry.add_frame），不经过 Excel：
+100× 的 9HPT 表超过 .xlsx 的行数上限，且 Excel 读取耗时已由表缓存单独处理。
+
+--backend 选择 session 级量表的匹配实现（pandas / polars）；--check_backends 在每个规模上
+用两个实现分别计算所有量表（精确匹配以及 nearest / backward / forward 三种最近访视窗口），
+输出不完全相同时以非零状态退出。
+
+结果写为 JSON；指定 --compare 时与之前的结果逐阶段比较，任一阶段变慢超过 --tolerance
+（且绝对差超过 --min_seconds）时以非零状态退出，可用于发现性能回退。
+
+使用方法:
+    python benchmark_participants.py --scales 1 10 100 --output benchmark.json
+    python benchmark_participants.py --scales 1 10 --compare benchmark.json --tolerance 0.25
+    python benchmark_participants.py --scales 1 10 --backend polars --check_backends
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+
+import participants as pt
+from session_measures import BACKENDS
+from synthetic_clinical_data import COHORT_SIZE, generate_cohort, write_bids_session_tree
+
+logger = logging.getLogger(__name__)
+
+# 计时的阶段（顺序即 participants.py 的处理顺序）
+STAGES = [
+    'scan_sessions',
+    'index_tables',
+    'participant_id',
+    'session',
+    'age',
+    'sex',
+    'is_ms',
+    'sdmt',
+    '9hpt',
+    'edss',
+    't25fw',
+    'education',
+]
+
+# 后端一致性检查使用的匹配窗口（None 为默认的同一天精确匹配）
+EQUIVALENCE_WINDOWS = [None, (30, 'nearest'), (30, 'backward'), (30, 'forward')]
+
+
+def _timed(timings: Dict[str, float], stage: str, func, *args):
+    """
+    调用 func(*args) 并把耗时（秒）记到 timings[stage]。
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def check_backend_equivalence(participants: Dict[str, List[str]], clinical_dir: Path) -> List[str]:
+    """
+    用每个后端分别计算所有量表，并比较宽表、长表和未匹配 session 列表。
+
+    返回:
+        List[str]: 不一致的描述（为空表示所有后端输出相同）
+    """
+    participant_ids = list(participants)
+    mismatches = []
+    for window in EQUIVALENCE_WINDOWS:
+        windows = {} if window is None else {key: window for key in pt.INSTRUMENTS}
+        label = 'exact' if window is None else f"{window[1]} {window[0]}d"
+        reference = None
+        for backend in BACKENDS:
+            measures = pt.compute_session_measures(
+                participants, participant_ids, clinical_dir, match_windows=windows, backend=backend
+            )
+            if reference is None:
+                reference = measures
+                continue
+            for name in ('wide', 'long'):
+                expected, actual = getattr(reference, name), getattr(measures, name)
+                if not expected.equals(actual):
+                    differing = (expected != actual).any(axis=1).sum() if expected.shape == actual.shape else 'all'
+                    mismatches.append(f"{label}: {backend} {name} table differs from {BACKENDS[0]} ({differing} rows)")
+            if measures.missing != reference.missing:
+                mismatches.append(f"{label}: {backend} unmatched sessions differ from {BACKENDS[0]}")
+    return mismatches
+
+
+def run_scale(
+    scale: int,
+    seed: int = 0,
+    max_sessions: int = 7,
+    backend: str = 'pandas',
+    check_backends: bool = False
+) -> dict:
+    """
+    生成 scale 倍规模的合成队列并计时各阶段。
+
+    参数:
+        scale (int): 受试者数为 scale × COHORT_SIZE
+        seed (int): 随机种子
+        max_sessions (int): 每个受试者最多的 session 数
+        backend (str): session 级量表的匹配实现（见 session_measures.BACKENDS）
+        check_backends (bool): 是否额外检查所有后端的输出是否一致
+
+    返回:
+        dict: {'scale', 'subjects', 'sessions', 'rows', 'backend', 'seconds': {阶段: 秒},
+            'total_seconds'}，检查后端时另有 'backend_mismatches'
+    """
+    n_subjects = scale * COHORT_SIZE
+    cohort = generate_cohort(n_subjects, max_sessions, seed)
+    timings: Dict[str, float] = {}
+    mismatches = None
+    pt.MEASURE_BACKEND = backend
+
+    with tempfile.TemporaryDirectory(prefix='participants_bench_') as tmp:
+        bids_dir = Path(tmp) / 'bids_data'
+        clinical_dir = Path(tmp) / 'clinical_data'
+        clinical_dir.mkdir()
+        write_bids_session_tree(cohort.sessions, bids_dir)
+
+        participants = _timed(timings, 'scan_sessions', pt.get_participants_and_sessions, bids_dir)
+
+        # 表注册中心按目录缓存：给合成目录注册内存中的表，字段处理函数会直接取用
+        registry = pt.get_table_registry(clinical_dir)
+
+        def index_tables():
+            for key, frame in cohort.workbooks.items():
+                registry.add_frame(key, frame)
+
+        _timed(timings, 'index_tables', index_tables)
+
+        df = _timed(timings, 'participant_id', pt.process_participant_id_field, participants)
+        df = _timed(timings, 'session', pt.process_session_field, participants, df)
+        df = _timed(timings, 'age', pt.process_age_field, participants, df, clinical_dir)
+        df = _timed(timings, 'sex', pt.process_sex_field, df, clinical_dir)
+        df = _timed(timings, 'is_ms', pt.process_is_ms_field, df, clinical_dir)
+        df = _timed(timings, 'sdmt', pt.process_sdmt_field, participants, df, clinical_dir)
+        df = _timed(timings, '9hpt', pt.process_9hpt_fields, participants, df, clinical_dir)
+        df = _timed(timings, 'edss', pt.process_edss_field, participants, df, clinical_dir)
+        df = _timed(timings, 't25fw', pt.process_t25fw_field, participants, df, clinical_dir)
+        df = _timed(timings, 'education', pt.process_education_field, participants, df, clinical_dir)
+
+        if check_backends:
+            mismatches = check_backend_equivalence(participants, clinical_dir)
+
+        pt.clear_table_registries()
+
+    result = {
+        'scale': scale,
+        'subjects': n_subjects,
+        'sessions': len(cohort.sessions),
+        'rows': {key: len(frame) for key, frame in cohort.workbooks.items()},
+        'backend': backend,
+        'seconds': {stage: round(timings[stage], 4) for stage in STAGES},
+        'total_seconds': round(sum(timings.values()), 4),
+    }
+    if mismatches is not None:
+        result['backend_mismatches'] = mismatches
+    return result
+
+
+def compare_results(
+    current: List[dict],
+    baseline: List[dict],
+    tolerance: float,
+    min_seconds: float
+) -> List[str]:
+    """
+    逐规模、逐阶段与基线比较。
+
+    返回:
+        List[str]: 回退描述（耗时超过 基线 × (1 + tolerance) 且多出 min_seconds 以上）
+    """
+    baseline_by_scale = {result['scale']: result for result in baseline}
+    regressions = []
+    for result in current:
+        previous = baseline_by_scale.get(result['scale'])
+        if previous is None:
+            continue
+        for stage, seconds in result['seconds'].items():
+            before = previous['seconds'].get(stage)
+            if before is None:
+                continue
+            if seconds > before * (1 + tolerance) and seconds - before > min_seconds:
+                regressions.append(
+                    f"{result['scale']}x {stage}: {before:.3f}s -> {seconds:.3f}s "
+                    f"(+{(seconds / before - 1) * 100 if before else float('inf'):.0f}%)"
+                )
+    return regressions
+
+
+def log_results(results: List[dict]):
+    """
+    以表格形式记录各规模各阶段的耗时。
+    """
+    table = pd.DataFrame(
+        {f"{result['scale']}x": result['seconds'] for result in results}
+    )
+    table.loc['total'] = [result['total_seconds'] for result in results]
+    logger.info("Stage timings (seconds):\n" + table.to_string(float_format=lambda v: f"{v:.3f}"))
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description='participants.py 的合成数据规模基准测试'
+    )
+    parser.add_argument(
+        '--scales',
+        type=int,
+        nargs='+',
+        default=[1, 10, 100],
+        help=f'队列规模倍数（1× = {COHORT_SIZE} 名受试者）'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='随机种子'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default='pandas',
+        help='session级量表的匹配实现 (默认: pandas)'
+    )
+    parser.add_argument(
+        '--check_backends',
+        action='store_true',
+        help='检查所有后端的输出是否完全一致（不一致时以非零状态退出）'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='结果 JSON 文件路径'
+    )
+    parser.add_argument(
+        '--compare',
+        type=str,
+        default=None,
+        help='与之前的结果 JSON 比较，发现回退时以非零状态退出'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.25,
+        help='允许的相对变慢比例 (默认: 0.25)'
+    )
+    parser.add_argument(
+        '--min_seconds',
+        type=float,
+        default=0.05,
+        help='忽略绝对差小于该秒数的变化 (默认: 0.05)'
+    )
+
+    args = parser.parse_args()
+
+    # 字段处理函数会为每个缺失的 session 记录告警，基准测试中只保留本模块的日志
+    logging.getLogger(pt.__name__).setLevel(logging.ERROR)
+    logging.getLogger('clinical_tables').setLevel(logging.ERROR)
+
+    results = []
+    for scale in args.scales:
+        logger.info(f"Running {scale}x ({scale * COHORT_SIZE} subjects)...")
+        result = run_scale(scale, args.seed, backend=args.backend, check_backends=args.check_backends)
+        logger.info(
+            f"{scale}x: {result['sessions']} sessions, {result['total_seconds']:.2f}s total"
+        )
+        results.append(result)
+
+    log_results(results)
+
+    if args.output:
+        report = {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote benchmark results to {args.output}")
+
+    failed = False
+    if args.check_backends:
+        for result in results:
+            for mismatch in result['backend_mismatches']:
+                logger.error(f"Backend mismatch at {result['scale']}x: {mismatch}")
+                failed = True
+        if not failed:
+            logger.info(f"All backends produced identical output ({', '.join(BACKENDS)})")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            for regression in regressions:
+                logger.error(f"Regression: {regression}")
+            failed = True
+        else:
+            logger.info("No regressions against baseline")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
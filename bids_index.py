@@ -0,0 +1,412 @@
+"""
+BIDS 数据集索引（SQLite）
+
+organize_to_bids.py 在生成 BIDS 目录后调用 build_bids_index()，在数据集根目录写入
+bids_index.sqlite：每个文件一行，包含受试者、session 编号/日期、模态、相对路径、
+文件大小、校验和，以及 NIfTI 头和 JSON sidecar 中的关键字段。
+
+下游脚本（如 participants.py）通过 load_bids_index() / load_participants_sessions()
+一次读取即可列出和筛选数据集，无需再用正则遍历整个目录树。
+
+使用方法:
+    python bids_index.py --bids_dir ./bids_data --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from bids_sidecar import load_inherited_sidecars, sidecar_path_for
+from nifti_header import read_nifti_header
+
+logger = logging.getLogger(__name__)
+
+# 索引文件名（位于 BIDS 根目录，并写入 .bidsignore 以免 BIDS 验证器报错）
+INDEX_FILENAME = 'bids_index.sqlite'
+
+# 匹配 BIDS 文件相对路径：sub-<id>/ses-<编号>_<日期>/anat/sub-<id>_ses-<编号>_<日期>_<模态>.<扩展名>
+BIDS_FILE_PATTERN = re.compile(
+    r'^sub-(?P<subject>\d+)/ses-(?P<session_number>\d+)_(?P<session_date>\d{8})/'
+    r'(?P<datatype>[^/]+)/[^/]+_(?P<modality>[A-Za-z0-9]+)\.(?P<extension>nii\.gz|nii|json)$'
+)
+
+# 从 JSON sidecar 中抽取到索引里的字段（dcm2niix 输出的常用字段）
+SIDECAR_FIELDS = [
+    'SeriesDescription',
+    'ProtocolName',
+    'Manufacturer',
+    'ManufacturersModelName',
+    'MagneticFieldStrength',
+    'RepetitionTime',
+    'EchoTime',
+    'InversionTime',
+    'FlipAngle',
+    'AcquisitionTime',
+]
+
+# 索引表的列（顺序即 SQLite 表的列顺序）
+INDEX_COLUMNS = [
+    'subject', 'session_number', 'session_date', 'datatype', 'modality', 'extension',
+    'path', 'size', 'mtime_ns', 'checksum',
+    'nifti_version', 'shape', 'voxel_sizes', 'datatype_code',
+] + SIDECAR_FIELDS
+
+# 匹配 session 目录的相对路径：sub-<id>/ses-<编号>_<日期>
+SESSION_DIR_PATTERN = re.compile(r'^sub-(?P<subject>\d+)/ses-(?P<session_number>\d+)_(?P<session_date>\d{8})$')
+
+# 计算校验和时每次读取的块大小
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_checksum(path) -> str:
+    """
+    流式计算文件的 SHA-256 校验和（恒定内存）
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        str: 十六进制校验和
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_sidecar_fields(json_path: Path) -> Dict[str, Optional[str]]:
+    """
+    读取 JSON sidecar 中的关键字段（缺失或读取失败时为 None）
+    """
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.debug(f"无法读取 sidecar {json_path}: {e}")
+        metadata = {}
+    return read_sidecar_fields_from_dict(metadata)
+
+
+def read_sidecar_fields_from_dict(metadata: Dict) -> Dict[str, Optional[str]]:
+    """
+    从已解析的 sidecar 字典中抽取关键字段（缺失时为 None）
+    """
+    fields = {key: None for key in SIDECAR_FIELDS}
+    for key in SIDECAR_FIELDS:
+        value = metadata.get(key)
+        if value is not None:
+            fields[key] = value if isinstance(value, (int, float, str)) else json.dumps(value)
+    return fields
+
+
+def _index_file(task: Tuple[str, str, Optional[Tuple[int, int, str]]]) -> Optional[Dict]:
+    """
+    进程池工作函数：为单个文件生成索引行
+
+    Args:
+        task: (绝对路径, BIDS 根目录, 旧索引中的 (size, mtime_ns, checksum) 或 None)
+
+    Returns:
+        dict 或 None（路径不符合 BIDS 命名规则时）
+    """
+    path_str, root_str, cached = task
+    path = Path(path_str)
+    relative = path.relative_to(root_str).as_posix()
+
+    match = BIDS_FILE_PATTERN.match(relative)
+    if not match:
+        return None
+
+    stat = path.stat()
+    row = {column: None for column in INDEX_COLUMNS}
+    row.update(match.groupdict())
+    row['subject'] = f"sub-{row['subject']}"
+    row['path'] = relative
+    row['size'] = stat.st_size
+    row['mtime_ns'] = stat.st_mtime_ns
+
+    # 大小和修改时间都未变 → 复用旧的校验和，避免重新读取整个文件
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        row['checksum'] = cached[2]
+    else:
+        row['checksum'] = file_checksum(path)
+
+    if row['extension'] == 'json':
+        row.update(read_sidecar_fields(path))
+        return row
+
+    try:
+        header = read_nifti_header(path)
+        row['nifti_version'] = header.version
+        row['shape'] = 'x'.join(str(v) for v in header.shape)
+        row['voxel_sizes'] = 'x'.join(f"{v:.6g}" for v in header.voxel_sizes)
+        row['datatype_code'] = header.datatype
+    except Exception as e:
+        logger.warning(f" 无法读取 NIfTI 头 {path}: {type(e).__name__}: {e}")
+
+    row.update(read_sidecar_fields(sidecar_path_for(path)))
+    return row
+
+
+def _load_cached_checksums(index_path: Path) -> Dict[str, Tuple[int, int, str]]:
+    """
+    从已有索引中读取 {相对路径: (size, mtime_ns, checksum)}，用于增量更新
+    """
+    if not index_path.exists():
+        return {}
+    try:
+        with sqlite3.connect(index_path) as conn:
+            rows = conn.execute('SELECT path, size, mtime_ns, checksum FROM files').fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"旧索引无法读取，将完整重建: {e}")
+        return {}
+    return {path: (size, mtime_ns, checksum) for path, size, mtime_ns, checksum in rows}
+
+
+def build_bids_index(bids_root, max_workers: Optional[int] = None) -> Path:
+    """
+    扫描 BIDS 目录并（重新）生成 bids_index.sqlite
+
+    已存在的索引会被用来跳过未变化文件的校验和计算；新索引先写入临时文件，
+    完成后原子替换，避免读者看到写了一半的索引。
+
+    Args:
+        bids_root: BIDS 数据集根目录
+        max_workers: 并行进程数（None → CPU 核数；1 → 串行）
+
+    Returns:
+        Path: 索引文件路径
+    """
+    root = Path(bids_root)
+    index_path = root / INDEX_FILENAME
+    cached = _load_cached_checksums(index_path)
+
+    files = sorted(
+        p for p in root.glob('sub-*/ses-*/*/*')
+        if p.is_file() and p.name.endswith(('.nii.gz', '.nii', '.json'))
+    )
+    logger.info(f"正在索引 {len(files)} 个文件...")
+
+    tasks = [
+        (str(p), str(root), cached.get(p.relative_to(root).as_posix()))
+        for p in files
+    ]
+
+    if max_workers == 1:
+        results = list(tqdm(map(_index_file, tasks), total=len(tasks), desc=" 生成 BIDS 索引"))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(tqdm(executor.map(_index_file, tasks, chunksize=32),
+                                total=len(tasks), desc=" 生成 BIDS 索引"))
+
+    rows = [row for row in results if row is not None]
+
+    # session 目录清单（包括没有任何文件的 session，与目录遍历的结果一致）
+    session_dirs = sorted(
+        (f"sub-{match.group('subject')}", match.group('session_date'))
+        for match in (
+            SESSION_DIR_PATTERN.match(p.relative_to(root).as_posix())
+            for p in root.glob('sub-*/ses-*') if p.is_dir()
+        )
+        if match
+    )
+
+    # 按 BIDS 继承原则，用根目录 <模态>.json 补全文件级 sidecar 中缺失的字段
+    inherited = load_inherited_sidecars(root)
+    for row in rows:
+        inherited_fields = read_sidecar_fields_from_dict(inherited.get(row['modality'], {}))
+        for key, value in inherited_fields.items():
+            if row[key] is None:
+                row[key] = value
+
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    column_defs = ', '.join(f'"{column}"' for column in INDEX_COLUMNS)
+    placeholders = ', '.join('?' for _ in INDEX_COLUMNS)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(f'CREATE TABLE files ({column_defs}, PRIMARY KEY ("path"))')
+        conn.executemany(
+            f'INSERT INTO files VALUES ({placeholders})',
+            ([row[column] for column in INDEX_COLUMNS] for row in rows)
+        )
+        conn.execute('CREATE INDEX idx_subject_session ON files (subject, session_date)')
+        conn.execute('CREATE INDEX idx_modality ON files (modality)')
+        conn.execute('CREATE TABLE sessions (subject, session_date, PRIMARY KEY (subject, session_date))')
+        conn.executemany('INSERT INTO sessions VALUES (?, ?)', session_dirs)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, index_path)
+
+    ensure_bidsignore(root)
+
+    reused = sum(1 for task in tasks if task[2] is not None)
+    logger.info(f"BIDS 索引已写入: {index_path}（{len(rows)} 行，复用校验和 {reused} 个）")
+    return index_path
+
+
+def ensure_bidsignore(root: Path, entry: str = INDEX_FILENAME):
+    """
+    将文件加入 .bidsignore（BIDS 验证器会忽略其中列出的文件），默认为索引文件
+    """
+    bidsignore = root / '.bidsignore'
+    lines = []
+    if bidsignore.exists():
+        lines = bidsignore.read_text(encoding='utf-8').splitlines()
+    if entry not in lines:
+        with open(bidsignore, 'a', encoding='utf-8') as f:
+            f.write(entry + '\n')
+
+
+def load_bids_index(bids_root, **filters) -> List[Dict]:
+    """
+    读取 BIDS 索引，可按列精确筛选
+
+    示例:
+        load_bids_index(root, modality='T1w', extension='nii.gz')
+
+    Args:
+        bids_root: BIDS 数据集根目录
+        **filters: 列名=取值 的筛选条件（列名必须属于 INDEX_COLUMNS）
+
+    Returns:
+        List[Dict]: 每个文件一行（按 path 排序）
+
+    Raises:
+        FileNotFoundError: 索引文件不存在
+        ValueError: 筛选条件中包含未知列名
+    """
+    index_path = Path(bids_root) / INDEX_FILENAME
+    if not index_path.exists():
+        raise FileNotFoundError(f"BIDS 索引不存在: {index_path}")
+
+    unknown = set(filters) - set(INDEX_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的索引列: {sorted(unknown)}")
+
+    where = ''
+    if filters:
+        where = ' WHERE ' + ' AND '.join(f'"{column}" = ?' for column in filters)
+
+    with sqlite3.connect(index_path) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.execute(f'SELECT * FROM files{where} ORDER BY path', list(filters.values()))
+        return [dict(row) for row in cursor]
+
+
+def index_is_current(bids_root) -> bool:
+    """
+    判断索引中的 session 清单是否仍与 BIDS 目录一致
+
+    要求：索引含 sessions 表（旧版索引不记录没有文件的 session 目录）；索引中的受试者目录都还在；
+    最后修改时间不早于索引的 sub-* 目录，其 ses-* 目录清单与索引相同。早于索引的受试者目录
+    自索引生成后没有增删过条目，无需列出。只比较 ses-* 目录清单，因此受试者目录中新写入的
+    其他文件（如 participants.py 写出的 sub-<id>_sessions.tsv）不会使索引过期。
+
+    Returns:
+        bool: 索引存在且未过期
+    """
+    root = Path(bids_root)
+    index_path = root / INDEX_FILENAME
+    if not index_path.exists():
+        return False
+    try:
+        with sqlite3.connect(index_path) as conn:
+            if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'"
+            ).fetchone() is None:
+                return False
+            indexed: Dict[str, set] = {}
+            for subject, session_date in conn.execute('SELECT subject, session_date FROM sessions'):
+                indexed.setdefault(subject, set()).add(session_date)
+    except sqlite3.Error:
+        return False
+
+    index_mtime = index_path.stat().st_mtime_ns
+    subjects = set()
+    for entry in os.scandir(root):
+        if not (entry.is_dir() and re.match(r'^sub-\d+$', entry.name)):
+            continue
+        subjects.add(entry.name)
+        # 同一时间戳也视为可能变化过，宁可列出目录
+        if entry.stat().st_mtime_ns < index_mtime:
+            continue
+        session_dates = set()
+        for session_entry in os.scandir(entry.path):
+            match = SESSION_DIR_PATTERN.match(f"{entry.name}/{session_entry.name}")
+            if match and session_entry.is_dir():
+                session_dates.add(match.group('session_date'))
+        if session_dates != indexed.get(entry.name, set()):
+            return False
+    return set(indexed) <= subjects
+
+
+def load_participants_sessions(bids_root) -> Dict[str, List[str]]:
+    """
+    从索引中读取 {participant_id: [session_date, ...]}（日期已排序）
+
+    返回格式与 participants.get_participants_and_sessions 相同（包括没有文件的 session 目录；
+    旧版索引没有 sessions 表时按文件统计）。索引可能已过期，调用前用 index_is_current 检查。
+
+    Raises:
+        FileNotFoundError: 索引文件不存在
+    """
+    index_path = Path(bids_root) / INDEX_FILENAME
+    if not index_path.exists():
+        raise FileNotFoundError(f"BIDS 索引不存在: {index_path}")
+
+    participants: Dict[str, List[str]] = {}
+    with sqlite3.connect(index_path) as conn:
+        has_sessions = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'"
+        ).fetchone() is not None
+        cursor = conn.execute(
+            'SELECT DISTINCT subject, session_date FROM '
+            f'{"sessions" if has_sessions else "files"} ORDER BY subject, session_date'
+        )
+        for subject, session_date in cursor:
+            participants.setdefault(subject, []).append(session_date)
+    return participants
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description='为BIDS数据集生成索引文件 (bids_index.sqlite)'
+    )
+    parser.add_argument(
+        '--bids_dir',
+        type=str,
+        default='/home/xingwang/Dresden/bids_data',
+        help='BIDS数据集目录路径'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='并行进程数（默认: CPU核数）'
+    )
+
+    args = parser.parse_args()
+    build_bids_index(args.bids_dir, max_workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
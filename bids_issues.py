@@ -0,0 +1,148 @@
+"""
+BIDS issues.tsv 读写工具
+
+issues.tsv 由 organize_to_bids.py 创建（列：type, participant_id, session, issue），
+各处理脚本通过 append_issues() 批量追加问题记录；已存在的相同记录不会重复写入，
+因此脚本可以安全地多次运行。每次运行都重新生成全部记录的脚本用 replace_issues()
+替换自己上次写入的记录（其余脚本的记录保持不变）。
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# issues.tsv 的列（顺序固定）
+ISSUES_COLUMNS = ['type', 'participant_id', 'session', 'issue']
+
+
+def _clean_row(issue) -> Tuple[str, ...]:
+    """
+    转为 issues.tsv 的一行（制表符/换行会破坏 TSV 结构，统一替换为空格）
+    """
+    return tuple(str(value).replace('\t', ' ').replace('\n', ' ') for value in issue)
+
+
+def read_issues(issues_path) -> Tuple[List[Tuple[str, ...]], bool]:
+    """
+    读取 issues.tsv 中的记录
+
+    Args:
+        issues_path: issues.tsv 路径
+
+    Returns:
+        (records, has_header): 记录列表（不含表头）和首行是否为 ISSUES_COLUMNS 表头；
+        文件不存在或为空时返回 ([], False)。首行不是表头时按记录处理
+    """
+    issues_path = Path(issues_path)
+    if not issues_path.exists():
+        return [], False
+
+    with open(issues_path, 'r', encoding='utf-8', newline='') as f:
+        rows = [tuple(line.rstrip('\n').split('\t')) for line in f if line.strip('\n')]
+
+    has_header = bool(rows) and list(rows[0]) == ISSUES_COLUMNS
+    if has_header:
+        rows = rows[1:]
+    elif rows:
+        logger.warning(f"{issues_path} does not start with the issues.tsv header; treating its first line as an issue")
+    return rows, has_header
+
+
+def _write_issues(issues_path: Path, rows: List[Tuple[str, ...]]):
+    """
+    原子地重写整个 issues.tsv（表头 + rows）：先写同目录的临时文件再替换，中断时旧文件保持完整
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=issues_path.parent, prefix=issues_path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write('\t'.join(ISSUES_COLUMNS) + '\n')
+            f.write(''.join('\t'.join(row) + '\n' for row in rows))
+        os.replace(tmp_name, issues_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def append_issues(issues_path, issues: Iterable[Tuple[str, str, str, str]]) -> int:
+    """
+    批量追加问题记录到 issues.tsv（文件不存在或为空时先写表头；缺少表头时补上）
+
+    Args:
+        issues_path: issues.tsv 路径
+        issues: [(type, participant_id, session, issue), ...]
+
+    Returns:
+        int: 实际新写入的记录数
+    """
+    issues_path = Path(issues_path)
+
+    rows, has_header = read_issues(issues_path)
+    existing = set(rows)
+
+    new_rows: List[Tuple[str, ...]] = []
+    for issue in issues:
+        row = _clean_row(issue)
+        if row not in existing:
+            existing.add(row)
+            new_rows.append(row)
+
+    if not new_rows:
+        return 0
+
+    if rows and not has_header:
+        # 已有记录但缺少表头：整体重写，而不是在无表头的文件后追加
+        _write_issues(issues_path, rows + new_rows)
+    else:
+        with open(issues_path, 'a', encoding='utf-8', newline='') as f:
+            if not has_header:
+                f.write('\t'.join(ISSUES_COLUMNS) + '\n')
+            f.write(''.join('\t'.join(row) + '\n' for row in new_rows))
+
+    logger.info(f"Appended {len(new_rows)} issues to {issues_path}")
+    return len(new_rows)
+
+
+def replace_issues(
+    issues_path,
+    issues: Iterable[Tuple[str, str, str, str]],
+    stale: Callable[[Tuple[str, ...]], bool]
+) -> int:
+    """
+    用本次的记录替换 issues.tsv 中上次写入的同类记录
+
+    删除 stale(row) 为真的已有记录，再追加 issues 中的记录（相同记录只保留一条），
+    其余记录保持原顺序；整个文件原子地重写。
+
+    Args:
+        issues_path: issues.tsv 路径
+        issues: [(type, participant_id, session, issue), ...]
+        stale: 判断已有记录是否由本次运行重新生成（应被替换）的函数
+
+    Returns:
+        int: 本次的记录数（去重后）
+    """
+    issues_path = Path(issues_path)
+
+    rows, has_header = read_issues(issues_path)
+    kept = [row for row in rows if not stale(row)]
+    existing = set(kept)
+
+    new_rows: List[Tuple[str, ...]] = []
+    for issue in issues:
+        row = _clean_row(issue)
+        if row not in existing:
+            existing.add(row)
+            new_rows.append(row)
+
+    if has_header and kept + new_rows == rows:
+        return len(new_rows)
+    if not issues_path.exists() and not new_rows:
+        return 0
+
+    _write_issues(issues_path, kept + new_rows)
+    logger.info(f"Replaced {len(rows) - len(kept)} stale issues with {len(new_rows)} issues in {issues_path}")
+    return len(new_rows)
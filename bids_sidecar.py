@@ -0,0 +1,226 @@
+"""
+BIDS JSON sidecar 继承压缩 / 展开
+
+BIDS 继承原则（Inheritance Principle）：数据集根目录下的 T1w.json / FLAIR.json
+对所有同后缀的文件生效，文件级 sidecar 中的同名键覆盖上层的值。
+
+dcm2niix 为每个 session 生成完整的 sidecar，其中扫描仪、协议、TR/TE/TI 等字段
+在成千上万个文件中完全相同。compact_sidecars() 把同一模态下所有文件取值相同的键
+提升到根目录的 <模态>.json，每个文件只保留不同的键；expand_sidecars() 执行逆操作。
+
+使用方法:
+    python bids_sidecar.py --bids_dir ./bids_data --action compact
+    python bids_sidecar.py --bids_dir ./bids_data --action expand
+"""
+
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# 根目录下不属于继承 sidecar 的 BIDS JSON 文件
+NON_SIDECAR_FILES = {'dataset_description.json', 'participants.json', 'phenotype.json'}
+
+
+def sidecar_path_for(path: Path) -> Path:
+    """
+    返回 NIfTI 文件对应的 JSON sidecar 路径（.nii.gz / .nii → .json）
+
+    注意：Path.with_suffix('.json') 对 'x.nii.gz' 只会替换 '.gz'，得到 'x.nii.json'
+    """
+    path = Path(path)
+    name = path.name
+    for ext in ('.nii.gz', '.nii'):
+        if name.endswith(ext):
+            return path.with_name(name[:-len(ext)] + '.json')
+    return path
+
+
+def modality_from_sidecar_name(path: Path) -> str:
+    """
+    从 BIDS 文件名中取出后缀（模态），如 'sub-1_ses-01_20180212_T1w.json' → 'T1w'
+    """
+    return Path(path).name[:-len('.json')].rsplit('_', 1)[-1]
+
+
+def _read_json(path: Path) -> Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json(path: Path, data: Dict):
+    """
+    先写临时文件再原子替换，避免中断时留下半个 JSON
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _collect_sidecars(bids_root: Path) -> Dict[str, List[Path]]:
+    """
+    收集 sub-*/ses-*/*/ 下的所有 sidecar，按模态分组：{'T1w': [...], 'FLAIR': [...]}
+    """
+    groups: Dict[str, List[Path]] = {}
+    for json_path in sorted(bids_root.glob('sub-*/ses-*/*/*.json')):
+        groups.setdefault(modality_from_sidecar_name(json_path), []).append(json_path)
+    return groups
+
+
+def load_inherited_sidecars(bids_root) -> Dict[str, Dict]:
+    """
+    读取根目录下的继承 sidecar：{'T1w': {...}, 'FLAIR': {...}}（不存在的模态不出现）
+    """
+    root = Path(bids_root)
+    inherited = {}
+    for json_path in root.glob('*.json'):
+        if json_path.name in NON_SIDECAR_FILES:
+            continue
+        try:
+            inherited[json_path.stem] = _read_json(json_path)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f" 无法读取继承 sidecar {json_path}: {e}")
+    return inherited
+
+
+def load_effective_sidecar(json_path, inherited: Dict[str, Dict]) -> Dict:
+    """
+    按继承原则合并得到某个文件的完整元数据（文件级键覆盖根目录键）
+
+    Args:
+        json_path: 文件级 sidecar 路径
+        inherited: load_inherited_sidecars() 的返回值
+
+    Returns:
+        dict: 合并后的元数据
+    """
+    metadata = dict(inherited.get(modality_from_sidecar_name(json_path), {}))
+    metadata.update(_read_json(Path(json_path)))
+    return metadata
+
+
+def compact_sidecars(bids_root) -> Dict[str, int]:
+    """
+    将每个模态下所有文件取值相同的键提升到根目录 <模态>.json
+
+    已经压缩过的数据集（或新加入了完整 sidecar 的数据集）会先按继承合并，
+    再重新计算公共键，因此可以重复执行。
+
+    Args:
+        bids_root: BIDS 数据集根目录
+
+    Returns:
+        dict: {模态: 提升到根目录的键数量}
+    """
+    root = Path(bids_root)
+    inherited = load_inherited_sidecars(root)
+    hoisted_counts = {}
+
+    for modality, json_paths in _collect_sidecars(root).items():
+        metadata = {}
+        for json_path in json_paths:
+            try:
+                metadata[json_path] = load_effective_sidecar(json_path, inherited)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f" 无法读取 sidecar，跳过该模态的压缩 {json_path}: {e}")
+                metadata = None
+                break
+        if not metadata:
+            continue
+
+        # 公共键：在每个文件中都存在且取值完全相同
+        entries = iter(metadata.values())
+        common = dict(next(entries))
+        for entry in entries:
+            for key in list(common):
+                if key not in entry or entry[key] != common[key]:
+                    del common[key]
+
+        # 写入顺序保证中途中断时按继承读取的元数据不变：
+        # 1. 旧的根目录文件中有新公共键不再提供（或取值不同）的键时，先把完整元数据写回文件级 sidecar；
+        # 2. 再写（或删除）根目录 <模态>.json；
+        # 3. 最后从文件级 sidecar 中去掉已由根目录文件提供的公共键。
+        previous_common = inherited.get(modality, {})
+        if any(key not in common or common[key] != value for key, value in previous_common.items()):
+            for json_path, entry in metadata.items():
+                _write_json(json_path, entry)
+
+        top_level_path = root / f"{modality}.json"
+        if common:
+            _write_json(top_level_path, common)
+        elif top_level_path.exists():
+            top_level_path.unlink()
+
+        for json_path, entry in metadata.items():
+            _write_json(json_path, {k: v for k, v in entry.items() if k not in common})
+
+        hoisted_counts[modality] = len(common)
+        logger.info(f"压缩 {modality} sidecar: {len(json_paths)} 个文件, 提升 {len(common)} 个公共键")
+
+    return hoisted_counts
+
+
+def expand_sidecars(bids_root) -> int:
+    """
+    将根目录 <模态>.json 中的键写回每个文件级 sidecar，并删除根目录文件
+
+    Args:
+        bids_root: BIDS 数据集根目录
+
+    Returns:
+        int: 被展开的文件级 sidecar 数量
+    """
+    root = Path(bids_root)
+    inherited = load_inherited_sidecars(root)
+    expanded = 0
+
+    groups = _collect_sidecars(root)
+    expanded_modalities = [modality for modality in groups if modality in inherited]
+
+    for modality in expanded_modalities:
+        for json_path in groups[modality]:
+            _write_json(json_path, load_effective_sidecar(json_path, inherited))
+            expanded += 1
+        (root / f"{modality}.json").unlink()
+
+    logger.info(f"展开 sidecar: {expanded} 个文件, 删除 {len(expanded_modalities)} 个根目录继承文件")
+    return expanded
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description='按BIDS继承原则压缩或展开JSON sidecar'
+    )
+    parser.add_argument(
+        '--bids_dir',
+        type=str,
+        default='/home/xingwang/Dresden/bids_data',
+        help='BIDS数据集目录路径'
+    )
+    parser.add_argument(
+        '--action',
+        choices=['compact', 'expand'],
+        required=True,
+        help='compact: 提升公共键到根目录; expand: 写回每个文件'
+    )
+
+    args = parser.parse_args()
+
+    if args.action == 'compact':
+        compact_sidecars(args.bids_dir)
+    else:
+        expand_sidecars(args.bids_dir)
+
+
+if __name__ == "__main__":
+    main()
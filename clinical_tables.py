@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+"""
+Clinical table layer for participants.py.
+
+临床 Excel 表（sDOB、SDMT、9HPT、EDSS、T25FW、Education）在读取后只做一次 ID 标准化，
+并按受试者 ID 建立哈希索引；各字段提取函数通过 rows_for() 以 O(1) 取得某个受试者的所有行，
+避免对每个受试者都重新 astype(str) 并扫描整张表（O(N·M)）。
+
+ClinicalTableRegistry 按 EXCEL_FILES 的键惰性加载工作簿，每个工作簿最多解析一次，
+并把同一个 ClinicalTable 交给所有字段提取函数。
+
+openpyxl 解析 Excel 很慢且是单线程的；指定 cache_dir 后，每个工作簿首次读取后会以 Parquet
+格式缓存，之后的运行直接读取 Parquet（毫秒级）。缓存条目按源文件的绝对路径区分，
+按源文件的大小、修改时间和 SHA-256 校验是否失效（元数据与数据写在同一个 Parquet 文件中）。Parquet 依赖 pyarrow；未安装时自动退回直接读取 Excel。
+
+每个工作簿只需要其中几列（如 SDMT 只用 'ID Dresden'、'Assessment Started At'、
+'Total Number Correct'）。指定 columns 时改用 openpyxl 只读模式流式逐行读取，只保留所需列，
+ID 列存为 category；不再为不用的列构建 object 列，峰值内存和解析时间都随之下降。
+
+各工作簿的评估日期格式不同（SDMT/9HPT/T25FW 为 'Tue, 15 Aug 2017 09:11:07 +0000'，
+EDSS 为 '14/10/2021' 或 Excel 日期单元格，Education 为 Unix 时间戳）。建表时按 DATE_PARSERS
+中的解析器一次性向量化解析，得到统一的 datetime64 列 assessment_date（归一到当天 0 点），
+无法解析的值汇总记录一条警告，而不是在每次匹配时逐行 strptime。
+
+各工作簿相互独立，ClinicalTableRegistry.preload() 在进程池中并行读取（或从缓存读取）它们；
+子进程把 DataFrame 序列化为 Arrow IPC 缓冲区传回主进程（比 pickle 整个 DataFrame 更快），
+冷启动耗时约等于最慢的单个工作簿。
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+# 缓存格式版本（缓存内容的规则改变时递增，使旧缓存全部失效）
+CACHE_FORMAT_VERSION = 3
+
+# Parquet schema 元数据中保存缓存元数据的键
+CACHE_METADATA_KEY = b'clinical_tables.cache'
+
+# 计算源文件 SHA-256 时每次读取的块大小
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _file_sha256(file_path: Path) -> str:
+    """
+    流式计算文件的 SHA-256。
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_columnar_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    将混合类型的 object 列（如 9HPT 的 'Pegs Dropped' 同时含 int 和 '5+'）中的非空值转为字符串。
+    
+    Parquet 要求每列类型一致；下游字段提取对这些列只使用 str(value)，
+    转换前后 str() 的结果相同，空值（NaN）保持不变。
+    无论是否启用缓存都做同样的转换，保证缓存命中与未命中时得到的表完全一致。
+    
+    参数:
+        df (pd.DataFrame): 从 Excel 读取的原始数据表
+    
+    返回:
+        pd.DataFrame: 处理后的数据表（原地修改并返回）
+    """
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        values = df[column]
+        non_null = values[values.notna()]
+        if non_null.map(type).nunique() > 1:
+            df[column] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+def _cache_path(file_path: Path, cache_dir: Path) -> Path:
+    """
+    返回源文件的 Parquet 缓存路径：<文件名>.<源文件绝对路径的哈希>.parquet。
+    
+    多个数据集副本共用同一个缓存目录时，同名工作簿各自有独立的缓存条目。
+    """
+    source_key = hashlib.sha256(str(Path(file_path).resolve()).encode('utf-8')).hexdigest()[:16]
+    return cache_dir / f"{file_path.name}.{source_key}.parquet"
+
+
+def read_table_cache(
+    file_path: Path,
+    cache_dir: Path,
+    columns: Optional[List[str]] = None
+) -> Optional[pd.DataFrame]:
+    """
+    读取某个 Excel 文件的 Parquet 缓存；缓存不存在或已失效时返回 None。
+    
+    缓存元数据保存在同一个 Parquet 文件的 schema 元数据中，并从同一个打开的文件句柄读取，
+    因此校验的元数据与读到的数据总是来自同一次写入。
+    
+    失效判断：
+      0. 缓存时选取的列与本次 columns 不同 → 失效；
+      1. 源文件大小不同 → 失效；
+      2. 大小相同且修改时间相同 → 有效；
+      3. 修改时间不同（如文件被复制/touch）→ 比较 SHA-256，相同则仍然有效并更新元数据。
+    
+    参数:
+        file_path (Path): 源 Excel 文件路径
+        cache_dir (Path): 缓存目录
+        columns (List[str], 可选): 需要的列（None 表示全部列）
+    
+    返回:
+        pd.DataFrame 或 None
+    """
+    cache_path = _cache_path(file_path, cache_dir)
+    if not cache_path.exists():
+        return None
+
+    try:
+        import pyarrow.parquet as pq
+
+        with open(cache_path, 'rb') as f:
+            metadata = pq.read_schema(f).metadata or {}
+            meta = json.loads(metadata.get(CACHE_METADATA_KEY, b'{}'))
+
+            stat = file_path.stat()
+            if meta.get('version') != CACHE_FORMAT_VERSION or meta.get('size') != stat.st_size:
+                return None
+            if meta.get('columns') != (list(columns) if columns is not None else None):
+                return None
+            refresh = meta.get('mtime_ns') != stat.st_mtime_ns
+            if refresh and meta.get('sha256') != _file_sha256(file_path):
+                return None
+
+            f.seek(0)
+            df = pd.read_parquet(f)
+    except Exception as e:
+        # 含 pyarrow 缺失（ImportError）和缓存文件损坏
+        logger.warning(f"Could not read cache {cache_path.name}, reloading Excel: {e}")
+        return None
+
+    if refresh:
+        # 内容未变，只是修改时间变化 → 重写缓存以刷新元数据，下次无需再计算哈希
+        write_table_cache(file_path, cache_dir, df, columns)
+    return df
+
+
+def write_table_cache(
+    file_path: Path,
+    cache_dir: Path,
+    df: pd.DataFrame,
+    columns: Optional[List[str]] = None
+):
+    """
+    将 DataFrame 写入 Parquet 缓存，源文件的大小、修改时间、SHA-256 以及选取的列写入同一文件的
+    schema 元数据。
+    
+    先写入唯一命名的临时文件再原子替换，多个进程同时写同一条目时不会互相覆盖半个文件。
+    写入失败（如未安装 pyarrow）只记录警告，不影响本次运行。
+    """
+    cache_path = _cache_path(file_path, cache_dir)
+    tmp_path = None
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        stat = file_path.stat()
+        meta = {
+            'version': CACHE_FORMAT_VERSION,
+            'source': str(Path(file_path).resolve()),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_sha256(file_path),
+            'columns': list(columns) if columns is not None else None,
+        }
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            CACHE_METADATA_KEY: json.dumps(meta).encode('utf-8'),
+        })
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, prefix=cache_path.name + '.', suffix='.tmp')
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Could not write cache for {file_path.name}: {e}")
+        if tmp_path is not None and tmp_path.exists():
+            tmp_path.unlink()
+
+
+# 与 pandas.read_excel 默认一致的缺失值字符串
+EXCEL_NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+})
+
+
+def read_excel_columns(file_path: Path, columns: List[str]) -> pd.DataFrame:
+    """
+    以 openpyxl 只读模式流式读取第一个工作表中的指定列。
+    
+    单元格取值规则与 pandas.read_excel 一致：整数值的浮点数转为 int，
+    EXCEL_NA_VALUES 中的字符串视为缺失，整行为空的行被跳过。
+    
+    参数:
+        file_path (Path): Excel 文件路径
+        columns (List[str]): 需要的列名（表头第一行）
+    
+    返回:
+        pd.DataFrame: 只包含 columns 的数据表（列顺序与 columns 一致）
+    
+    异常:
+        ValueError: 表头中缺少某个所需列
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(value) if value is not None else '' for value in next(rows, ())]
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns {missing} in {file_path.name}")
+        positions = [header.index(column) for column in columns]
+
+        data: List[list] = [[] for _ in columns]
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            for values, position in zip(data, positions):
+                value = row[position] if position < len(row) else None
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                elif isinstance(value, str) and value in EXCEL_NA_VALUES:
+                    value = None
+                values.append(value)
+    finally:
+        workbook.close()
+
+    return pd.DataFrame(dict(zip(columns, data)), columns=columns)
+
+
+def load_excel_file(
+    file_path: Path,
+    cache_dir: Optional[Path] = None,
+    columns: Optional[List[str]] = None,
+    categorical_columns: Tuple[str, ...] = ()
+) -> Optional[pd.DataFrame]:
+    """
+    从指定路径加载 Excel 文件，并返回对应的 pandas DataFrame。
+    
+    参数:
+        file_path (Path): 要加载的 Excel 文件的路径（应为 pathlib.Path 对象）。
+        cache_dir (Path, 可选): Parquet 缓存目录；为 None 时不使用缓存。
+        columns (List[str], 可选): 只读取这些列（流式读取，见 read_excel_columns）；
+            为 None 时读取全部列。
+        categorical_columns (Tuple[str, ...], 可选): 转为 category 类型的列（如受试者 ID 列）。
+    
+    返回:
+        pd.DataFrame 或 None: 
+            - 如果文件存在且成功读取，返回包含数据的 DataFrame；
+            - 如果文件不存在或读取过程中出错，返回 None。
+    """
+    # 检查文件是否存在
+    if not file_path.exists():
+        # 如果文件不存在，记录一条警告日志，并返回 None
+        logger.warning(f"Excel file not found: {file_path}")
+        return None
+    
+    # 优先读取有效的 Parquet 缓存
+    if cache_dir is not None:
+        df = read_table_cache(file_path, cache_dir, columns)
+        if df is not None:
+            logger.info(f"Loaded {file_path.name} from cache: {len(df)} rows")
+            return df
+    
+    try:
+        if columns is None:
+            # 使用 pandas 读取 Excel 文件（支持 .xls 和 .xlsx）
+            df = pd.read_excel(file_path)
+        else:
+            # 只流式读取所需列
+            df = read_excel_columns(file_path, columns)
+        df = make_columnar_safe(df)
+        for column in categorical_columns:
+            df[column] = df[column].astype('category')
+        
+        # 记录成功加载的日志，包括文件名和行数，便于调试和监控
+        logger.info(f"Loaded {file_path.name}: {len(df)} rows")
+    
+    except Exception as e:
+        # 捕获所有可能的异常（如文件损坏、格式错误、缺少依赖库等）
+        # 记录错误日志，包含具体的异常信息，便于排查问题
+        logger.error(f"Error loading {file_path}: {e}")
+        
+        # 出错时返回 None，避免程序崩溃
+        return None
+    
+    if cache_dir is not None:
+        write_table_cache(file_path, cache_dir, df, columns)
+    
+    # 返回读取到的数据框
+    return df
+
+
+def frame_to_arrow_bytes(df: pd.DataFrame) -> Optional[bytes]:
+    """
+    将 DataFrame 序列化为 Arrow IPC 流（无法序列化或未安装 pyarrow 时返回 None）。
+    """
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    except Exception as e:
+        logger.debug(f"Arrow serialization failed, falling back to pickle: {e}")
+        return None
+
+
+def frame_from_arrow_bytes(data: bytes) -> pd.DataFrame:
+    """
+    frame_to_arrow_bytes 的逆操作。
+    """
+    import pyarrow as pa
+    with pa.ipc.open_stream(io.BytesIO(data)) as reader:
+        return reader.read_all().to_pandas()
+
+
+def _load_workbook_task(task: Tuple[str, Path, Optional[Path], Optional[List[str]], Tuple[str, ...]]
+                        ) -> Tuple[str, str, Any, float]:
+    """
+    进程池工作函数：读取一个工作簿并以 Arrow 缓冲区返回。
+
+    参数:
+        task: (键, 工作簿路径, 缓存目录或 None, 所需列或 None, category 列)
+
+    返回:
+        (键, 载荷类型 'arrow' / 'frame' / 'none', 载荷, 耗时秒数)
+    """
+    key, file_path, cache_dir, columns, categorical_columns = task
+    start = time.perf_counter()
+    df = load_excel_file(file_path, cache_dir, columns, categorical_columns)
+    elapsed = time.perf_counter() - start
+    if df is None:
+        return key, 'none', None, elapsed
+    data = frame_to_arrow_bytes(df)
+    if data is None:
+        return key, 'frame', df, elapsed
+    return key, 'arrow', data, elapsed
+
+
+# 标准化后的评估日期列名（datetime64，无法解析时为 NaT）
+ASSESSMENT_DATE_COLUMN = 'assessment_date'
+
+
+def _parse_with_formats(text: pd.Series, formats: List[str]) -> pd.Series:
+    """
+    依次用 formats 中的格式解析字符串列，前一个格式解析失败的值交给下一个格式。
+    """
+    result = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    for fmt in formats:
+        pending = result.isna() & text.notna()
+        if not pending.any():
+            break
+        result[pending] = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+    return result
+
+
+def _parse_rfc2822(values: pd.Series) -> pd.Series:
+    """
+    'Tue, 15 Aug 2017 09:11:07 +0000' → 取日期和时间部分（忽略时区，与原 strptime 逻辑一致），
+    其次尝试 'YYYY-MM-DD'。
+    """
+    text = values.where(values.isna(), values.astype(str))
+    without_zone = text.str.split(' +', n=1, regex=False).str[0]
+    result = _parse_with_formats(without_zone, ['%a, %d %b %Y %H:%M:%S'])
+    pending = result.isna() & text.notna()
+    if pending.any():
+        result[pending] = _parse_with_formats(text[pending], ['%Y-%m-%d'])
+    return result
+
+
+def _parse_day_first(values: pd.Series) -> pd.Series:
+    """
+    '14/10/2021'（日/月/年）；Excel 日期单元格读出后为 datetime 或 '2021-10-14 00:00:00'。
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('datetime64[ns]')
+    text = values.where(values.isna(), values.astype(str))
+    return _parse_with_formats(text, ['%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'])
+
+
+def _parse_unix_seconds(values: pd.Series) -> pd.Series:
+    """
+    Unix 时间戳（秒，按 UTC 转换）。
+    """
+    seconds = pd.to_numeric(values, errors='coerce')
+    return pd.to_datetime(seconds, unit='s', errors='coerce').astype('datetime64[ns]')
+
+
+# 日期解析器：名称 → 向量化解析函数（输入原始列，输出 datetime64[ns]，失败为 NaT）
+DATE_PARSERS = {
+    'rfc2822': _parse_rfc2822,
+    'day_first': _parse_day_first,
+    'unix_seconds': _parse_unix_seconds,
+}
+
+
+def normalize_assessment_dates(values: pd.Series, parser: str) -> Tuple[pd.Series, pd.Series]:
+    """
+    向量化解析评估日期列，并归一到当天 0 点。
+
+    参数:
+        values (pd.Series): 原始日期列
+        parser (str): DATE_PARSERS 中的解析器名称
+
+    返回:
+        Tuple[pd.Series, pd.Series]:
+            - 解析后的 datetime64[ns] 列（无法解析为 NaT）
+            - 无法解析的原始值（原值非空但解析结果为 NaT）
+    """
+    if parser not in DATE_PARSERS:
+        raise ValueError(f"Unknown date parser: {parser}")
+    dates = DATE_PARSERS[parser](values).dt.normalize()
+    unparseable = values[dates.isna() & values.notna()]
+    return dates, unparseable
+
+
+def normalize_id_column(series: pd.Series) -> pd.Series:
+    """
+    将 ID 列标准化为去除首尾空格的字符串（与 participant_id 去掉 'sub-' 后的形式一致）。
+
+    参数:
+        series (pd.Series): 原始 ID 列（可能是 int、float 或 str）
+
+    返回:
+        pd.Series: 标准化后的字符串 ID 列
+    """
+    return series.astype(str).str.strip()
+
+
+class ClinicalTable:
+    """
+    带受试者 ID 哈希索引的临床数据表。
+
+    构造时对 ID 列做一次标准化，并用 groupby 建立 {numeric_id: 行位置数组} 的映射，
+    之后每次查询都是一次字典查找 + iloc 取行，行顺序与原 Excel 表保持一致
+    （因此 “取第一条匹配记录” 的语义不变）。
+
+    若指定了 date_column，会额外生成标准化的 assessment_date 列（见 normalize_assessment_dates）。
+
+    属性:
+        df (pd.DataFrame): 原始数据表
+        id_column (str): ID 列名（如 'ID Dresden' 或 'mpi'）
+        normalized_ids (pd.Series): 标准化后的 ID 列（与 df 同索引）
+        date_column (str 或 None): 原始评估日期列名
+        unparseable_dates (int): 无法解析的日期值个数
+    """
+
+    def __init__(self, df: pd.DataFrame, id_column: str,
+                 date_column: Optional[str] = None, date_parser: Optional[str] = None):
+        self.df = df
+        self.id_column = id_column
+        self.date_column = date_column
+        self.unparseable_dates = 0
+
+        if date_column is not None:
+            dates, unparseable = normalize_assessment_dates(df[date_column], date_parser)
+            df[ASSESSMENT_DATE_COLUMN] = dates
+            self.unparseable_dates = len(unparseable)
+            if self.unparseable_dates:
+                samples = unparseable.astype(str).value_counts().head(10).to_dict()
+                logger.warning(
+                    f"{self.unparseable_dates} of {len(df)} '{date_column}' values could not be "
+                    f"parsed as dates (most common: {samples})"
+                )
+
+        normalized_ids = normalize_id_column(df[id_column])
+        self.normalized_ids = normalized_ids
+        # groupby(...).indices 返回 {ID: 按原顺序排列的行位置 ndarray}
+        self._positions: Dict[str, np.ndarray] = normalized_ids.groupby(
+            normalized_ids, sort=False
+        ).indices
+        self._empty = df.iloc[0:0]
+
+        logger.debug(
+            f"Indexed {len(df)} rows by '{id_column}': {len(self._positions)} distinct IDs"
+        )
+
+    def rows_for(self, numeric_id: str) -> pd.DataFrame:
+        """
+        返回某个受试者的所有行（无记录时返回空 DataFrame）。
+
+        参数:
+            numeric_id (str): 去掉 'sub-' 前缀的受试者 ID，如 '500000017'
+
+        返回:
+            pd.DataFrame: 该受试者的所有行（保持原表顺序）
+        """
+        positions = self._positions.get(numeric_id)
+        if positions is None:
+            return self._empty
+        return self.df.iloc[positions]
+
+    def ids(self) -> List[str]:
+        """
+        返回表中出现过的所有（标准化后的）受试者 ID。
+        """
+        return list(self._positions)
+
+    def __contains__(self, numeric_id: str) -> bool:
+        return numeric_id in self._positions
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+
+class ClinicalTableRegistry:
+    """
+    临床表注册中心：按 EXCEL_FILES 的键惰性加载工作簿，每个工作簿最多加载一次。
+
+    加载失败（文件缺失/损坏）的结果同样会被缓存为 None，避免重复尝试和重复告警。
+    get / preload / add_frame 由同一把锁保护，多个线程同时取表时每个工作簿仍只加载一次。
+
+    属性:
+        clinical_data_dir (Path): 临床数据目录
+        excel_files (Dict[str, str]): 键 → Excel 文件名（即 participants.EXCEL_FILES）
+        id_columns (Dict[str, str]): 键 → ID 列名
+        date_columns (Dict[str, Tuple[str, str]]): 键 → (原始日期列名, DATE_PARSERS 中的解析器名)
+        cache_dir (Path 或 None): Parquet 缓存目录（None 表示不缓存）
+        columns (Dict[str, List[str]]): 键 → 需要读取的列（未列出的键读取全部列）
+        load_stats (Dict[str, dict]): 键 → {'file', 'rows', 'seconds', 'memory_mb'}
+    """
+
+    def __init__(self, clinical_data_dir: Path, excel_files: Dict[str, str],
+                 id_columns: Dict[str, str],
+                 date_columns: Optional[Dict[str, Tuple[str, str]]] = None,
+                 cache_dir: Optional[Path] = None,
+                 columns: Optional[Dict[str, List[str]]] = None):
+        self.clinical_data_dir = Path(clinical_data_dir)
+        self.excel_files = excel_files
+        self.id_columns = id_columns
+        self.date_columns = date_columns or {}
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.columns = columns or {}
+        self.load_stats: Dict[str, dict] = {}
+        self._tables: Dict[str, Optional[ClinicalTable]] = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: str) -> Optional[ClinicalTable]:
+        """
+        返回键对应的 ClinicalTable（首次访问时加载并建索引）。
+
+        参数:
+            key (str): EXCEL_FILES 中的键，如 'sDOB'、'sdmt'
+
+        返回:
+            ClinicalTable 或 None（文件不存在或读取失败）
+        """
+        with self._lock:
+            if key in self._tables:
+                return self._tables[key]
+
+            start = time.perf_counter()
+            df = load_excel_file(*self._load_args(key))
+            return self._add_table(key, df, start)
+
+    def _load_args(self, key: str) -> tuple:
+        """
+        返回 load_excel_file 的参数：(路径, 缓存目录, 所需列, category 列)。
+        """
+        return (
+            self.clinical_data_dir / self.excel_files[key],
+            self.cache_dir,
+            self.columns.get(key),
+            (self.id_columns[key],),
+        )
+
+    def preload(self, keys: Optional[List[str]] = None, max_workers: Optional[int] = None):
+        """
+        在进程池中并行加载尚未加载的工作簿。
+
+        参数:
+            keys (List[str], 可选): 要加载的键（默认 excel_files 中的全部键）
+            max_workers (int, 可选): 并行进程数（None → min(工作簿数, CPU 核数)；1 → 串行）
+        """
+        with self._lock:
+            if keys is None:
+                keys = list(self.excel_files)
+            pending = [key for key in keys if key not in self._tables]
+            if not pending:
+                return
+
+            if max_workers is None:
+                max_workers = min(len(pending), os.cpu_count() or 1)
+            if max_workers <= 1 or len(pending) == 1:
+                for key in pending:
+                    self.get(key)
+                return
+
+            tasks = [(key,) + self._load_args(key) for key in pending]
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for key, kind, payload, worker_seconds in executor.map(_load_workbook_task, tasks):
+                    if kind == 'arrow':
+                        df = frame_from_arrow_bytes(payload)
+                    else:
+                        df = payload
+                    self._add_table(key, df, time.perf_counter() - worker_seconds)
+            logger.info(
+                f"Preloaded {len(pending)} workbooks with {max_workers} processes "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+
+    def add_frame(self, key: str, df: pd.DataFrame) -> Optional[ClinicalTable]:
+        """
+        直接用内存中的 DataFrame 注册一个表（不读取 Excel），如合成数据或基准测试。
+
+        DataFrame 须与工作簿结构一致（含 id_columns / date_columns 中的列）；已注册的键会被覆盖。
+        """
+        with self._lock:
+            return self._add_table(key, df, time.perf_counter())
+
+    def _add_table(self, key: str, df: Optional[pd.DataFrame], start: float) -> Optional[ClinicalTable]:
+        """
+        为已加载的 DataFrame 建表（日期标准化 + ID 索引），并记录加载统计。
+
+        start 为加载开始的 perf_counter 时间（并行加载时按子进程内的实际耗时回推）。
+        """
+        file_path = self.clinical_data_dir / self.excel_files[key]
+        date_column, date_parser = self.date_columns.get(key, (None, None))
+        table = (
+            ClinicalTable(df, self.id_columns[key], date_column, date_parser)
+            if df is not None else None
+        )
+        elapsed = time.perf_counter() - start
+
+        if table is not None:
+            memory_mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+            self.load_stats[key] = {
+                'file': file_path.name,
+                'rows': len(df),
+                'seconds': elapsed,
+                'memory_mb': memory_mb,
+            }
+            logger.info(
+                f"Table '{key}' ready: {len(df)} rows, {memory_mb:.1f} MB, "
+                f"loaded in {elapsed:.2f}s"
+            )
+
+        self._tables[key] = table
+        return table
+
+    def loaded_keys(self) -> List[str]:
+        """
+        返回已加载（含加载失败）的键。
+        """
+        return list(self._tables)
+
+    def log_summary(self):
+        """
+        记录所有已加载表的耗时和内存占用汇总。
+        """
+        if not self.load_stats:
+            return
+        total_seconds = sum(stat['seconds'] for stat in self.load_stats.values())
+        total_memory = sum(stat['memory_mb'] for stat in self.load_stats.values())
+        for key, stat in self.load_stats.items():
+            logger.info(
+                f"  {key:<10} {stat['file']:<35} {stat['rows']:>8} rows "
+                f"{stat['memory_mb']:>8.1f} MB {stat['seconds']:>7.2f}s"
+            )
+        logger.info(
+            f"Clinical tables: {len(self.load_stats)} loaded, "
+            f"{total_memory:.1f} MB, {total_seconds:.2f}s total"
+        )
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Missing-data records for participants.py.
+
+各字段处理函数把缺失/未匹配的 (participant_id, session, field, reason) 批量加入 MissingDataLog，
+而不是各自把受试者列表拼进日志。运行结束时：
+
+    log_summary()   每个字段一行计数（受试者数 / session 数及原因）
+    write_issues()  把全部记录一次性写入 BIDS 根目录的 issues.tsv，替换上次运行写入的 "Missing …"
+                    记录（见 bids_issues.replace_issues；其他脚本的记录保持不变）
+
+增量更新只重算部分受试者/字段时，用 cover() 标明本次重算的范围，write_issues() 只替换
+该范围内的旧记录；未调用 cover() 表示本次重算了全部受试者的全部字段。
+
+session 为空表示受试者级的缺失（如 sDOB 表中没有该受试者）；写入 issues.tsv 时
+session 日期会换成对应的 session 目录名（如 ses-01_20180212）。
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from bids_issues import replace_issues
+from session_outputs import session_labels
+
+logger = logging.getLogger(__name__)
+
+# 记录表的列
+MISSING_COLUMNS = ['participant_id', 'session', 'field', 'reason']
+
+# issues.tsv 中的问题类型（针对具体受试者/session）
+ISSUE_TYPE = 'specific'
+
+# 本模块写入的问题描述前缀（'Missing <field>: <reason>'）
+ISSUE_PREFIX = 'Missing '
+
+
+class MissingDataLog:
+    """
+    收集缺失数据记录，按字段汇总并批量写入 issues.tsv。
+    """
+
+    def __init__(self):
+        self._chunks: List[pd.DataFrame] = []
+        # 本次重算的范围：[(受试者集合, 字段集合或 None=全部字段), ...]；None 表示全部
+        self._scope: Optional[List[Tuple[Set[str], Optional[Set[str]]]]] = None
+
+    def cover(self, participant_ids: Iterable[str], fields: Optional[Iterable[str]] = None):
+        """
+        标明本次重算了这些受试者的这些字段（fields 为 None 表示全部字段），
+        write_issues() 会替换该范围内上次写入的记录。
+        """
+        if self._scope is None:
+            self._scope = []
+        self._scope.append((set(participant_ids), None if fields is None else set(fields)))
+
+    def covers(self, participant_id: str, field: str) -> bool:
+        """
+        (participant_id, field) 是否在本次重算的范围内。
+        """
+        if self._scope is None:
+            return True
+        return any(
+            participant_id in participant_ids and (fields is None or field in fields)
+            for participant_ids, fields in self._scope
+        )
+
+    def add(self, field: str, reason: str, participant_ids: Iterable[str],
+            sessions: Optional[Iterable[str]] = None):
+        """
+        批量加入同一字段、同一原因的记录。
+
+        参数:
+            field (str): 字段名，如 'age'、'edss'
+            reason (str): 缺失原因
+            participant_ids (Iterable[str]): 受试者 ID
+            sessions (Iterable[str], 可选): 与 participant_ids 一一对应的 session 日期（YYYYMMDD）；
+                不提供表示受试者级记录
+        """
+        participant_ids = list(participant_ids)
+        if not participant_ids:
+            return
+        self._chunks.append(pd.DataFrame({
+            'participant_id': participant_ids,
+            'session': list(sessions) if sessions is not None else '',
+            'field': field,
+            'reason': reason,
+        }))
+
+    def extend(self, other: 'MissingDataLog'):
+        """
+        并入另一个记录表的全部记录。
+        """
+        self._chunks.extend(other._chunks)
+
+    def add_frame(self, records: pd.DataFrame):
+        """
+        并入 frame() 格式的记录（如多节点分片写出的缺失记录文件）。
+        """
+        if len(records):
+            self._chunks.append(records[MISSING_COLUMNS].reset_index(drop=True))
+
+    def frame(self) -> pd.DataFrame:
+        """
+        返回全部记录（列见 MISSING_COLUMNS）。
+        """
+        if not self._chunks:
+            return pd.DataFrame(columns=MISSING_COLUMNS)
+        return pd.concat(self._chunks, ignore_index=True)
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def counts(self) -> pd.DataFrame:
+        """
+        按 (字段, 原因) 统计受试者数和 session 数。
+        """
+        records = self.frame()
+        is_session = records['session'] != ''
+        return records.assign(
+            participants=~is_session, sessions=is_session
+        ).groupby(['field', 'reason'], sort=False)[['participants', 'sessions']].sum()
+
+    def log_summary(self):
+        """
+        每个 (字段, 原因) 记录一行计数警告。
+        """
+        if not self._chunks:
+            return
+        for (field, reason), row in self.counts().iterrows():
+            parts = []
+            if row['participants']:
+                parts.append(f"{row['participants']} participants")
+            if row['sessions']:
+                parts.append(f"{row['sessions']} sessions")
+            logger.warning(f"Missing {field}: {', '.join(parts)} ({reason})")
+
+    def to_issues(self, bids_dir: Optional[Path] = None) -> pd.DataFrame:
+        """
+        转为 issues.tsv 的行（列 type、participant_id、session、issue）。
+
+        提供 bids_dir 时把 session 日期换成 session 目录名（找不到目录时保留日期）。
+        """
+        records = self.frame()
+        sessions = records['session']
+        if bids_dir is not None and (sessions != '').any():
+            subjects = records.loc[sessions != '', 'participant_id'].unique()
+            labels: Dict[tuple, str] = {
+                (participant_id, session_date): label
+                for participant_id in subjects
+                for session_date, label in session_labels(Path(bids_dir), participant_id).items()
+            }
+            sessions = pd.Series([
+                labels.get((participant_id, session), session)
+                for participant_id, session in zip(records['participant_id'], sessions)
+            ], index=records.index)
+        return pd.DataFrame({
+            'type': ISSUE_TYPE,
+            'participant_id': records['participant_id'],
+            'session': sessions,
+            'issue': 'Missing ' + records['field'] + ': ' + records['reason'],
+        })
+
+    def write_issues(self, issues_path: Path, bids_dir: Optional[Path] = None) -> int:
+        """
+        把全部记录一次性写入 issues.tsv，替换本次重算范围内上次写入的 "Missing …" 记录
+        （没有记录时只删除这些旧记录）。
+
+        返回:
+            int: 写入的记录数
+        """
+        issues = self.to_issues(bids_dir)
+
+        def stale(row) -> bool:
+            # 上次写入的 'Missing <field>: <reason>' 记录，且在本次重算的范围内
+            if len(row) != 4 or row[0] != ISSUE_TYPE or not row[3].startswith(ISSUE_PREFIX):
+                return False
+            field = row[3][len(ISSUE_PREFIX):].split(':', 1)[0]
+            return self.covers(row[1], field)
+
+        return replace_issues(issues_path, issues.itertuples(index=False, name=None), stale)
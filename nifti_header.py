@@ -0,0 +1,435 @@
+"""
+流式读取 NIfTI-1 / NIfTI-2 头信息（无需解压整个 .nii.gz）
+
+NIfTI 头固定位于文件开头：NIfTI-1 为 348 字节，NIfTI-2 为 540 字节。
+对 .nii.gz 文件只需解压 gzip 流的前 540 个字节即可得到图像尺寸、体素大小和仿射矩阵，
+无需像 nibabel 那样加载完整体数据。
+
+本模块供 organize_to_bids.py 及各类 QA 脚本共享使用。
+
+使用方法:
+    python nifti_header.py --bids_dir ./bids_data --output ./nifti_headers.tsv --workers 8
+"""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import math
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+# NIfTI-1 / NIfTI-2 头长度（sizeof_hdr 字段的合法取值）
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+# 每次从磁盘读取的压缩数据块大小（字节）
+# 头信息通常在第一个 1 KB 压缩块内即可解压完成
+_READ_CHUNK_SIZE = 1024
+
+# 计算体数据哈希时每次读取的（解压后）数据块大小
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# 少于该数量的文件直接串行读取（进程池启动开销大于收益）
+_MIN_FILES_FOR_POOL = 64
+
+
+class NiftiHeader(NamedTuple):
+    """
+    NIfTI 头信息的紧凑表示（只保留下游常用的字段）
+
+    字段:
+        path: 文件路径（字符串）
+        version: 1（NIfTI-1）或 2（NIfTI-2）
+        endian: '<'（小端）或 '>'（大端）
+        shape: 各维度大小，例如 (256, 256, 176)
+        voxel_sizes: 各空间/时间维度的体素尺寸，与 shape 一一对应（单位：mm / s）
+        datatype: NIfTI datatype 代码（如 4=int16, 16=float32）
+        bitpix: 每个体素的比特数
+        vox_offset: 体数据在（解压后）文件中的起始偏移（字节）
+        scl_slope: 强度缩放斜率
+        scl_inter: 强度缩放截距
+        qform_code: qform 坐标系代码
+        sform_code: sform 坐标系代码
+        affine: 4x4 体素→世界坐标仿射矩阵（嵌套元组，按行存储）
+    """
+    path: str
+    version: int
+    endian: str
+    shape: Tuple[int, ...]
+    voxel_sizes: Tuple[float, ...]
+    datatype: int
+    bitpix: int
+    vox_offset: int
+    scl_slope: float
+    scl_inter: float
+    qform_code: int
+    sform_code: int
+    affine: Tuple[Tuple[float, ...], ...]
+
+
+def read_header_bytes(path, n_bytes: int = NIFTI2_HEADER_SIZE) -> bytes:
+    """
+    读取文件开头的 n_bytes 个（解压后的）字节
+
+    对 .gz 文件使用 zlib 增量解压，且通过 max_length 限制输出长度，
+    因此只会解压头部所在的第一个压缩块，而不是整个体数据。
+
+    Args:
+        path: .nii 或 .nii.gz 文件路径
+        n_bytes: 需要的字节数（默认 540，足够容纳 NIfTI-2 头）
+
+    Returns:
+        bytes: 文件开头的字节（文件过短时可能少于 n_bytes）
+    """
+    path = Path(path)
+    with open(path, 'rb') as f:
+        if not path.name.endswith('.gz'):
+            return f.read(n_bytes)
+
+        # wbits = 16 + MAX_WBITS → 解析 gzip 头部和尾部
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        output = b''
+        while len(output) < n_bytes:
+            chunk = decompressor.unconsumed_tail or f.read(_READ_CHUNK_SIZE)
+            if not chunk:
+                break  # 文件结束（可能是截断的文件）
+            output += decompressor.decompress(chunk, n_bytes - len(output))
+            if decompressor.eof:
+                break
+        return output
+
+
+def _quaternion_affine(quatern_b, quatern_c, quatern_d,
+                       qoffset, pixdim) -> Tuple[Tuple[float, ...], ...]:
+    """
+    根据 qform 四元数参数计算仿射矩阵（NIfTI 标准方法 2）
+    """
+    b, c, d = quatern_b, quatern_c, quatern_d
+    # 四元数实部 a 由单位长度约束求得；数值误差可能导致负数，需截断到 0
+    a = math.sqrt(max(0.0, 1.0 - (b * b + c * c + d * d)))
+
+    rotation = (
+        (a * a + b * b - c * c - d * d, 2 * (b * c - a * d), 2 * (b * d + a * c)),
+        (2 * (b * c + a * d), a * a + c * c - b * b - d * d, 2 * (c * d - a * b)),
+        (2 * (b * d - a * c), 2 * (c * d + a * b), a * a + d * d - c * c - b * b),
+    )
+
+    # pixdim[0] 是 qfac（取值 ±1，0 视为 1），决定第三轴的方向
+    qfac = -1.0 if pixdim[0] < 0 else 1.0
+    scales = (pixdim[1], pixdim[2], pixdim[3] * qfac)
+
+    rows = []
+    for i in range(3):
+        rows.append(tuple(rotation[i][j] * scales[j] for j in range(3)) + (qoffset[i],))
+    rows.append((0.0, 0.0, 0.0, 1.0))
+    return tuple(rows)
+
+
+def _build_affine(qform_code, sform_code, srows, quatern, qoffset, pixdim):
+    """
+    按 NIfTI 规范的优先级选择仿射矩阵：sform > qform > 仅体素尺寸
+    """
+    if sform_code > 0:
+        return tuple(tuple(float(v) for v in row) for row in srows) + ((0.0, 0.0, 0.0, 1.0),)
+    if qform_code > 0:
+        return _quaternion_affine(*quatern, qoffset, pixdim)
+    # 方法 1（旧 ANALYZE 兼容）：只有体素缩放，无旋转和平移
+    return (
+        (pixdim[1], 0.0, 0.0, 0.0),
+        (0.0, pixdim[2], 0.0, 0.0),
+        (0.0, 0.0, pixdim[3], 0.0),
+        (0.0, 0.0, 0.0, 1.0),
+    )
+
+
+def parse_nifti_header(data: bytes, path: str = '') -> NiftiHeader:
+    """
+    将头部原始字节解析为 NiftiHeader
+
+    通过 sizeof_hdr 字段（348 / 540）同时判断 NIfTI 版本和字节序。
+
+    Args:
+        data: 文件开头的原始字节（至少 348 字节；NIfTI-2 需要 540 字节）
+        path: 文件路径，仅用于填充结果和错误信息
+
+    Returns:
+        NiftiHeader
+
+    Raises:
+        ValueError: 数据过短或不是合法的 NIfTI 头
+    """
+    if len(data) < 4:
+        raise ValueError(f"文件过短，无法读取 NIfTI 头: {path}")
+
+    version = None
+    endian = None
+    for candidate in ('<', '>'):
+        sizeof_hdr = struct.unpack(candidate + 'i', data[:4])[0]
+        if sizeof_hdr == NIFTI1_HEADER_SIZE:
+            version, endian = 1, candidate
+            break
+        if sizeof_hdr == NIFTI2_HEADER_SIZE:
+            version, endian = 2, candidate
+            break
+
+    if version is None:
+        raise ValueError(f"非法的 sizeof_hdr，不是 NIfTI 文件: {path}")
+
+    header_size = NIFTI1_HEADER_SIZE if version == 1 else NIFTI2_HEADER_SIZE
+    if len(data) < header_size:
+        raise ValueError(
+            f"NIfTI-{version} 头不完整（{len(data)}/{header_size} 字节）: {path}"
+        )
+
+    if version == 1:
+        dim = struct.unpack_from(endian + '8h', data, 40)
+        datatype, bitpix = struct.unpack_from(endian + '2h', data, 70)
+        pixdim = struct.unpack_from(endian + '8f', data, 76)
+        vox_offset, scl_slope, scl_inter = struct.unpack_from(endian + '3f', data, 108)
+        qform_code, sform_code = struct.unpack_from(endian + '2h', data, 252)
+        quatern_and_offset = struct.unpack_from(endian + '6f', data, 256)
+        srow_values = struct.unpack_from(endian + '12f', data, 280)
+    else:
+        datatype, bitpix = struct.unpack_from(endian + '2h', data, 12)
+        dim = struct.unpack_from(endian + '8q', data, 16)
+        pixdim = struct.unpack_from(endian + '8d', data, 104)
+        (vox_offset,) = struct.unpack_from(endian + 'q', data, 168)
+        scl_slope, scl_inter = struct.unpack_from(endian + '2d', data, 176)
+        qform_code, sform_code = struct.unpack_from(endian + '2i', data, 344)
+        quatern_and_offset = struct.unpack_from(endian + '6d', data, 352)
+        srow_values = struct.unpack_from(endian + '12d', data, 400)
+
+    # dim[0] 为维度数（1~7），其后依次是各维大小
+    ndim = dim[0]
+    if not 1 <= ndim <= 7:
+        raise ValueError(f"非法的 dim[0]={ndim}: {path}")
+
+    srows = (srow_values[0:4], srow_values[4:8], srow_values[8:12])
+    affine = _build_affine(
+        qform_code, sform_code, srows,
+        quatern_and_offset[0:3], quatern_and_offset[3:6], pixdim
+    )
+
+    return NiftiHeader(
+        path=str(path),
+        version=version,
+        endian=endian,
+        shape=tuple(int(v) for v in dim[1:ndim + 1]),
+        voxel_sizes=tuple(float(v) for v in pixdim[1:ndim + 1]),
+        datatype=int(datatype),
+        bitpix=int(bitpix),
+        vox_offset=int(vox_offset),
+        scl_slope=float(scl_slope),
+        scl_inter=float(scl_inter),
+        qform_code=int(qform_code),
+        sform_code=int(sform_code),
+        affine=affine,
+    )
+
+
+def read_nifti_header(path) -> NiftiHeader:
+    """
+    读取单个 .nii / .nii.gz 文件的头信息（只解压前 540 字节）
+
+    Args:
+        path: NIfTI 文件路径
+
+    Returns:
+        NiftiHeader
+
+    Raises:
+        OSError: 文件无法读取
+        zlib.error: gzip 流损坏
+        ValueError: 不是合法的 NIfTI 头
+    """
+    return parse_nifti_header(read_header_bytes(path), str(path))
+
+
+def expected_data_size(header: NiftiHeader) -> int:
+    """
+    根据头信息计算（解压后）文件的期望最小长度：vox_offset + 体数据字节数
+
+    Args:
+        header: NiftiHeader
+
+    Returns:
+        int: 期望的字节数
+    """
+    n_voxels = 1
+    for size in header.shape:
+        n_voxels *= max(size, 1)
+    return header.vox_offset + n_voxels * header.bitpix // 8
+
+
+def voxel_data_hash(path) -> str:
+    """
+    流式计算 NIfTI 体数据的内容哈希（SHA-256，恒定内存）
+
+    哈希的是解压后 vox_offset 之后的体数据（外加 shape/datatype/bitpix），
+    与 gzip 头中的时间戳、文件名以及压缩级别无关：同一次采集被 PACS 重复发送后
+    重新转换得到的 .nii.gz 即使压缩字节不同，哈希也相同。
+
+    Args:
+        path: .nii 或 .nii.gz 文件路径
+
+    Returns:
+        str: 十六进制哈希
+
+    Raises:
+        OSError / EOFError / zlib.error: 文件无法读取或 gzip 流损坏
+        ValueError: 不是合法的 NIfTI 头
+    """
+    path = Path(path)
+    opener = gzip.open if path.name.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        head = f.read(NIFTI2_HEADER_SIZE)
+        header = parse_nifti_header(head, str(path))
+
+        digest = hashlib.sha256()
+        digest.update(f"{header.shape}|{header.datatype}|{header.bitpix}|".encode())
+
+        # NIfTI-1 的 vox_offset 通常为 352，小于已读取的 540 字节
+        if header.vox_offset < len(head):
+            digest.update(head[header.vox_offset:])
+        else:
+            f.read(header.vox_offset - len(head))
+
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_header_safe(path: str) -> Tuple[str, Optional[NiftiHeader], Optional[str]]:
+    """
+    进程池工作函数：读取头信息，并把异常转换为错误字符串（避免单个坏文件中断整批扫描）
+    """
+    try:
+        return path, read_nifti_header(path), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def scan_nifti_headers(
+    paths: Iterable,
+    max_workers: Optional[int] = None,
+    chunksize: int = 32,
+    show_progress: bool = True
+) -> Tuple[Dict[str, NiftiHeader], Dict[str, str]]:
+    """
+    并行批量读取大量 NIfTI 文件的头信息
+
+    Args:
+        paths: 文件路径列表
+        max_workers: 进程数（None → CPU 核数；1 → 串行）
+        chunksize: 每次分发给子进程的文件数（越大调度开销越小）
+        show_progress: 是否显示 tqdm 进度条
+
+    Returns:
+        (headers, errors):
+            - headers: {路径字符串: NiftiHeader}
+            - errors: {路径字符串: 错误描述}
+    """
+    path_list = [str(p) for p in paths]
+    headers: Dict[str, NiftiHeader] = {}
+    errors: Dict[str, str] = {}
+
+    if max_workers == 1 or len(path_list) < _MIN_FILES_FOR_POOL:
+        results = map(_read_header_safe, path_list)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        results = executor.map(_read_header_safe, path_list, chunksize=chunksize)
+
+    try:
+        for path, header, error in tqdm(results, total=len(path_list),
+                                        desc=" 读取 NIfTI 头", disable=not show_progress):
+            if header is not None:
+                headers[path] = header
+            else:
+                errors[path] = error
+                logger.warning(f" 无法读取 NIfTI 头 {path}: {error}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info(f"读取 NIfTI 头完成: 成功 {len(headers)}, 失败 {len(errors)}")
+    return headers, errors
+
+
+def format_header_row(header: NiftiHeader, root: Optional[Path] = None) -> List[str]:
+    """
+    将 NiftiHeader 格式化为 TSV 的一行（维度/体素/仿射用 'x' 和 ',' 连接）
+    """
+    path = header.path
+    if root is not None:
+        path = os.path.relpath(header.path, root)
+    affine = ','.join(f"{v:.6g}" for row in header.affine[:3] for v in row)
+    return [
+        path,
+        str(header.version),
+        'x'.join(str(v) for v in header.shape),
+        'x'.join(f"{v:.6g}" for v in header.voxel_sizes),
+        str(header.datatype),
+        str(header.bitpix),
+        affine,
+    ]
+
+
+HEADER_TSV_COLUMNS = ['path', 'nifti_version', 'shape', 'voxel_sizes', 'datatype', 'bitpix', 'affine']
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description='批量读取BIDS目录下所有NIfTI文件的头信息（只解压文件头）'
+    )
+    parser.add_argument(
+        '--bids_dir',
+        type=str,
+        default='/home/xingwang/Dresden/bids_data',
+        help='BIDS数据集目录路径'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='nifti_headers.tsv',
+        help='输出TSV文件路径'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='并行进程数（默认: CPU核数）'
+    )
+
+    args = parser.parse_args()
+
+    bids_path = Path(args.bids_dir)
+    nifti_files = sorted(bids_path.rglob('*.nii.gz'))
+    logging.info(f" 共找到 {len(nifti_files)} 个 NIfTI 文件")
+
+    headers, errors = scan_nifti_headers(nifti_files, max_workers=args.workers)
+
+    with open(args.output, 'w', encoding='utf-8', newline='') as f:
+        f.write('\t'.join(HEADER_TSV_COLUMNS) + '\n')
+        for path in sorted(headers):
+            f.write('\t'.join(format_header_row(headers[path], bids_path)) + '\n')
+
+    logging.info(f"头信息已写入: {args.output}（失败 {len(errors)} 个）")
+
+
+if __name__ == "__main__":
+    main()
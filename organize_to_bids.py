@@ -22,10 +22,17 @@ import re
 import shutil
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 import logging
 
+from bids_index import build_bids_index
+from bids_issues import append_issues
+from nifti_header import voxel_data_hash
+from bids_sidecar import compact_sidecars, expand_sidecars, sidecar_path_for
+from session_reconciliation import load_session_corrections
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -148,17 +155,22 @@ def extract_subject_id_from_path(path):
     return None
 
 
-def build_session_mapping(input_path):
+def build_session_mapping(input_path, date_corrections=None):
     """
     扫描输入目录，为每个受试者的session建立编号映射
     
     Args:
         input_path: 输入根目录路径
+        date_corrections: 可选的 {(BIDS受试者ID, 目录日期): 更正日期} 映射
+                          （session_reconciliation.py 生成的 session_date_corrections.tsv，
+                          经 load_session_corrections 读取）；更正的 session 按采集日期编号和命名
         
     Returns:
         dict: {(subject_id, session_date): session_label} 映射
               例如: {("396_500000017", "20180212"): "01_20180212", ...}
+              键中的 session_date 始终是原始目录日期
     """
+    date_corrections = date_corrections or {}
     session_mapping = {}
     
     # 扫描所有受试者目录
@@ -176,20 +188,26 @@ def build_session_mapping(input_path):
     for subject_dir in subject_dirs:
         subject_id = subject_dir.name
         
-        # 收集该受试者的所有session日期
+        bids_subject_id = subject_id.replace('396_', '')  # 与组织文件时的 BIDS 受试者ID一致
+        
+        # 收集该受试者的所有session日期：(更正后的日期, 目录日期)
         session_dates = []
         for item in subject_dir.iterdir():
             if item.is_dir() and re.match(r'^\d{8}$', item.name):
-                session_dates.append(item.name)
+                corrected_date = date_corrections.get((bids_subject_id, item.name), item.name)
+                session_dates.append((corrected_date, item.name))
         
-        # 按日期排序（确保session编号按时间顺序）
+        # 按（更正后的）日期排序（确保session编号按时间顺序）
         session_dates.sort()
         
         # 为每个session分配编号（从01开始）
-        for idx, session_date in enumerate(session_dates, start=1):
-            session_label = f"{idx:02d}_{session_date}"  # 格式：01_20180212
+        for idx, (corrected_date, session_date) in enumerate(session_dates, start=1):
+            session_label = f"{idx:02d}_{corrected_date}"  # 格式：01_20180212
             session_mapping[(subject_id, session_date)] = session_label
-            logging.debug(f"  受试者 {subject_id}, session {session_date} → {session_label}")
+            if corrected_date != session_date:
+                logging.info(f"  受试者 {subject_id}, session {session_date} 按采集日期更正为 {session_label}")
+            else:
+                logging.debug(f"  受试者 {subject_id}, session {session_date} → {session_label}")
     
     logging.info(f"建立了 {len(session_mapping)} 个session映射")
     return session_mapping
@@ -213,13 +231,160 @@ def format_bids_filename(subject_id, session_label, modality):
     return f"{bids_subject}_{bids_session}_{modality}"
 
 
-def organize_to_bids(input_root, output_root):
+# 内容哈希缓存文件名（位于 BIDS 根目录，以 . 开头，BIDS 验证器会自动忽略）
+CONTENT_HASH_CACHE_FILENAME = '.content_hash_cache.tsv'
+
+
+def _hash_task(path_str):
+    """
+    进程池工作函数：计算单个 NIfTI 文件的体数据哈希，失败时返回 None
+    """
+    try:
+        return path_str, voxel_data_hash(path_str)
+    except Exception as e:
+        logging.warning(f" 无法计算内容哈希 {path_str}: {type(e).__name__}: {e}")
+        return path_str, None
+
+
+def compute_content_hashes(output_path, workers=None):
+    """
+    计算 BIDS 目录中所有 NIfTI 文件的体数据哈希（带缓存）
+    
+    缓存文件记录 (相对路径, size, mtime_ns, hash)，大小和修改时间都未变化的文件直接复用旧哈希
+    
+    Args:
+        output_path: BIDS根目录 (Path)
+        workers: 并行进程数 (None → CPU核数；1 → 串行)
+    
+    Returns:
+        dict: {相对路径: 哈希}
+    """
+    cache_path = output_path / CONTENT_HASH_CACHE_FILENAME
+    cache = {}
+    if cache_path.exists():
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            next(f, None)  # 跳过表头
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == 4:
+                    cache[parts[0]] = (parts[1], parts[2], parts[3])
+    
+    hashes = {}
+    stats = {}
+    pending = []
+    for nifti_file in sorted(output_path.glob('sub-*/ses-*/*/*.nii.gz')):
+        rel_path = nifti_file.relative_to(output_path).as_posix()
+        stat = nifti_file.stat()
+        stats[rel_path] = (str(stat.st_size), str(stat.st_mtime_ns))
+        cached = cache.get(rel_path)
+        if cached is not None and cached[:2] == stats[rel_path]:
+            hashes[rel_path] = cached[2]
+        else:
+            pending.append(str(nifti_file))
+    
+    logging.info(f"计算内容哈希: 复用缓存 {len(hashes)} 个, 待计算 {len(pending)} 个")
+    
+    if pending:
+        if workers == 1:
+            results = list(tqdm(map(_hash_task, pending), total=len(pending), desc=" 计算内容哈希"))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(tqdm(executor.map(_hash_task, pending, chunksize=4),
+                                    total=len(pending), desc=" 计算内容哈希"))
+        for path_str, digest in results:
+            if digest is not None:
+                hashes[Path(path_str).relative_to(output_path).as_posix()] = digest
+    
+    # 写回缓存（先写临时文件再原子替换）
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write("path\tsize\tmtime_ns\thash\n")
+        for rel_path in sorted(hashes):
+            size, mtime_ns = stats[rel_path]
+            f.write(f"{rel_path}\t{size}\t{mtime_ns}\t{hashes[rel_path]}\n")
+    os.replace(tmp_path, cache_path)
+    
+    return hashes
+
+
+def deduplicate_nifti_outputs(output_path, mode='report', workers=None):
+    """
+    检测内容完全相同的 NIfTI 文件（如 PACS 重复发送导致同一次采集出现在两个 session 日期下）
+    
+    内容哈希基于解压后的体数据，与 gzip 时间戳无关。每组重复文件中按路径排序的第一个视为原件：
+      - mode='report': 将重复记录写入 issues.tsv
+      - mode='link'  : 同一受试者内的重复文件替换为指向原件的硬链接（节省存储），并写入 issues.tsv；
+                       跨受试者的重复只报告不链接（通常意味着 ID 标注错误，需要人工核查）
+    
+    注意：同一个 raw 目录中同模态的重复文件在组织阶段已因目标文件已存在而被跳过
+    
+    Args:
+        output_path: BIDS根目录 (Path)
+        mode: 'report' 或 'link'
+        workers: 并行进程数
+    
+    Returns:
+        list: [(原件相对路径, 重复文件相对路径), ...]
+    """
+    hashes = compute_content_hashes(output_path, workers=workers)
+    
+    # 按哈希分组
+    groups = {}
+    for rel_path in sorted(hashes):
+        groups.setdefault(hashes[rel_path], []).append(rel_path)
+    
+    duplicates = []
+    issues = []
+    linked_count = 0
+    for digest, rel_paths in groups.items():
+        if len(rel_paths) < 2:
+            continue
+        original = rel_paths[0]
+        for duplicate in rel_paths[1:]:
+            duplicates.append((original, duplicate))
+            subject, session = duplicate.split('/')[:2]
+            same_subject = original.split('/')[0] == subject
+            
+            issues.append((
+                "specific",
+                subject,
+                session,
+                f"Duplicate NIfTI content: {duplicate} is identical to {original} (sha256 {digest[:12]})"
+            ))
+            
+            original_file = output_path / original
+            duplicate_file = output_path / duplicate
+            if mode == 'link' and same_subject and not os.path.samefile(original_file, duplicate_file):
+                # 先在临时路径创建硬链接，再原子替换，避免中断时丢失文件
+                tmp_link = duplicate_file.with_name(duplicate_file.name + '.tmp')
+                if tmp_link.exists():
+                    tmp_link.unlink()
+                os.link(original_file, tmp_link)
+                os.replace(tmp_link, duplicate_file)
+                linked_count += 1
+                logging.info(f" 硬链接重复文件: {duplicate} → {original}")
+    
+    append_issues(output_path / "issues.tsv", issues)
+    logging.info(f"重复检测完成: 发现 {len(duplicates)} 个重复文件, 建立硬链接 {linked_count} 个")
+    return duplicates
+
+
+def organize_to_bids(input_root, output_root, build_index=True, workers=None, sidecar_mode=None,
+                     dedup_mode=None, session_corrections=None):
     """
     将NIfTI文件组织为BIDS格式
     
     Args:
         input_root: 输入根目录 (包含转换后的NIfTI文件)
         output_root: 输出根目录 (BIDS格式数据集)
+        build_index: 是否在完成后生成数据集索引 bids_index.sqlite
+        workers: 生成索引时的并行进程数 (None → CPU核数)
+        sidecar_mode: None（不处理）、'compact'（公共键提升到根目录 T1w.json / FLAIR.json）
+                      或 'expand'（将根目录的公共键写回每个 sidecar）
+        dedup_mode: None（不检测）、'report'（重复文件写入 issues.tsv）
+                    或 'link'（同一受试者内的重复文件替换为硬链接并报告）
+        session_corrections: 可选的 session_date_corrections.tsv 路径（见 session_reconciliation.py），
+                             对应 session 按 MRI 采集日期命名
     """
     input_path = Path(input_root)
     output_path = Path(output_root)
@@ -315,7 +480,8 @@ def organize_to_bids(input_root, output_root):
 
     #  建立session编号映射（在处理文件之前）
     logging.info("正在扫描目录结构以建立session映射...")
-    session_mapping = build_session_mapping(input_path)
+    date_corrections = load_session_corrections(session_corrections) if session_corrections else None
+    session_mapping = build_session_mapping(input_path, date_corrections)
     
     #  批量扫描所有 .nii.gz 文件（递归搜索 input_path 下所有子目录）
     #    rglob('*.nii.gz') = recursive glob，确保不漏掉任何 NIfTI 文件
@@ -366,7 +532,8 @@ def organize_to_bids(input_root, output_root):
                 continue
             
             #  模态识别：双重保险策略（JSON > 文件名）
-            json_file = nifti_file.with_suffix('.json')  # 同名 .json 文件路径
+            #    注意：with_suffix('.json') 对 'x.nii.gz' 会得到 'x.nii.json'，需用 sidecar_path_for
+            json_file = sidecar_path_for(nifti_file)  # 同名 .json 文件路径
             modality = None
             
             # 1 优先从 dcm2niix 生成的 JSON sidecar 中识别（最可靠！）
@@ -445,6 +612,20 @@ def organize_to_bids(input_root, output_root):
             f.write("For more information about BIDS, visit: https://bids.neuroimaging.io/\n")  # ← 移除了末尾多余空格
         logging.info(f"创建README文件: {readme_path}")
 
+    # 基于体数据内容哈希检测重复的 NIfTI 文件
+    if dedup_mode:
+        deduplicate_nifti_outputs(output_path, mode=dedup_mode, workers=workers)
+
+    # 按 BIDS 继承原则压缩/展开 JSON sidecar（必须在生成索引之前，索引会按继承读取元数据）
+    if sidecar_mode == 'compact':
+        compact_sidecars(output_path)
+    elif sidecar_mode == 'expand':
+        expand_sidecars(output_path)
+
+    # 生成数据集索引（每个文件一行），供下游脚本直接读取而无需遍历目录
+    if build_index:
+        build_bids_index(output_path, max_workers=workers)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -462,6 +643,37 @@ def main():
         default='/home/xingwang/Dresden/bids_data',
         help='输出BIDS数据集目录路径'
     )
+    parser.add_argument(
+        '--skip_index',
+        action='store_true',
+        help='不生成数据集索引 (bids_index.sqlite)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='并行进程数 (默认: CPU核数)'
+    )
+    parser.add_argument(
+        '--sidecars',
+        choices=['compact', 'expand'],
+        default=None,
+        help='compact: 将各模态公共的sidecar字段提升到根目录T1w.json/FLAIR.json; '
+             'expand: 将根目录字段写回每个sidecar'
+    )
+    parser.add_argument(
+        '--dedup',
+        choices=['report', 'link'],
+        default=None,
+        help='检测内容相同的NIfTI文件: report: 写入issues.tsv; '
+             'link: 同一受试者内的重复文件替换为硬链接并写入issues.tsv'
+    )
+    parser.add_argument(
+        '--session_corrections',
+        type=str,
+        default=None,
+        help='session日期更正表 (session_reconciliation.py 生成的 session_date_corrections.tsv)'
+    )
     
     args = parser.parse_args()
     
@@ -469,7 +681,15 @@ def main():
     logging.info(f"输入目录: {args.input_dir}")
     logging.info(f"输出目录: {args.output_dir}")
     
-    organize_to_bids(args.input_dir, args.output_dir)
+    organize_to_bids(
+        args.input_dir,
+        args.output_dir,
+        build_index=not args.skip_index,
+        workers=args.workers,
+        sidecar_mode=args.sidecars,
+        dedup_mode=args.dedup,
+        session_corrections=args.session_corrections
+    )
     
     logging.info("BIDS组织完成！")
 
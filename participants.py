@@ -3,29 +3,65 @@
 Automated generation of participants.tsv from BIDS dataset and clinical data.
 """
 
+import argparse
+import json
 import os
 import re
+import sqlite3
+import threading
 import pandas as pd
 import logging
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
-# 配置日志记录：设置日志级别、格式和输出目标
-logging.basicConfig(
-    level=logging.INFO,  # 设置日志级别为 INFO，会记录 INFO 及以上级别的日志（如 WARNING、ERROR）
-    format='%(asctime)s - %(levelname)s - %(message)s',  # 日志格式：时间 - 日志级别 - 消息内容
-    handlers=[
-        logging.FileHandler('participants_generation.log', encoding='utf-8'),  # 将日志写入文件，使用 UTF-8 编码支持中文等字符
-        logging.StreamHandler()  # 同时将日志输出到控制台（标准输出）
-    ]
+from bids_index import (
+    INDEX_FILENAME, ensure_bidsignore, file_checksum, index_is_current, load_participants_sessions
+)
+from clinical_tables import ClinicalTable, ClinicalTableRegistry
+from missing_data import MissingDataLog
+from session_measures import (
+    BACKENDS, InstrumentSpec, SessionMeasures, build_session_frame, format_values, join_session_measures,
+    output_columns
 )
+from session_outputs import write_long_outputs
+from stage_metrics import StageRecorder
+
+# 日志配置见 configure_logging()（仅命令行运行时配置，作为库导入时不改动调用方的日志设置）
 logger = logging.getLogger(__name__)  # 获取当前模块的日志记录器，便于后续在代码中记录日志
 
-# 定义路径常量
+# 命令行的默认路径和配置（可用命令行参数覆盖；库调用见 generate_participants）
 BIDS_DATA_DIR = Path("/home/xingwang/Dresden_dataset/bids_data")      # BIDS 格式数据的根目录
 CLINICAL_DATA_DIR = Path("/home/xingwang/Dresden_dataset/raw/clinical_data")  # 原始临床数据所在目录
 OUTPUT_FILE = BIDS_DATA_DIR / "participants.tsv"  # 最终生成的 participants.tsv 文件路径（BIDS 规范要求）
+CLINICAL_CACHE_DIR = Path("/home/xingwang/Dresden_dataset/cache/clinical_tables")  # 临床 Excel 的 Parquet 缓存目录（None 表示不缓存）
+LOAD_WORKERS: Optional[int] = None  # 并行加载工作簿的进程数（None → min(工作簿数, CPU 核数)；1 → 串行）
+WRITE_LONG_OUTPUTS = True  # 是否同时写出长格式的 sessions.tsv、phenotype/*.tsv 和 Parquet（见 session_outputs.py）
+MEASURE_BACKEND = 'pandas'  # session 级量表的匹配实现：'pandas' 或 'polars'（需安装 polars，输出相同）
+INCREMENTAL_UPDATE = False  # 增量模式：只重算 session 列表变化的受试者和内容变化的工作簿对应的列
+STAGE_REPORT_FILE: Optional[Path] = None  # 各阶段耗时/内存报告（JSON；None 表示不写，--stage_report 不带路径时写到输出文件旁）
+WRITE_MISSING_ISSUES = True  # 是否把所有缺失数据记录写入 BIDS 根目录的 issues.tsv（见 missing_data.py）
+TRACE_STAGE_MEMORY = False  # 是否用 tracemalloc 统计各阶段的内存峰值（会使处理明显变慢，默认关闭）
+SHARD_COUNT = 1  # 按受试者分片的数量（>1 时各分片在进程池中分别计算，合并后按 participant_id 排序）
+SHARD_WORKERS: Optional[int] = None  # 分片计算的并行进程数（None → min(分片数, CPU 核数)；1 → 串行）
+
+# participants 表的输出格式（'tsv' 为 BIDS 的 participants.tsv；'parquet' 写到同名 .parquet 文件）
+OUTPUT_FORMATS = ('tsv', 'parquet')
+
+# 分片模式的部分输出文件名（多节点运行时每个节点写一个，再用 --merge_shards 合并）
+SHARD_FILENAME = 'participants.shard-{index:03d}-of-{count:03d}.tsv'
+# 各分片的缺失数据记录（列见 missing_data.MISSING_COLUMNS；合并时一并写入 issues.tsv）
+SHARD_MISSING_FILENAME = 'participants.shard-{index:03d}-of-{count:03d}.missing.tsv'
+
+# 增量模式的源指纹文件（与 participants.tsv 同目录；以 . 开头，BIDS 验证器会自动忽略）
+FINGERPRINT_FILENAME = '.participants_fingerprint.json'
+FINGERPRINT_VERSION = 3
+
+# sDOB 表中的出生日期列（Excel 日期单元格；文本形式为 dd.mm.yyyy）
+BIRTH_DATE_COLUMN = 'Study date of Birth (sDOB: 01.01.yyyy)'
+
+# 每回归年的天数（年龄 = 天数差 / DAYS_PER_YEAR）
+DAYS_PER_YEAR = 365.2425
 
 # 定义需要读取的 Excel 文件名映射字典
 # 键（key）表示数据类型或变量名，值（value）是对应的 Excel 文件名
@@ -38,129 +74,216 @@ EXCEL_FILES = {
     'education': 'Education_MSType.xlsx'           # 教育程度和多发性硬化类型（MS Type）信息
 }
 
+# 每个 Excel 文件中用于匹配受试者的 ID 列
+ID_COLUMNS = {
+    'sDOB': 'ID Dresden',
+    'sdmt': 'ID Dresden',
+    '9hpt': 'ID Dresden',
+    'edss': 'ID Dresden',
+    't25fw': 'ID Dresden',
+    'education': 'mpi'
+}
 
-def extract_date_from_timestamp(timestamp_str: str) -> Optional[str]:
-    """
-    从 Unix 时间戳中提取日期，返回格式为 YYYYMMDD 的字符串。
 
-    参数:
-        timestamp_str (str): Unix 时间戳（单位：秒），通常以字符串形式传入
 
-    返回:
-        str | None:
-            - 成功时返回 'YYYYMMDD'
-            - 输入非法或转换失败时返回 None
+def normalize_hand(values: pd.Series) -> pd.Series:
     """
-    try:
-        # 将时间戳字符串转换为整数
-        # 如果 timestamp_str 不是纯数字，会抛出 ValueError
-        timestamp = int(timestamp_str)
+    将 'Dominant Hand' / 'Hand Used' 标准化为小写去空格的字符串（空值为 ''）。
+    """
+    return values.astype(str).str.strip().str.lower().where(values.notna(), '')
 
-        # 将 Unix 时间戳转换为 datetime 对象（本地时间）
-        dt = datetime.fromtimestamp(timestamp)
 
-        # 将 datetime 格式化为 YYYYMMDD 字符串
-        return dt.strftime('%Y%m%d')
+def aggregate_9hpt_trials(candidates: pd.DataFrame) -> pd.DataFrame:
+    """
+    将同一受试者同一天的多条 9HPT 记录合并为一条（InstrumentSpec.aggregate）。
 
-    except (ValueError, TypeError):
-        # 捕获：
-        # - ValueError：无法将字符串转换为整数
-        # - TypeError：timestamp_str 为 None 或类型不正确
-        return None
+    9HPT 导出表每次评估有两行（左手、右手各一行，Left/Right Hand Time 在两行中相同），
+    同一天还可能做了多次评估。'Hand Used' 与 'Dominant Hand' 一致且为 'left'/'right'
+    的行是有效试次：同一天所有有效试次的左右手时间取平均，利手取第一个有效试次的利手。
+    没有有效试次的日期保留第一条记录（其 dom/ndom 为空）。
 
+    参数:
+        candidates (pd.DataFrame): 列为 _id、_date、dominant_hand、hand_used、left_time、right_time
 
-def extract_date_from_datetime(datetime_str: str) -> Optional[str]:
+    返回:
+        pd.DataFrame: 同样的列，每个 (_id, _date) 一行
+    """
+    keys = ['_id', '_date']
+    dominant = normalize_hand(candidates['dominant_hand'])
+    valid = (dominant == normalize_hand(candidates['hand_used'])) & dominant.isin(['left', 'right'])
+
+    averaged = pd.DataFrame({
+        '_id': candidates['_id'],
+        '_date': candidates['_date'],
+        'dominant_hand': dominant,
+        'left_time': pd.to_numeric(candidates['left_time'], errors='coerce'),
+        'right_time': pd.to_numeric(candidates['right_time'], errors='coerce'),
+    }).loc[valid].groupby(keys, sort=False).agg(
+        dominant_hand=('dominant_hand', 'first'),
+        left_time=('left_time', 'mean'),
+        right_time=('right_time', 'mean'),
+    ).reset_index()
+    averaged['hand_used'] = averaged['dominant_hand']
+
+    first = candidates.drop_duplicates(keys, keep='first')
+    has_valid = pd.MultiIndex.from_frame(first[keys]).isin(pd.MultiIndex.from_frame(averaged[keys]))
+    return pd.concat([averaged, first.loc[~has_valid]], ignore_index=True)[list(candidates.columns)]
+
+
+def resolve_9hpt_hands(matched: pd.DataFrame) -> pd.DataFrame:
     """
-    从 datetime 字符串中提取日期，返回格式为 YYYYMMDD。
+    由匹配到的 9HPT 记录计算每个 session 的优势手/非优势手时间和利手（整列向量化）。
 
-    支持的输入格式包括：
-    1) 'Tue, 15 Aug 2017 09:11:07 +0000'
-    2) 'YYYY-MM-DD'
+    只有当 'Hand Used' 与 'Dominant Hand' 一致且为 'left'/'right' 时，
+    才认为本次测试提供了有效的 dom/ndom 配对数据；否则两者都为空。
 
     参数:
-        datetime_str (str): datetime 字符串
+        matched (pd.DataFrame): 列为 dominant_hand、hand_used、left_time、right_time
+            （未匹配的 session 为 NaN）
 
     返回:
-        str | None:
-            - 成功时返回 'YYYYMMDD'
-            - 解析失败或输入非法时返回 None
+        pd.DataFrame: 列为 9hpt_dom、9hpt_ndom、handedness（均为字符串）
     """
-    try:
-        # 第一种尝试：
-        # 处理格式如 'Tue, 15 Aug 2017 09:11:07 +0000'
-        # 由于格式串不包含时区信息 (+0000)，
-        # 先通过 split(' +') 去掉时区部分
-        dt = datetime.strptime(
-            datetime_str.split(' +')[0],
-            '%a, %d %b %Y %H:%M:%S'
-        )
+    dominant = normalize_hand(matched['dominant_hand'])
+    consistent = dominant == normalize_hand(matched['hand_used'])
+    # 左手是优势手 → left_time 为 dom，right_time 为 ndom；右手反之
+    left_dominant = consistent & (dominant == 'left')
+    right_dominant = consistent & (dominant == 'right')
+    left_time = format_values(matched['left_time'])
+    right_time = format_values(matched['right_time'])
+
+    return pd.DataFrame({
+        '9hpt_dom': right_time.where(right_dominant, left_time.where(left_dominant, '')),
+        '9hpt_ndom': left_time.where(right_dominant, right_time.where(left_dominant, '')),
+        'handedness': dominant.where(left_dominant | right_dominant, ''),
+    }, index=matched.index)
+
+
+# session 级临床量表：评估日期与 MRI session 日期为同一天时取值（见 session_measures.py）
+INSTRUMENTS = {
+    'sdmt': InstrumentSpec(
+        key='sdmt', file=EXCEL_FILES['sdmt'], id_column=ID_COLUMNS['sdmt'],
+        date_column='Assessment Started At', date_parser='rfc2822',
+        value_columns={'sdmt': 'Total Number Correct'}
+    ),
+    '9hpt': InstrumentSpec(
+        key='9hpt', file=EXCEL_FILES['9hpt'], id_column=ID_COLUMNS['9hpt'],
+        date_column='Assessment Started At', date_parser='rfc2822',
+        value_columns={
+            'dominant_hand': 'Dominant Hand',
+            'hand_used': 'Hand Used',
+            'left_time': 'Left Hand Time',
+            'right_time': 'Right Hand Time',
+        },
+        derive=resolve_9hpt_hands,
+        derived_columns=('9hpt_dom', '9hpt_ndom', 'handedness'),
+        aggregate=aggregate_9hpt_trials,
+        participant_columns=('handedness',)
+    ),
+    'edss': InstrumentSpec(
+        key='edss', file=EXCEL_FILES['edss'], id_column=ID_COLUMNS['edss'],
+        date_column='Visitdate', date_parser='day_first',
+        value_columns={'edss': 'scoreEdss'}
+    ),
+    't25fw': InstrumentSpec(
+        key='t25fw', file=EXCEL_FILES['t25fw'], id_column=ID_COLUMNS['t25fw'],
+        date_column='Assessment Started At', date_parser='rfc2822',
+        value_columns={'t25fw': 'Walk Duration'}
+    ),
+    'education': InstrumentSpec(
+        key='education', file=EXCEL_FILES['education'], id_column=ID_COLUMNS['education'],
+        date_column='encdate', date_parser='unix_seconds',
+        value_columns={'education': 'educ'}
+    ),
+}
+
+# 每个 Excel 文件的评估日期列及其解析器（见 clinical_tables.DATE_PARSERS），
+# 建表时一次性解析为标准化的 assessment_date 列
+DATE_COLUMNS = {
+    key: (spec.date_column, spec.date_parser) for key, spec in INSTRUMENTS.items()
+}
 
-        # 将 datetime 转换为 YYYYMMDD 格式
-        return dt.strftime('%Y%m%d')
+# 每个 Excel 文件实际需要读取的列（其余列在加载时直接跳过，以降低内存和解析时间）
+TABLE_COLUMNS = {
+    'sDOB': [
+        ID_COLUMNS['sDOB'],
+        BIRTH_DATE_COLUMN,
+        'Gender',
+        'Date of Diagnosis (year)'
+    ],
+    **{
+        key: list(dict.fromkeys(
+            [spec.id_column, spec.date_column] + list(spec.value_columns.values())
+        ))
+        for key, spec in INSTRUMENTS.items()
+    }
+}
 
-    except (ValueError, AttributeError):
-        try:
-            # 第二种尝试：
-            # 处理简单日期格式 'YYYY-MM-DD'
-            dt = datetime.strptime(datetime_str, '%Y-%m-%d')
+# 最近访视匹配窗口：量表键 → (容差天数, 方向)，方向为 'nearest' / 'backward' / 'forward'
+# 例如 {'edss': (30, 'nearest'), 'sdmt': (14, 'backward')}。
+# 未列出的量表只接受与 session 同一天的评估；列出的量表会额外输出 <key>_offset_days 列
+MATCH_WINDOWS: Dict[str, Tuple[int, str]] = {}
 
-            # 转换为 YYYYMMDD
-            return dt.strftime('%Y%m%d')
+# 按临床数据目录缓存的表注册中心（同一目录下的工作簿在一次运行中只加载一次）：
+# 目录 → (注册中心, 创建时各工作簿的 (大小, mtime_ns))；工作簿变化后重新创建
+_TABLE_REGISTRIES: Dict[Path, Tuple[ClinicalTableRegistry, Dict[str, Optional[Tuple[int, int]]]]] = {}
+_TABLE_REGISTRIES_LOCK = threading.Lock()
 
-        except (ValueError, AttributeError):
-            # 所有解析方式都失败，返回 None
-            return None
+# get_table_registry 未指定 cache_dir 时：沿用已有注册中心的缓存目录，新建时使用 CLINICAL_CACHE_DIR
+_KEEP_CACHE_DIR = object()
 
 
-def extract_date_from_visitdate(visitdate_str: str) -> Optional[str]:
+def parse_birth_dates(values: pd.Series) -> pd.Series:
     """
-    从访问日期字符串中提取日期，并统一格式为 yyyymmdd。
-    输入示例: '14/10/2021'
-    输出示例: '20211014'
+    将出生日期列解析为 datetime64（Excel 日期单元格直接使用；文本按 dd.mm.yyyy 解析，
+    不符合时再按通用格式解析）；无法解析的值为 NaT。
     """
-    try:
-        # 按照 日/月/年 (dd/mm/yyyy) 的格式解析字符串为 datetime 对象
-        dt = datetime.strptime(visitdate_str, '%d/%m/%Y')
-
-        # 将 datetime 对象格式化为 yyyymmdd 字符串
-        return dt.strftime('%Y%m%d')
-
-    except (ValueError, AttributeError):
-        # 如果格式不匹配或输入不是字符串，则返回 None
-        return None
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('datetime64[ns]')
+    parsed = pd.to_datetime(values.astype(str).str.strip(), format='%d.%m.%Y', errors='coerce')
+    pending = parsed.isna() & values.notna()
+    if pending.any():
+        parsed[pending] = pd.to_datetime(values[pending].astype(str), format='mixed', errors='coerce')
+    return parsed.astype('datetime64[ns]')
+
+
+def compute_session_ages(
+    participants: Dict[str, List[str]],
+    participant_ids: List[str],
+    table: ClinicalTable
+) -> pd.DataFrame:
+    """
+    一次性计算所有 (受试者, session) 的年龄（单位：年，float）。
 
+    年龄 = (session 日期 - 出生日期) 的天数 / DAYS_PER_YEAR；出生日期取 sDOB 表中该受试者的第一行。
 
+    参数:
+        participants (Dict[str, List[str]]): participant_id → session 日期列表
+        participant_ids (List[str]): 输出行顺序
+        table (ClinicalTable): sDOB 表
 
-def calculate_age(dob_str: str, session_date: str) -> Optional[float]:
-    """
-    根据出生日期和 session 日期计算年龄（单位：年）。
-    
-    参数：
-    - dob_str: 出生日期字符串，格式 dd.mm.yyyy（如 '15.08.1995'）
-    - session_date: session 日期字符串，格式 yyyymmdd（如 '20211014'）
-    
-    返回：
-    - 年龄（float，单位：年），或 None（解析失败时）
+    返回:
+        pd.DataFrame: build_session_frame 的长表，另有 in_table（受试者是否在 sDOB 表中）、
+            birth_date（datetime64，缺失或无法解析时为 NaT）和 age（float，无法计算时为 NaN）
     """
-    try:
-        # 解析出生日期（格式：日.月.年）
-        dob = datetime.strptime(dob_str, '%d.%m.%Y')
+    sessions = build_session_frame(participants, participant_ids)
 
-        # 解析 session 日期（格式：年月日）
-        session_dt = datetime.strptime(session_date, '%Y%m%d')
+    first_rows = ~table.normalized_ids.duplicated()
+    birth_dates = pd.Series(
+        parse_birth_dates(table.df.loc[first_rows.to_numpy(), BIRTH_DATE_COLUMN]).to_numpy(),
+        index=table.normalized_ids[first_rows].to_numpy()
+    )
+    sessions['in_table'] = sessions['numeric_id'].isin(birth_dates.index)
+    sessions['birth_date'] = sessions['numeric_id'].map(birth_dates).astype('datetime64[ns]')
+    sessions['age'] = (sessions['session_ts'] - sessions['birth_date']).dt.days / DAYS_PER_YEAR
+    return sessions
 
-        # 计算出生日期到 session 日期之间的天数差
-        days_diff = (session_dt - dob).days
 
-        # 将天数转换为年龄（年）
-        # 使用 365.2425 天/年（回归年），更符合科研计算标准
-        age = days_diff / 365.2425
-
-        return age
-
-    except (ValueError, AttributeError):
-        # 如果日期格式不正确或输入为空，则返回 None
-        return None
+def format_ages(ages: pd.Series) -> pd.Series:
+    """
+    将年龄格式化为两位小数的字符串（NaN 为 ''），用于写入 participants.tsv。
+    """
+    return ages.map('{:.2f}'.format).where(ages.notna(), '')
 
 
 
@@ -181,14 +304,26 @@ def get_participants_and_sessions(bids_dir: Path) -> Dict[str, List[str]]:
         logger.error(f"BIDS data directory does not exist: {bids_dir}")
         return participants
 
+    # 优先读取 organize_to_bids.py 生成的数据集索引（无需遍历所有 session 目录）；
+    # 索引生成后新增/删除过受试者或 session 目录时索引已过期，改为遍历目录
+    if (bids_dir / INDEX_FILENAME).exists() and not index_is_current(bids_dir):
+        logger.info(f"{INDEX_FILENAME} does not match the BIDS session directories, scanning directories instead")
+    elif (bids_dir / INDEX_FILENAME).exists():
+        try:
+            participants = load_participants_sessions(bids_dir)
+            logger.info(f"Found {len(participants)} participants (from {INDEX_FILENAME})")
+            return participants
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read {INDEX_FILENAME}, falling back to directory scan: {e}")
+
     # 匹配 sub-<subject_id> 目录（只允许数字 ID）
     sub_pattern = re.compile(r'^sub-(\d+)$')
 
     # 匹配 ses-<序号>_<日期> 目录，如 ses-01_20211014
     ses_pattern = re.compile(r'^ses-(\d+)_(\d{8})$')
 
-    # 遍历 BIDS 根目录下的所有条目
-    for item in bids_dir.iterdir():
+    # 遍历 BIDS 根目录下的所有条目（按名称排序，受试者顺序与索引中的一致，不依赖文件系统的列出顺序）
+    for item in sorted(bids_dir.iterdir(), key=lambda path: path.name):
         # 只处理目录
         if not item.is_dir():
             continue
@@ -217,41 +352,68 @@ def get_participants_and_sessions(bids_dir: Path) -> Dict[str, List[str]]:
 
 
 
-def load_excel_file(file_path: Path) -> Optional[pd.DataFrame]:
+def workbook_signature(clinical_data_dir: Path) -> Dict[str, Optional[Tuple[int, int]]]:
+    """
+    返回各工作簿的 (大小, mtime_ns)（文件不存在为 None），用于判断已加载的表是否过期。
     """
-    从指定路径加载 Excel 文件，并返回对应的 pandas DataFrame。
+    signature = {}
+    for key, file_name in EXCEL_FILES.items():
+        try:
+            stat = (Path(clinical_data_dir) / file_name).stat()
+            signature[key] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            signature[key] = None
+    return signature
+
+
+def get_table_registry(clinical_data_dir: Path, cache_dir=_KEEP_CACHE_DIR) -> ClinicalTableRegistry:
+    """
+    获取（必要时创建）某个临床数据目录对应的表注册中心。
+    
+    所有字段处理函数共享同一个注册中心：sDOB 表被 age / sex / is_ms 三个函数使用，
+    但只会被解析一次。任一工作簿的大小或修改时间变化、或指定了不同的 cache_dir 时，
+    旧注册中心（及其已加载的表）被丢弃并重新创建，因此长期运行的进程不会用到过期的表。
     
     参数:
-        file_path (Path): 要加载的 Excel 文件的路径（应为 pathlib.Path 对象）。
+        clinical_data_dir (Path): 临床数据目录
+        cache_dir (Path 或 None, 可选): Parquet 缓存目录（None 表示不缓存）；
+            不指定时沿用已有注册中心的缓存目录，新建时使用 CLINICAL_CACHE_DIR
     
     返回:
-        pd.DataFrame 或 None: 
-            - 如果文件存在且成功读取，返回包含数据的 DataFrame；
-            - 如果文件不存在或读取过程中出错，返回 None。
-    """
-    # 检查文件是否存在
-    if not file_path.exists():
-        # 如果文件不存在，记录一条警告日志，并返回 None
-        logger.warning(f"Excel file not found: {file_path}")
-        return None
-    
-    try:
-        # 使用 pandas 读取 Excel 文件（支持 .xls 和 .xlsx）
-        df = pd.read_excel(file_path)
-        
-        # 记录成功加载的日志，包括文件名和行数，便于调试和监控
-        logger.info(f"Loaded {file_path.name}: {len(df)} rows")
-        
-        # 返回读取到的数据框
-        return df
-    
-    except Exception as e:
-        # 捕获所有可能的异常（如文件损坏、格式错误、缺少依赖库等）
-        # 记录错误日志，包含具体的异常信息，便于排查问题
-        logger.error(f"Error loading {file_path}: {e}")
-        
-        # 出错时返回 None，避免程序崩溃
-        return None
+        ClinicalTableRegistry: 该目录的表注册中心
+    """
+    key = Path(clinical_data_dir).resolve()
+    signature = workbook_signature(key)
+    with _TABLE_REGISTRIES_LOCK:
+        entry = _TABLE_REGISTRIES.get(key)
+        if entry is not None:
+            registry, previous_signature = entry
+            same_cache = cache_dir is _KEEP_CACHE_DIR or registry.cache_dir == (
+                Path(cache_dir) if cache_dir is not None else None
+            )
+            if previous_signature == signature and same_cache:
+                return registry
+            if cache_dir is _KEEP_CACHE_DIR:
+                cache_dir = registry.cache_dir
+            if previous_signature != signature:
+                logger.info(f"Clinical workbooks in {key} changed, reloading tables")
+        elif cache_dir is _KEEP_CACHE_DIR:
+            cache_dir = CLINICAL_CACHE_DIR
+        registry = ClinicalTableRegistry(
+            key, EXCEL_FILES, ID_COLUMNS, DATE_COLUMNS,
+            cache_dir=cache_dir, columns=TABLE_COLUMNS
+        )
+        _TABLE_REGISTRIES[key] = (registry, signature)
+        return registry
+
+
+def clear_table_registries():
+    """
+    清空已缓存的表注册中心（get_table_registry 会自动重新加载变化的工作簿，
+    这里用于释放内存或强制重新加载）。
+    """
+    with _TABLE_REGISTRIES_LOCK:
+        _TABLE_REGISTRIES.clear()
 
 
 def get_participant_id_from_dresden_id(dresden_id: str) -> str:
@@ -350,19 +512,19 @@ def process_session_field(participants: Dict[str, List[str]], df: pd.DataFrame)
 def process_age_field(
     participants: Dict[str, List[str]], 
     df: pd.DataFrame, 
-    clinical_data_dir: Path
+    clinical_data_dir: Path,
+    missing_log: Optional[MissingDataLog] = None
 ) -> pd.DataFrame:
     """
     为 DataFrame 添加 'age' 列，表示每个参与者在每次会话时的年龄。
     
     年龄通过以下步骤计算：
       1. 从临床数据目录中读取包含出生日期（sDOB）的 Excel 文件；
-      2. 根据 participant_id（如 'sub-5000017'）匹配 Excel 中的 'ID Dresden' 列；
-      3. 获取该参与者的出生日期；
-      4. 对该参与者拥有的每一个 session_date，调用 calculate_age 计算当时年龄；
-      5. 多个年龄值用逗号连接（与 session 列一一对应）。
+      2. 将所有 (participant_id, session_date) 展开为长表，按 'ID Dresden' 连接出生日期；
+      3. 用 compute_session_ages 对整列 datetime64 一次性计算年龄（float）；
+      4. 写入时才格式化为两位小数，多个年龄值用逗号连接（与 session 列一一对应）。
     
-    如果无法获取出生日期或计算失败，则对应位置填空字符串 ''。
+    如果无法获取出生日期，则对应位置填空字符串 ''。
     
     参数:
         participants (Dict[str, List[str]]): 
@@ -371,93 +533,50 @@ def process_age_field(
             当前 DataFrame，必须包含 'participant_id' 列
         clinical_data_dir (Path): 
             临床数据所在目录路径，用于定位 Excel 文件
+        missing_log (MissingDataLog, 可选): 
+            收集缺失记录（不提供时在函数结束时记录计数警告）
     
     返回:
         pd.DataFrame: 添加了 'age' 列的更新版 DataFrame
     """
+    log = missing_log if missing_log is not None else MissingDataLog()
     
-    # 构建出生日期 Excel 文件的完整路径
-    # EXCEL_FILES['sDOB'] 应该是一个文件名，如 "sDOB_data.xlsx"
-    excel_path = clinical_data_dir / EXCEL_FILES['sDOB']
-    
-    # 安全加载 Excel 文件（若文件不存在或读取出错，load_excel_file 会返回 None）
-    excel_df = load_excel_file(excel_path)
+    # 从共享的表注册中心获取 sDOB 表（每个工作簿每次运行最多解析一次）
+    table = get_table_registry(clinical_data_dir).get('sDOB')
     
     # 如果 Excel 文件加载失败（None），则所有 age 字段设为空字符串，并返回
-    if excel_df is None:
+    if table is None:
         df['age'] = ''  # 为所有行添加空 age 列
+        log.add('age', 'sDOB workbook could not be loaded', df['participant_id'])
+        if missing_log is None:
+            log.log_summary()
         return df
     
-    # 初始化两个列表：
-    # - ages: 存储每个 participant_id 对应的年龄字符串（可能含多个，用逗号分隔）
-    # - missing_age_participants: 记录哪些参与者缺失年龄信息，用于日志警告
-    ages = []
-    missing_age_participants = []
-    
-    # 遍历 DataFrame 中的每一个 participant_id
-    for participant_id in df['participant_id']:
-        # 从 BIDS 格式的 ID（如 'sub-5000017'）中提取纯数字部分 '5000017'
-        numeric_id = participant_id.replace('sub-', '')
-        
-        # 在 Excel 数据中查找 'ID Dresden' 列等于 numeric_id 的行
-        # 注意：先将该列转为字符串并去除空格，确保匹配鲁棒性
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
-        
-        # 如果找不到匹配的行，说明该参与者在临床数据中无记录
-        if matching_rows.empty:
-            ages.append('')  # 年龄留空
-            missing_age_participants.append(participant_id)
-            continue  # 跳过后续处理
-        
-        # 从匹配的第一行中提取出生日期字段
-        # 字段名是：'Study date of Birth (sDOB: 01.01.yyyy)'
-        dob_value = matching_rows.iloc[0]['Study date of Birth (sDOB: 01.01.yyyy)']
-        
-        # 检查出生日期是否为空或 NaN
-        if pd.isna(dob_value) or dob_value == '':
-            ages.append('')
-            missing_age_participants.append(participant_id)
-            continue
-        
-        # 获取该参与者的所有会话日期（来自 participants 字典）
-        session_dates = participants[participant_id]
-        age_values = []  # 用于存储本次参与者各会话对应的年龄字符串
-        
-        # 对每个会话日期，计算当时的年龄
-        for session_date in session_dates:
-            # 调用外部函数 calculate_age（需已实现），传入出生日期和会话日期
-            # 假设 session_date 是字符串格式（如 '20231005' 或 '2023-10-05'）
-            age = calculate_age(str(dob_value), session_date)
-            
-            if age is not None:
-                # 保留两位小数，转为字符串（如 "25.34"）
-                age_values.append(f"{age:.2f}")
-            else:
-                # 如果计算失败（如日期格式无效），填空字符串
-                age_values.append('')
-        
-        # 将该参与者的所有年龄值用逗号连接，形成一个字符串
-        # 例如：['25.34', '26.12'] → "25.34,26.12"
-        ages.append(','.join(age_values))
-        
-        # 如果所有年龄都为空（即 age_values 全是空字符串），则视为缺失
-        if all(not v for v in age_values):
-            missing_age_participants.append(participant_id)
+    # 每个 (受试者, session) 一行，age 为 float（无法计算时为 NaN）
+    sessions = compute_session_ages(participants, list(df['participant_id']), table)
     
-    # 将生成的 ages 列添加到 DataFrame 中
-    df['age'] = ages
+    # 格式化后按受试者用逗号拼接（受试者的 session 顺序不变），例如 "25.34,26.12"
+    packed = format_ages(sessions['age']).groupby(sessions['participant_id'], sort=False).agg(','.join)
+    df['age'] = packed.reindex(df['participant_id']).fillna('').to_numpy()
     
-    # 如果有参与者缺失年龄信息，记录警告日志
-    if missing_age_participants:
-        logger.warning(f"Missing age for participants: {missing_age_participants}")
+    # 批量记录缺失信息（受试者级）
+    per_participant = sessions.drop_duplicates('participant_id')
+    not_in_table = ~per_participant['in_table']
+    no_birth_date = per_participant['in_table'] & per_participant['birth_date'].isna()
+    log.add('age', 'not in sDOB workbook', per_participant.loc[not_in_table, 'participant_id'])
+    log.add('age', 'no valid date of birth in sDOB workbook', per_participant.loc[no_birth_date, 'participant_id'])
+    if missing_log is None:
+        log.log_summary()
     
     # 返回更新后的 DataFrame
     return df
 
 
-def process_sex_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFrame:
+def process_sex_field(
+    df: pd.DataFrame,
+    clinical_data_dir: Path,
+    missing_log: Optional[MissingDataLog] = None
+) -> pd.DataFrame:
     """
     为 DataFrame 添加 'sex' 列，表示每位参与者的性别信息。
     
@@ -475,20 +594,21 @@ def process_sex_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFrame
         pd.DataFrame: 添加了 'sex' 列的更新版 DataFrame
     """
     
-    # 构建临床 Excel 文件的完整路径（此处复用 sDOB 文件，因其通常包含 Gender 列）
-    excel_path = clinical_data_dir / EXCEL_FILES['sDOB']
-    
-    # 安全加载 Excel 文件；若失败（文件缺失/损坏），返回带空 sex 列的 df
-    excel_df = load_excel_file(excel_path)
+    # 从共享的表注册中心获取 sDOB 表（每个工作簿每次运行最多解析一次）
+    table = get_table_registry(clinical_data_dir).get('sDOB')
+    log = missing_log if missing_log is not None else MissingDataLog()
     
-    if excel_df is None:
+    if table is None:
         # 如果无法加载 Excel，所有参与者的 sex 设为空字符串
         df['sex'] = ''
+        log.add('sex', 'sDOB workbook could not be loaded', df['participant_id'])
+        if missing_log is None:
+            log.log_summary()
         return df
     
     # 初始化列表：用于存储每个 participant_id 对应的性别值
     sexes = []
-    missing_sex_participants = []  # 记录缺失性别的参与者 ID，用于日志
+    not_in_table, no_gender = [], []  # 记录缺失性别的参与者 ID（按原因）
     
     # 遍历 DataFrame 中的每一个 participant_id
     for participant_id in df['participant_id']:
@@ -496,15 +616,13 @@ def process_sex_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFrame
         numeric_id = participant_id.replace('sub-', '')
         
         # 在 Excel 数据中查找 'ID Dresden' 列匹配 numeric_id 的行
-        # 注意：将该列转为字符串并去除首尾空格，提高匹配鲁棒性
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
+        # 通过预先建立的 ID 索引 O(1) 取行（ID 列已在建表时统一标准化）
+        matching_rows = table.rows_for(numeric_id)
         
         # 如果没有找到匹配行，说明该参与者在临床数据中无记录
         if matching_rows.empty:
             sexes.append('')  # 性别留空
-            missing_sex_participants.append(participant_id)
+            not_in_table.append(participant_id)
             continue  # 跳过后续处理
         
         # 从匹配的第一行中提取 'Gender' 列的值
@@ -513,7 +631,7 @@ def process_sex_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFrame
         # 检查性别值是否为空或 NaN
         if pd.isna(gender_value) or gender_value == '':
             sexes.append('')
-            missing_sex_participants.append(participant_id)
+            no_gender.append(participant_id)
         else:
             # 将性别值转为字符串，去除首尾空格，并统一转为小写
             # 例如：'Male' → 'male'，' FEMALE ' → 'female'
@@ -523,15 +641,21 @@ def process_sex_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFrame
     # 将生成的性别列表作为新列 'sex' 添加到 DataFrame 中
     df['sex'] = sexes
     
-    # 如果存在缺失性别的参与者，记录警告日志以便后续排查
-    if missing_sex_participants:
-        logger.warning(f"Missing sex for participants: {missing_sex_participants}")
+    # 批量记录缺失性别的参与者，以便后续排查
+    log.add('sex', 'not in sDOB workbook', not_in_table)
+    log.add('sex', 'no gender in sDOB workbook', no_gender)
+    if missing_log is None:
+        log.log_summary()
     
     # 返回更新后的 DataFrame
     return df
 
 
-def process_is_ms_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFrame:
+def process_is_ms_field(
+    df: pd.DataFrame,
+    clinical_data_dir: Path,
+    missing_log: Optional[MissingDataLog] = None
+) -> pd.DataFrame:
     """
     为 DataFrame 添加 'is_ms' 列，用于标记参与者是否患有多发性硬化症（Multiple Sclerosis, MS）。
     
@@ -552,22 +676,23 @@ def process_is_ms_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFra
         pd.DataFrame: 添加了 'is_ms' 列的更新版 DataFrame
     """
     
-    # 构建临床 Excel 文件的完整路径（复用 sDOB 文件，因其通常包含诊断信息）
-    excel_path = clinical_data_dir / EXCEL_FILES['sDOB']
-    
-    # 尝试加载 Excel 文件；若失败（文件不存在/损坏等），返回带空 is_ms 列的 df
-    excel_df = load_excel_file(excel_path)
+    # 从共享的表注册中心获取 sDOB 表（每个工作簿每次运行最多解析一次）
+    table = get_table_registry(clinical_data_dir).get('sDOB')
+    log = missing_log if missing_log is not None else MissingDataLog()
     
-    if excel_df is None:
+    if table is None:
         # 无法获取临床数据，所有参与者的 is_ms 设为空字符串
         df['is_ms'] = ''
+        log.add('is_ms', 'sDOB workbook could not be loaded', df['participant_id'])
+        if missing_log is None:
+            log.log_summary()
         return df
     
-    # 初始化两个列表：
+    # 初始化列表：
     # - is_ms_values: 存储每个 participant_id 对应的 'is_ms' 值（'1' 或 ''）
-    # - missing_is_ms_participants: 记录无法确定是否为 MS 的参与者 ID，用于日志警告
+    # - not_in_table / no_diagnosis: 无法确定是否为 MS 的参与者 ID（按原因）
     is_ms_values = []
-    missing_is_ms_participants = []
+    not_in_table, no_diagnosis = [], []
     
     # 遍历 DataFrame 中的每一个 participant_id
     for participant_id in df['participant_id']:
@@ -575,15 +700,13 @@ def process_is_ms_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFra
         numeric_id = participant_id.replace('sub-', '')
         
         # 在 Excel 数据中查找 'ID Dresden' 列匹配 numeric_id 的行
-        # 注意：先转为字符串并去除首尾空格，提高匹配鲁棒性
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
+        # 通过预先建立的 ID 索引 O(1) 取行（ID 列已在建表时统一标准化）
+        matching_rows = table.rows_for(numeric_id)
         
         # 如果没有找到匹配行，说明该参与者不在临床数据中
         if matching_rows.empty:
             is_ms_values.append('')  # 无法判断，留空
-            missing_is_ms_participants.append(participant_id)
+            not_in_table.append(participant_id)
             continue  # 跳过后续处理
         
         # 从匹配的第一行中提取 'Date of Diagnosis (year)' 字段（诊断年份）
@@ -593,7 +716,7 @@ def process_is_ms_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFra
         if pd.isna(diagnosis_year) or diagnosis_year == '':
             # 无诊断年份 → 无法确认是否为 MS 患者
             is_ms_values.append('')
-            missing_is_ms_participants.append(participant_id)
+            no_diagnosis.append(participant_id)
         else:
             # 有诊断年份 → 视为 MS 患者，标记为 '1'
             # 使用字符串 '1' 而非整数 1，便于后续写入 TSV/CSV 并保持字段一致性
@@ -602,14 +725,146 @@ def process_is_ms_field(df: pd.DataFrame, clinical_data_dir: Path) -> pd.DataFra
     # 将生成的 is_ms 值列表作为新列添加到 DataFrame 中
     df['is_ms'] = is_ms_values
     
-    # 如果有参与者缺失 is_ms 信息，记录警告日志以便数据核查
-    if missing_is_ms_participants:
-        logger.warning(f"Missing is_ms for participants: {missing_is_ms_participants}")
+    # 批量记录缺失 is_ms 信息的参与者，以便数据核查
+    log.add('is_ms', 'not in sDOB workbook', not_in_table)
+    log.add('is_ms', 'no diagnosis year in sDOB workbook', no_diagnosis)
+    if missing_log is None:
+        log.log_summary()
     
     # 返回更新后的 DataFrame
     return df
 
 
+def resolve_instrument_specs(
+    instrument_keys: Optional[List[str]] = None,
+    match_windows: Optional[Dict[str, Tuple[int, str]]] = None
+) -> List[InstrumentSpec]:
+    """
+    返回要处理的 InstrumentSpec 列表，并应用最近访视匹配窗口。
+    
+    参数:
+        instrument_keys (List[str], 可选): INSTRUMENTS 中的键（默认全部）
+        match_windows (Dict[str, Tuple[int, str]], 可选): 
+            量表键 → (容差天数, 方向)（默认使用模块级 MATCH_WINDOWS）
+    
+    返回:
+        List[InstrumentSpec]: 按 instrument_keys 顺序排列的量表描述
+    """
+    if instrument_keys is None:
+        instrument_keys = list(INSTRUMENTS)
+    if match_windows is None:
+        match_windows = MATCH_WINDOWS
+    
+    specs = []
+    for key in instrument_keys:
+        spec = INSTRUMENTS[key]
+        if key in match_windows:
+            tolerance_days, direction = match_windows[key]
+            spec = spec._replace(tolerance_days=tolerance_days, direction=direction)
+        specs.append(spec)
+    return specs
+
+
+def compute_session_measures(
+    participants: Dict[str, List[str]],
+    participant_ids: List[str],
+    clinical_data_dir: Path,
+    instrument_keys: Optional[List[str]] = None,
+    match_windows: Optional[Dict[str, Tuple[int, str]]] = None,
+    backend: Optional[str] = None
+) -> SessionMeasures:
+    """
+    计算所有 session 级临床量表字段（宽表 + 长表），不修改任何 DataFrame。
+    
+    参数含义同 process_session_measures；participant_ids 决定输出行顺序；
+    backend 为匹配实现（默认使用模块级 MEASURE_BACKEND）。
+    """
+    return join_session_measures(
+        participants,
+        participant_ids,
+        get_table_registry(clinical_data_dir),
+        resolve_instrument_specs(instrument_keys, match_windows),
+        backend or MEASURE_BACKEND
+    )
+
+
+def record_missing_measures(missing_log: MissingDataLog, measures: SessionMeasures):
+    """
+    将各量表未匹配的 session（'participant_session'）批量加入缺失记录。
+    """
+    for key, sessions in measures.missing.items():
+        pairs = [session.rsplit('_', 1) for session in sessions]
+        missing_log.add(
+            key, f"no matching assessment in {EXCEL_FILES[key]}",
+            [participant_id for participant_id, _ in pairs],
+            [session_date for _, session_date in pairs]
+        )
+
+
+def apply_session_measures(
+    df: pd.DataFrame,
+    measures: SessionMeasures,
+    missing_log: Optional[MissingDataLog] = None
+) -> pd.DataFrame:
+    """
+    将 compute_session_measures 的宽表写入 df，并把未匹配的 session 加入缺失记录
+    （不提供 missing_log 时为每个量表记录一条计数警告）。
+    """
+    # 按 participant_id 对齐写回（宽表的行顺序与 df 相同）
+    for column in measures.wide.columns:
+        df[column] = measures.wide[column].to_numpy()
+    
+    log = missing_log if missing_log is not None else MissingDataLog()
+    record_missing_measures(log, measures)
+    if missing_log is None:
+        log.log_summary()
+    
+    return df
+
+
+def process_session_measures(
+    participants: Dict[str, List[str]],
+    df: pd.DataFrame,
+    clinical_data_dir: Path,
+    instrument_keys: Optional[List[str]] = None,
+    match_windows: Optional[Dict[str, Tuple[int, str]]] = None
+) -> pd.DataFrame:
+    """
+    一次性为 DataFrame 添加所有 session 级临床量表字段（sdmt、9hpt_dom、9hpt_ndom、
+    handedness、edss、t25fw、education）。
+
+    每个量表由 INSTRUMENTS 中的 InstrumentSpec 描述；所有 (participant, session) 与各量表
+    通过向量化 merge 按 (ID, 日期) 匹配，同一天有多条记录时取第一条。
+    在 match_windows 中配置了窗口的量表改为匹配 ±N 天内最近的评估，
+    并输出 <key>_offset_days 列（评估日期 − session 日期）。
+    
+    输出格式：
+      - 每个字段为逗号分隔字符串，顺序与 'session' 列严格对齐；
+      - 某次会话无对应数据时该位置为空字符串 ''；
+      - handedness 取第一个能确定利手的 session。
+    
+    参数:
+        participants (Dict[str, List[str]]): 
+            participant_id 到其会话日期列表的映射，例如 {'sub-5000017': ['20231005', '20240110']}
+        df (pd.DataFrame): 
+            必须包含 'participant_id' 列的 DataFrame
+        clinical_data_dir (Path): 
+            临床数据目录路径
+        instrument_keys (List[str], 可选): 
+            只处理 INSTRUMENTS 中的这些量表（默认全部）
+        match_windows (Dict[str, Tuple[int, str]], 可选): 
+            量表键 → (容差天数, 方向)（默认使用模块级 MATCH_WINDOWS）
+    
+    返回:
+        pd.DataFrame: 添加了各量表字段的 DataFrame
+    """
+    measures = compute_session_measures(
+        participants, df['participant_id'].tolist(), clinical_data_dir,
+        instrument_keys, match_windows
+    )
+    return apply_session_measures(df, measures)
+
+
 def process_sdmt_field(
     participants: Dict[str, List[str]], 
     df: pd.DataFrame, 
@@ -637,95 +892,7 @@ def process_sdmt_field(
     返回:
         pd.DataFrame: 添加了 'sdmt' 列的更新版 DataFrame
     """
-    
-    # 构建 SDMT 专用 Excel 文件的完整路径（通常与 sDOB 文件不同）
-    excel_path = clinical_data_dir / EXCEL_FILES['sdmt']
-    
-    # 尝试加载 SDMT 数据文件；若失败，所有 sdmt 字段设为空，并返回
-    excel_df = load_excel_file(excel_path)
-    
-    if excel_df is None:
-        df['sdmt'] = ''
-        return df
-    
-    # 初始化两个列表：
-    # - sdmt_values: 存储每个 participant_id 对应的 SDMT 得分字符串（如 "45,50"）
-    # - missing_sdmt_sessions: 记录缺失 SDMT 数据的具体 (participant_session) 组合，用于日志
-    sdmt_values = []
-    missing_sdmt_sessions = []
-    
-    # 遍历 DataFrame 中的每个 participant_id
-    for participant_id in df['participant_id']:
-        # 提取纯数字 ID（去除 'sub-' 前缀）
-        numeric_id = participant_id.replace('sub-', '')
-        
-        # 获取该参与者的所有会话日期（来自 participants 字典）
-        session_dates = participants[participant_id]
-        
-        # 在 SDMT Excel 数据中查找所有匹配该 numeric_id 的行
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
-        
-        # 如果该参与者在 SDMT 文件中完全无记录
-        if matching_rows.empty:
-            # 为该参与者的每一个会话都填空字符串
-            sdmt_values.append(','.join([''] * len(session_dates)))
-            # 记录所有缺失的会话
-            missing_sdmt_sessions.extend([f"{participant_id}_{sd}" for sd in session_dates])
-            continue
-        
-        # 初始化当前参与者的 SDMT 得分列表（按 session_dates 顺序填充）
-        session_sdmt = []
-        
-        # 遍历该参与者的每一个会话日期
-        for session_date in session_dates:
-            found = False  # 标记是否找到匹配的评估记录
-            
-            # 在 matching_rows 中逐行查找：是否有评估日期与 session_date 匹配
-            for idx, row in matching_rows.iterrows():
-                assessment_date_str = row['Assessment Started At']
-                
-                # 跳过空的评估时间
-                if pd.isna(assessment_date_str):
-                    continue
-                
-                # 使用自定义函数从原始时间戳（如 "2023-10-05 14:30:00"）中提取日期部分
-                # 假设 extract_date_from_datetime 返回格式如 "20231005"
-                assessment_date = extract_date_from_datetime(str(assessment_date_str))
-                
-                # 如果提取的评估日期与当前会话日期一致，则视为匹配
-                if assessment_date == session_date:
-                    # 获取 'Total Number Correct' 列的值（即 SDMT 得分）
-                    total_correct = row['Total Number Correct']
-                    
-                    # 处理空值或 NaN
-                    if pd.isna(total_correct) or total_correct == '':
-                        session_sdmt.append('')
-                    else:
-                        # 转为字符串存储（便于后续 join）
-                        session_sdmt.append(str(total_correct))
-                    
-                    found = True
-                    break  # 找到匹配后跳出内层循环（如果一个 session_date 匹配到多个 Assessment Started At 日期相同的记录，只取第一个）
-            
-            # 如果遍历完所有匹配行仍未找到对应 session_date 的记录
-            if not found:
-                session_sdmt.append('')  # 该会话无 SDMT 数据
-                missing_sdmt_sessions.append(f"{participant_id}_{session_date}")
-        
-        # 将该参与者的所有 SDMT 得分用逗号连接成一个字符串
-        sdmt_values.append(','.join(session_sdmt))
-    
-    # 将生成的 sdmt 字符串列表作为新列添加到 DataFrame
-    df['sdmt'] = sdmt_values
-    
-    # 如果存在缺失的 SDMT 会话，记录警告日志（仅显示前 10 条，避免日志过长）
-    if missing_sdmt_sessions:
-        logger.warning(f"Missing sdmt for sessions: {missing_sdmt_sessions[:10]}...")
-    
-    # 返回更新后的 DataFrame
-    return df
+    return process_session_measures(participants, df, clinical_data_dir, ['sdmt'])
 
 
 def process_9hpt_fields(
@@ -741,7 +908,8 @@ def process_9hpt_fields(
 
     9-HPT（Nine-Hole Peg Test）是一种评估上肢精细运动功能的标准化测试。
     本函数从 9HPT 专用 Excel 文件中，根据 participant_id 和 session_date 匹配记录，
-    并根据 'Dominant Hand' 和 'Hand Used' 字段判断哪只手是优势手/非优势手。
+    并根据 'Dominant Hand' 和 'Hand Used' 字段判断哪只手是优势手/非优势手；
+    同一天的多次有效试次取平均（见 aggregate_9hpt_trials）。
 
     输出格式：
       - '9hpt_dom' 和 '9hpt_ndom' 为逗号分隔字符串，顺序与 session 列严格对齐
@@ -759,137 +927,7 @@ def process_9hpt_fields(
     返回:
         pd.DataFrame: 添加/更新了 '9hpt_dom', '9hpt_ndom', 'handedness' 三列的 DataFrame
     """
-    
-    # 构建 9HPT 专用 Excel 文件路径
-    excel_path = clinical_data_dir / EXCEL_FILES['9hpt']
-    
-    # 尝试加载 9HPT 数据文件
-    excel_df = load_excel_file(excel_path)
-    
-    # 如果文件加载失败，所有相关字段设为空并返回
-    if excel_df is None:
-        df['9hpt_dom'] = ''
-        df['9hpt_ndom'] = ''
-        df['handedness'] = ''
-        return df
-    
-    # 初始化三列为空字符串（确保列存在）
-    df['9hpt_dom'] = ''
-    df['9hpt_ndom'] = ''
-    df['handedness'] = ''
-    
-    # 记录缺失 9HPT 数据的 (participant_session) 组合，用于日志
-    missing_9hpt_sessions = []
-    
-    # 遍历 DataFrame 中的每个 participant_id（使用 enumerate 获取行索引 idx）
-    for idx, participant_id in enumerate(df['participant_id']):
-        # 提取纯数字 ID（去除 'sub-' 前缀）
-        numeric_id = participant_id.replace('sub-', '')
-        
-        # 获取该参与者的所有会话日期
-        session_dates = participants[participant_id]
-        
-        # 在 9HPT Excel 数据中查找所有匹配该 numeric_id 的行
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
-        
-        # 如果该参与者在 9HPT 文件中无任何记录
-        if matching_rows.empty:
-            # 所有会话的 dom/ndom/handedness 均设为空
-            df.at[idx, '9hpt_dom'] = ','.join([''] * len(session_dates))
-            df.at[idx, '9hpt_ndom'] = ','.join([''] * len(session_dates))
-            df.at[idx, 'handedness'] = ''
-            # 记录所有缺失的会话
-            missing_9hpt_sessions.extend([f"{participant_id}_{sd}" for sd in session_dates])
-            continue
-        
-        # 初始化当前参与者的 dom/ndom 时间列表（按 session_dates 顺序填充）
-        session_dom = []
-        session_ndom = []
-        
-        # 读取当前行已有的 handedness（可能由其他函数预先设置）
-        # 如果尚未设置（空字符串），则在找到有效数据时赋值
-        handedness = df.at[idx, 'handedness']
-        
-        # 遍历该参与者的每一个会话日期
-        for session_date in session_dates:
-            found = False  # 标记是否找到匹配的评估记录
-            
-            # 在 matching_rows 中逐行查找：是否有评估日期与 session_date 匹配
-            for row_idx, row in matching_rows.iterrows():
-                assessment_date_str = row['Assessment Started At']
-                
-                # 跳过空的评估时间
-                if pd.isna(assessment_date_str):
-                    continue
-                
-                # 提取标准化日期（如 "20231005"）
-                assessment_date = extract_date_from_datetime(str(assessment_date_str))
-                
-                # 如果日期匹配
-                if assessment_date == session_date:
-                    # 安全提取并标准化 'Dominant Hand' 字段（应为 'left'/'right'）
-                    dominant_hand = (
-                        str(row['Dominant Hand']).strip().lower() 
-                        if pd.notna(row['Dominant Hand']) else ''
-                    )
-                    
-                    # 安全提取 'Hand Used' 字段（表示本次测试用的是哪只手）
-                    hand_used = (
-                        str(row['Hand Used']).strip().lower() 
-                        if pd.notna(row['Hand Used']) else ''
-                    )
-                    
-                    # 提取左右手完成时间（保留原始类型，后续转字符串）
-                    left_time = row['Left Hand Time'] if pd.notna(row['Left Hand Time']) else ''
-                    right_time = row['Right Hand Time'] if pd.notna(row['Right Hand Time']) else ''
-                    
-                    # 关键逻辑：只有当 'Hand Used' 与 'Dominant Hand' 一致时，
-                    # 才认为本次测试提供了有效的 dom/ndom 配对数据
-                    if hand_used == dominant_hand:
-                        if hand_used == 'left':
-                            # 左手是优势手 → left_time 为 dom，right_time 为 ndom
-                            session_dom.append(str(left_time) if left_time != '' else '')
-                            session_ndom.append(str(right_time) if right_time != '' else '')
-                            # 如果 handedness 尚未设置，则推断为 'left'
-                            if not handedness:
-                                handedness = 'left'
-                        elif hand_used == 'right':
-                            # 右手是优势手 → right_time 为 dom，left_time 为 ndom
-                            session_dom.append(str(right_time) if right_time != '' else '')
-                            session_ndom.append(str(left_time) if left_time != '' else '')
-                            if not handedness:
-                                handedness = 'right'
-                        else:
-                            # dominant_hand 不是 'left'/'right'（如空、'ambidextrous' 等）
-                            session_dom.append('')
-                            session_ndom.append('')
-                    else:
-                        # Hand Used 与 Dominant Hand 不一致 → 无法可靠分配 dom/ndom
-                        # （例如：优势手是右手，但这次只测了左手）
-                        session_dom.append('')
-                        session_ndom.append('')
-                    
-                    found = True
-                    break  # 找到第一个匹配记录即停止（⚠️ 注意：存在重复时仅用第一条）
-            
-            # 如果未找到匹配的评估记录
-            if not found:
-                session_dom.append('')
-                session_ndom.append('')
-                missing_9hpt_sessions.append(f"{participant_id}_{session_date}")
-        
-        # 将当前参与者的所有会话结果写入 DataFrame 对应行
-        df.at[idx, '9hpt_dom'] = ','.join(session_dom)
-        df.at[idx, '9hpt_ndom'] = ','.join(session_ndom)
-        df.at[idx, 'handedness'] = handedness  # 更新 handedness（可能仍为空）
-    
-    # 如果存在缺失的 9HPT 会话，记录警告日志（最多显示前 10 条）
-    if missing_9hpt_sessions:
-        logger.warning(f"Missing 9hpt for sessions: {missing_9hpt_sessions[:10]}...")
-    
-    return df
+    return process_session_measures(participants, df, clinical_data_dir, ['9hpt'])
 
 
 def process_edss_field(
@@ -915,92 +953,7 @@ def process_edss_field(
     返回：
         pd.DataFrame: 添加了 'edss' 列的 df。
     """
-    
-    # 构建 EDSS 数据 Excel 文件的完整路径
-    excel_path = clinical_data_dir / EXCEL_FILES['edss']
-    
-    # 尝试加载 Excel 文件（假设 load_excel_file 是自定义函数，处理文件不存在或读取错误等情况）
-    excel_df = load_excel_file(excel_path)
-    
-    # 如果无法加载 EDSS 数据，则为所有受试者填充空字符串
-    if excel_df is None:
-        df['edss'] = ''
-        return df
-    
-    # 用于存储每个受试者对应各 session 的 EDSS 值（最终每行一个逗号分隔字符串）
-    edss_values = []
-    # 记录缺失 EDSS 数据的 session（用于日志警告）
-    missing_edss_sessions = []
-    
-    # 遍历主数据框中的每个受试者
-    for participant_id in df['participant_id']:
-        # 去掉 'sub-' 前缀，得到纯数字 ID（如 'sub-123' → '123'）
-        numeric_id = participant_id.replace('sub-', '')
-        # 获取该受试者的所有 session 日期列表
-        session_dates = participants[participant_id]
-        
-        # 在 EDSS 表中查找 ID Dresden 列匹配当前 numeric_id 的所有行
-        # 注意：先转换为字符串并去除首尾空格，确保匹配准确
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
-        
-        # 如果没有找到任何匹配的受试者记录
-        if matching_rows.empty:
-            # 为该受试者的所有 session 填充空字符串（数量等于 session 数量）
-            edss_values.append(','.join([''] * len(session_dates)))
-            # 记录所有缺失的 session（格式：sub-xxx_yyyy-mm-dd）
-            missing_edss_sessions.extend([
-                f"{participant_id}_{sd}" for sd in session_dates
-            ])
-            continue  # 跳过后续处理
-        
-        # 存储当前受试者每个 session 对应的 EDSS 值
-        session_edss = []
-        
-        # 遍历该受试者的每一个 session 日期
-        for session_date in session_dates:
-            found = False  # 标记是否在 EDSS 表中找到匹配的 visit date
-            
-            # 遍历所有匹配该受试者的 EDSS 行（可能有多次随访记录）
-            for idx, row in matching_rows.iterrows():
-                visitdate_str = row['Visitdate']
-                # 如果 Visitdate 为空，跳过
-                if pd.isna(visitdate_str):
-                    continue
-                
-                # 将 Visitdate 字符串解析为标准日期格式（如 '2023-05-15'）
-                # extract_date_from_visitdate 是自定义函数，处理不同日期格式
-                visit_date = extract_date_from_visitdate(str(visitdate_str))
-                
-                # 如果解析后的日期与当前 session 日期一致
-                if visit_date == session_date:
-                    score_edss = row['scoreEdss']
-                    # 处理 EDSS 分数为空或 NaN 的情况
-                    if pd.isna(score_edss) or score_edss == '':
-                        session_edss.append('')
-                    else:
-                        # 转为字符串（保留原始精度，避免 float 显示问题）
-                        session_edss.append(str(score_edss))
-                    found = True
-                    break  # 找到匹配项后跳出内层循环
-            
-            # 如果遍历完所有行都没找到匹配的 visit date
-            if not found:
-                session_edss.append('')  # 当前 session 无 EDSS 数据
-                missing_edss_sessions.append(f"{participant_id}_{session_date}")
-        
-        # 将该受试者所有 session 的 EDSS 值用逗号连接成一个字符串
-        edss_values.append(','.join(session_edss))
-    
-    # 将生成的 EDSS 字符串列表赋值给 df 的新列 'edss'
-    df['edss'] = edss_values
-    
-    # 如果存在缺失的 session，记录警告日志（最多显示前 10 个）
-    if missing_edss_sessions:
-        logger.warning(f"Missing edss for sessions: {missing_edss_sessions[:10]}...")
-    
-    return df
+    return process_session_measures(participants, df, clinical_data_dir, ['edss'])
 
 
 def process_t25fw_field(
@@ -1028,92 +981,7 @@ def process_t25fw_field(
     返回：
         pd.DataFrame: 添加了 't25fw' 列的 df。
     """
-    
-    # 构建 T25FW 数据 Excel 文件的完整路径（EXCEL_FILES 是预定义的文件名映射字典）
-    excel_path = clinical_data_dir / EXCEL_FILES['t25fw']
-    
-    # 尝试加载 Excel 文件（load_excel_file 应能处理文件缺失或读取错误，并返回 None）
-    excel_df = load_excel_file(excel_path)
-    
-    # 如果无法加载 T25FW 数据，则为所有受试者填充空字符串
-    if excel_df is None:
-        df['t25fw'] = ''
-        return df
-    
-    # 存储每个受试者对应各 session 的 T25FW 值（每项为逗号分隔字符串）
-    t25fw_values = []
-    # 记录缺失 T25FW 数据的 session（用于日志警告）
-    missing_t25fw_sessions = []
-    
-    # 遍历主数据框中的每个受试者
-    for participant_id in df['participant_id']:
-        # 去除 'sub-' 前缀，得到纯数字 ID（例如 'sub-123' → '123'）
-        numeric_id = participant_id.replace('sub-', '')
-        # 获取该受试者的所有 session 日期列表
-        session_dates = participants[participant_id]
-        
-        # 在 T25FW 表中查找 'ID Dresden' 列匹配当前 numeric_id 的所有行
-        # 注意：先转换为字符串并去除首尾空格，避免因格式问题匹配失败
-        matching_rows = excel_df[
-            excel_df['ID Dresden'].astype(str).str.strip() == numeric_id
-        ]
-        
-        # 如果没有找到任何匹配的受试者记录
-        if matching_rows.empty:
-            # 为该受试者的所有 session 填充空字符串（数量等于 session 数量）
-            t25fw_values.append(','.join([''] * len(session_dates)))
-            # 记录所有缺失的 session（格式：sub-xxx_yyyy-mm-dd）
-            missing_t25fw_sessions.extend([
-                f"{participant_id}_{sd}" for sd in session_dates
-            ])
-            continue  # 跳过后续处理
-        
-        # 存储当前受试者每个 session 对应的 T25FW 时间值
-        session_t25fw = []
-        
-        # 遍历该受试者的每一个 session 日期
-        for session_date in session_dates:
-            found = False  # 标记是否在 T25FW 表中找到匹配的评估日期
-            
-            # 遍历所有匹配该受试者的 T25FW 行（可能有多次评估记录）
-            for idx, row in matching_rows.iterrows():
-                assessment_date_str = row['Assessment Started At']
-                # 如果评估开始时间为空，跳过该行
-                if pd.isna(assessment_date_str):
-                    continue
-                
-                # 从完整的 datetime 字符串中提取日期部分（如 '2023-05-15 14:30:00' → '2023-05-15'）
-                # extract_date_from_datetime 是自定义函数，负责标准化日期格式
-                assessment_date = extract_date_from_datetime(str(assessment_date_str))
-                
-                # 如果提取的日期与当前 session 日期一致
-                if assessment_date == session_date:
-                    walk_duration = row['Walk Duration']
-                    # 处理 Walk Duration 为空、NaN 或空字符串的情况
-                    if pd.isna(walk_duration) or walk_duration == '':
-                        session_t25fw.append('')
-                    else:
-                        # 转为字符串（保留原始数值格式，避免浮点显示问题）
-                        session_t25fw.append(str(walk_duration))
-                    found = True
-                    break  # 找到匹配项后立即跳出内层循环
-            
-            # 如果遍历完所有匹配行仍未找到对应日期的记录
-            if not found:
-                session_t25fw.append('')  # 当前 session 无 T25FW 数据
-                missing_t25fw_sessions.append(f"{participant_id}_{session_date}")
-        
-        # 将该受试者所有 session 的 T25FW 值用逗号连接成一个字符串
-        t25fw_values.append(','.join(session_t25fw))
-    
-    # 将生成的 T25FW 字符串列表赋值给 df 的新列 't25fw'
-    df['t25fw'] = t25fw_values
-    
-    # 如果存在缺失的 session，记录警告日志（最多显示前 10 个）
-    if missing_t25fw_sessions:
-        logger.warning(f"Missing t25fw for sessions: {missing_t25fw_sessions[:10]}...")
-    
-    return df
+    return process_session_measures(participants, df, clinical_data_dir, ['t25fw'])
 
 
 def process_education_field(
@@ -1141,192 +1009,887 @@ def process_education_field(
     返回：
         pd.DataFrame: 添加了 'education' 列的 df。
     """
+    return process_session_measures(participants, df, clinical_data_dir, ['education'])
+
+
+# participants.tsv 的标准列顺序
+PARTICIPANT_COLUMNS = [
+    'participant_id', 'session', 'age', 'sex', 'is_ms', 'sdmt',
+    '9hpt_dom', '9hpt_ndom', 'handedness', 'edss', 't25fw', 'education'
+]
+
+
+def workbook_fields() -> Dict[str, List[str]]:
+    """
+    返回每个工作簿决定的 participants.tsv 列：{EXCEL_FILES 的键: [列名, ...]}。
     
-    # 构建教育信息 Excel 文件的完整路径（EXCEL_FILES 是预定义的文件名映射字典）
-    excel_path = clinical_data_dir / EXCEL_FILES['education']
+    工作簿内容变化时，增量模式只需要重算这些列。
+    """
+    fields = {'sDOB': ['age', 'sex', 'is_ms']}
+    for spec in resolve_instrument_specs():
+        fields[spec.key] = output_columns(spec)
+    return fields
+
+
+def order_participant_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    按标准顺序排列列；启用了最近访视匹配的量表，其日期偏移列（<key>_offset_days）追加在最后。
+    """
+    column_order = PARTICIPANT_COLUMNS + [
+        column for column in df.columns if column.endswith('_offset_days')
+    ]
+    # 注意：若某列不存在会报错，因此需确保所有字段处理函数都已正确执行
+    return df[column_order]
+
+
+def build_participants_table(
+    participants: Dict[str, List[str]],
+    clinical_data_dir: Path,
+    participant_ids: Optional[List[str]] = None,
+    workbook_keys: Optional[List[str]] = None,
+    recorder: Optional[StageRecorder] = None,
+    backend: Optional[str] = None,
+    missing_log: Optional[MissingDataLog] = None
+) -> Tuple[pd.DataFrame, Optional[SessionMeasures]]:
+    """
+    依次处理各字段，生成 participants.tsv 的（部分）内容。
     
-    # 尝试加载 Excel 文件；若失败（如文件不存在或读取错误），load_excel_file 应返回 None
-    excel_df = load_excel_file(excel_path)
+    参数:
+        participants (Dict[str, List[str]]): participant_id → session 日期列表
+        clinical_data_dir (Path): 临床数据目录
+        participant_ids (List[str], 可选): 只处理这些受试者（默认全部，顺序同 participants）
+        workbook_keys (List[str], 可选): 只生成这些工作簿决定的列（默认全部，见 workbook_fields）
+        recorder (StageRecorder, 可选): 记录每个字段阶段的耗时、内存峰值和行数
+        backend (str, 可选): session 级量表的匹配实现（默认 MEASURE_BACKEND）
+        missing_log (MissingDataLog, 可选): 收集所有字段的缺失记录
+            （不提供时每个字段各记录一条计数警告）
     
-    # 如果无法加载教育数据，则为所有受试者填充空字符串
-    if excel_df is None:
-        df['education'] = ''
-        return df
+    返回:
+        Tuple[pd.DataFrame, SessionMeasures 或 None]:
+            - 含 participant_id、session 以及所请求字段的 DataFrame
+            - session 级量表的计算结果（未处理任何量表时为 None）
+    """
+    if participant_ids is not None:
+        participants = {participant_id: participants[participant_id] for participant_id in participant_ids}
+    if workbook_keys is None:
+        workbook_keys = list(EXCEL_FILES)
+    if recorder is None:
+        recorder = StageRecorder(trace_memory=False)
     
-    # 存储每个受试者对应各 session 的教育年限值（最终每行一个逗号分隔字符串）
-    education_values = []
-    # 记录缺失教育数据的 session（用于日志警告）
-    missing_education_sessions = []
+    # ———————— 逐个处理各字段 ————————
     
-    # 遍历主数据框中的每个受试者
-    for participant_id in df['participant_id']:
-        # 去除 'sub-' 前缀，得到纯数字 ID（例如 'sub-123' → '123'）
-        numeric_id = participant_id.replace('sub-', '')
-        # 获取该受试者的所有 session 日期列表
-        session_dates = participants[participant_id]
-        
-        # 在教育数据表中查找 'mpi' 列匹配当前 numeric_id 的所有行
-        # 注意：先转换为字符串并去除首尾空格，避免因格式问题（如前导空格）导致匹配失败
-        matching_rows = excel_df[
-            excel_df['mpi'].astype(str).str.strip() == numeric_id
-        ]
-        
-        # 如果没有找到任何匹配的受试者记录
-        if matching_rows.empty:
-            # 为该受试者的所有 session 填充空字符串（数量等于 session 数量）
-            education_values.append(','.join([''] * len(session_dates)))
-            # 记录所有缺失的 session（格式：sub-xxx_yyyy-mm-dd）
-            missing_education_sessions.extend([
-                f"{participant_id}_{sd}" for sd in session_dates
-            ])
-            continue  # 跳过后续处理
-        
-        # 存储当前受试者每个 session 对应的教育年限
-        session_education = []
+    logger.info("Processing participant_id field...")
+    # 生成 'participant_id' 列（如 sub-001, sub-002...）
+    with recorder.stage('participant_id') as record:
+        df = process_participant_id_field(participants)
+        record['rows'] = len(df)
+    
+    logger.info("Processing session field...")
+    # 生成 'session' 列，每个受试者对应多个 session，值为逗号分隔的日期字符串
+    with recorder.stage('session') as record:
+        df = process_session_field(participants, df)
+        record['rows'] = len(df)
+    
+    if 'sDOB' in workbook_keys:
+        logger.info("Processing age field...")
+        # 从临床数据中提取每个 session 对应的年龄（可能基于出生日期和 session 日期动态计算）
+        with recorder.stage('age') as record:
+            df = process_age_field(participants, df, clinical_data_dir, missing_log)
+            record['rows'] = len(df)
         
-        # 遍历该受试者的每一个 session 日期
-        for session_date in session_dates:
-            found = False  # 标记是否在教育表中找到匹配的评估日期
-            
-            # 遍历所有匹配该受试者的教育记录行（理论上可能有多次录入，但教育年限通常不变）
-            for idx, row in matching_rows.iterrows():
-                encdate_str = row['encdate']
-                # 如果 encdate（就诊/录入时间戳）为空，跳过该行
-                if pd.isna(encdate_str):
-                    continue
-                
-                # 从 Unix 时间戳字符串中提取标准日期（如 '1620123456' → '2021-05-04'）
-                # extract_date_from_timestamp 是自定义函数，负责将时间戳转为 'YYYY-MM-DD' 格式
-                enc_date = extract_date_from_timestamp(str(encdate_str))
-                
-                # 如果提取的日期与当前 session 日期一致
-                if enc_date == session_date:
-                    educ = row['educ']  # 获取教育年限字段
-                    # 处理 educ 为空、NaN 或空字符串的情况
-                    if pd.isna(educ) or educ == '':
-                        session_education.append('')
-                    else:
-                        # 转为字符串（保留原始值，如整数 12 或浮点 12.0）
-                        session_education.append(str(educ))
-                    found = True
-                    break  # 找到匹配项后立即跳出内层循环
-            
-            # 如果遍历完所有匹配行仍未找到对应日期的记录
-            if not found:
-                session_education.append('')  # 当前 session 无教育数据
-                missing_education_sessions.append(f"{participant_id}_{session_date}")
+        logger.info("Processing sex field...")
+        # 提取性别信息（通常为静态字段，但按 session 重复填充以保持结构一致）
+        with recorder.stage('sex') as record:
+            df = process_sex_field(df, clinical_data_dir, missing_log)
+            record['rows'] = len(df)
         
-        # 将该受试者所有 session 的教育值用逗号连接成一个字符串
-        education_values.append(','.join(session_education))
+        logger.info("Processing is_ms field...")
+        # 标记是否为多发性硬化症患者（MS vs HC），通常为二元标签（如 'yes'/'no' 或 1/0）
+        with recorder.stage('is_ms') as record:
+            df = process_is_ms_field(df, clinical_data_dir, missing_log)
+            record['rows'] = len(df)
+    
+    measures = None
+    instrument_keys = [key for key in INSTRUMENTS if key in workbook_keys]
+    if instrument_keys:
+        logger.info("Processing session-level clinical measures...")
+        # 一次性匹配所有 session 级量表：
+        # SDMT 认知测试得分、9-Hole Peg Test 优势手/非优势手时间及利手（handedness）、
+        # EDSS 残疾评分、T25FW 行走时间、教育年限
+        # （所有量表共用一次 session 展开，因此作为一个阶段计时；行数为 session 数）
+        with recorder.stage('session_measures') as record:
+            measures = compute_session_measures(
+                participants, df['participant_id'].tolist(), clinical_data_dir, instrument_keys,
+                backend=backend
+            )
+            df = apply_session_measures(df, measures, missing_log)
+            record['rows'] = len(measures.long)
+    
+    return df, measures
+
+
+def compute_fingerprint(participants: Dict[str, List[str]], clinical_data_dir: Path) -> dict:
+    """
+    计算决定 participants.tsv 内容的源指纹：每个受试者的 session 列表、每个工作簿的 SHA-256，
+    以及影响输出的配置（最近访视匹配窗口）。
+    """
+    workbooks = {}
+    for key, filename in EXCEL_FILES.items():
+        file_path = Path(clinical_data_dir) / filename
+        workbooks[key] = file_checksum(file_path) if file_path.exists() else None
+    return {
+        'version': FINGERPRINT_VERSION,
+        'config': {
+            'match_windows': {key: list(window) for key, window in sorted(MATCH_WINDOWS.items())},
+            'columns': PARTICIPANT_COLUMNS,
+        },
+        'workbooks': workbooks,
+        'subjects': {participant_id: list(dates) for participant_id, dates in participants.items()},
+    }
+
+
+def load_fingerprint(output_file: Path) -> Optional[dict]:
+    """
+    读取 participants.tsv 旁的指纹文件（不存在或无法解析时返回 None）。
+    """
+    path = Path(output_file).with_name(FINGERPRINT_FILENAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def save_fingerprint(output_file: Path, fingerprint: dict):
+    """
+    将指纹写到 participants.tsv 旁（先写临时文件再原子替换）。
+    """
+    path = Path(output_file).with_name(FINGERPRINT_FILENAME)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(fingerprint, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def update_participants_table(
+    participants: Dict[str, List[str]],
+    clinical_data_dir: Path,
+    output_file: Path,
+    fingerprint: dict,
+    backend: Optional[str] = None,
+    missing_log: Optional[MissingDataLog] = None
+) -> Optional[Tuple[pd.DataFrame, bool]]:
+    """
+    增量更新已有的 participants.tsv。
+    
+    与上次运行的指纹比较：
+      - session 列表变化（或新增）的受试者 → 重算整行；
+      - 内容变化的工作簿 → 对其余受试者只重算该工作簿决定的列；
+      - 已不存在的受试者 → 删除该行。
+    
+    参数:
+        participants (Dict[str, List[str]]): 当前的 participant_id → session 日期列表
+        clinical_data_dir (Path): 临床数据目录
+        output_file (Path): 已有的 participants.tsv
+        fingerprint (dict): 当前指纹（compute_fingerprint 的结果）
+        backend (str, 可选): session 级量表的匹配实现（默认 MEASURE_BACKEND）
+        missing_log (MissingDataLog, 可选): 收集重算部分的缺失记录
     
-    # 将生成的教育字符串列表赋值给 df 的新列 'education'
-    df['education'] = education_values
+    返回:
+        Tuple[pd.DataFrame, bool] 或 None:
+            - (更新后的表, 是否有变化)；
+            - 无法增量更新（没有旧指纹/旧表、版本或配置变化、旧表列不符）时返回 None，需完整重建。
+    """
+    previous = load_fingerprint(output_file)
+    if (
+        previous is None
+        or not Path(output_file).exists()
+        or previous.get('version') != fingerprint['version']
+        or previous.get('config') != fingerprint['config']
+    ):
+        return None
     
-    # 如果存在缺失的 session，记录警告日志（最多显示前 10 个）
-    if missing_education_sessions:
-        logger.warning(f"Missing education for sessions: {missing_education_sessions[:10]}...")
+    existing = pd.read_csv(output_file, sep='\t', dtype=str, keep_default_na=False)
+    fields = workbook_fields()
+    expected_columns = set(PARTICIPANT_COLUMNS).union(*fields.values())
+    if set(existing.columns) != expected_columns:
+        return None
+    
+    previous_subjects = previous.get('subjects', {})
+    changed_subjects = [
+        participant_id for participant_id, dates in participants.items()
+        if previous_subjects.get(participant_id) != dates
+    ]
+    removed_subjects = sorted(set(previous_subjects) - set(participants))
+    changed_workbooks = [
+        key for key, digest in fingerprint['workbooks'].items()
+        if previous.get('workbooks', {}).get(key) != digest
+    ]
+    
+    logger.info(
+        f"Incremental update: {len(changed_subjects)} changed/new subjects, "
+        f"{len(removed_subjects)} removed, changed workbooks: {changed_workbooks or 'none'}"
+    )
+    if not changed_subjects and not removed_subjects and not changed_workbooks:
+        return existing, False
+    
+    existing = existing.set_index('participant_id', drop=False)
+    existing = existing.loc[existing.index.isin(participants)]
+    
+    # 标明本次重算的范围，写 issues.tsv 时只替换范围内的旧缺失记录
+    if missing_log is not None:
+        missing_log.cover(changed_subjects + removed_subjects)
+    
+    # 内容变化的工作簿：只为未变化的受试者重算对应列
+    unchanged_ids = [participant_id for participant_id in existing.index if participant_id not in changed_subjects]
+    if changed_workbooks and unchanged_ids:
+        if missing_log is not None:
+            # 缺失记录的字段名是 sDOB 决定的列名或量表的键
+            missing_log.cover(unchanged_ids, [field for key in changed_workbooks for field in [key] + fields[key]])
+        updated, _ = build_participants_table(
+            participants, clinical_data_dir, unchanged_ids, changed_workbooks,
+            backend=backend, missing_log=missing_log
+        )
+        updated = updated.set_index('participant_id')
+        for key in changed_workbooks:
+            for column in fields[key]:
+                existing.loc[unchanged_ids, column] = updated.loc[unchanged_ids, column]
+    
+    # session 列表变化或新增的受试者：重算整行
+    if changed_subjects:
+        rows, _ = build_participants_table(
+            participants, clinical_data_dir, changed_subjects,
+            backend=backend, missing_log=missing_log
+        )
+        rows = rows.set_index('participant_id', drop=False)
+        existing = pd.concat([existing.drop(index=changed_subjects, errors='ignore'), rows])
+    
+    # 行顺序与完整重建一致
+    existing = existing.reindex(list(participants)).reset_index(drop=True)
+    return existing, True
+
+
+def partition_participants(
+    participants: Dict[str, List[str]],
+    n_shards: int
+) -> List[Dict[str, List[str]]]:
+    """
+    将受试者按 participant_id 排序后轮流分配到 n_shards 个分片（各分片的 session 数大致均衡）。
+    
+    分片只取决于受试者集合，因此各节点独立扫描同一 BIDS 目录得到的分片相同。
+    
+    参数:
+        participants (Dict[str, List[str]]): participant_id → session 日期列表
+        n_shards (int): 分片数（>= 1）
     
+    返回:
+        List[Dict[str, List[str]]]: 第 i 个元素为第 i 个分片（受试者数少于分片数时部分分片为空）
+    """
+    if n_shards < 1:
+        raise ValueError(f"Number of shards must be at least 1, got {n_shards}")
+    participant_ids = sorted(participants)
+    return [
+        {participant_id: participants[participant_id] for participant_id in participant_ids[index::n_shards]}
+        for index in range(n_shards)
+    ]
+
+
+def _build_shard_task(
+    task: Tuple[int, Dict[str, List[str]], Path, Optional[Path], Optional[str]]
+) -> Tuple[int, pd.DataFrame, Optional[pd.DataFrame], MissingDataLog]:
+    """
+    进程池任务：计算一个分片的 participants 行。
+    
+    临床表取自本进程的表注册中心：fork 启动的子进程直接继承主进程已加载的表，
+    其余情况从共享的 Parquet 缓存目录读取（见 clinical_tables.read_table_cache）。
+    
+    返回:
+        (分片序号, 分片的宽表, session 级长表或 None, 分片的缺失记录)
+    """
+    index, shard, clinical_data_dir, cache_dir, backend = task
+    get_table_registry(clinical_data_dir, cache_dir)
+    missing_log = MissingDataLog()
+    df, measures = build_participants_table(shard, clinical_data_dir, backend=backend, missing_log=missing_log)
+    return index, df, None if measures is None else measures.long, missing_log
+
+
+def sort_participant_rows(df: pd.DataFrame, long: Optional[pd.DataFrame] = None):
+    """
+    按 participant_id 稳定排序宽表（以及长表；同一受试者的 session 顺序保持不变）。
+    
+    返回:
+        Tuple[pd.DataFrame, pd.DataFrame 或 None]: 排序后的宽表和长表
+    """
+    df = df.sort_values('participant_id', kind='stable', ignore_index=True)
+    if long is not None:
+        long = long.sort_values('participant_id', kind='stable', ignore_index=True)
+    return df, long
+
+
+def build_participants_sharded(
+    participants: Dict[str, List[str]],
+    clinical_data_dir: Path,
+    n_shards: int,
+    max_workers: Optional[int] = None,
+    backend: Optional[str] = None,
+    missing_log: Optional[MissingDataLog] = None,
+    cache_dir: Optional[Path] = CLINICAL_CACHE_DIR
+) -> Tuple[pd.DataFrame, Optional[SessionMeasures]]:
+    """
+    按受试者分片，在进程池中分别计算各分片的行，再按 participant_id 合并（map-reduce）。
+    
+    每个受试者的行只取决于它自己的 session 和临床表，因此合并结果与单进程计算的各行相同，
+    只是行顺序为按 participant_id 排序。
+    
+    参数:
+        participants (Dict[str, List[str]]): participant_id → session 日期列表
+        clinical_data_dir (Path): 临床数据目录
+        n_shards (int): 分片数
+        max_workers (int, 可选): 并行进程数（None → min(分片数, CPU 核数)；1 → 在本进程中串行）
+        backend (str, 可选): session 级量表的匹配实现（默认 MEASURE_BACKEND）
+        missing_log (MissingDataLog, 可选): 收集所有分片的缺失记录
+        cache_dir (Path, 可选): 临床表的 Parquet 缓存目录（默认 CLINICAL_CACHE_DIR；None 表示不缓存）
+    
+    返回:
+        Tuple[pd.DataFrame, SessionMeasures 或 None]: 合并后的表，以及合并后的 session 级长表
+            （SessionMeasures 只有 long 有效；wide 的各列已写入表中）
+    """
+    shards = [shard for shard in partition_participants(participants, n_shards) if shard]
+    tasks = [
+        (index, shard, Path(clinical_data_dir), cache_dir, backend)
+        for index, shard in enumerate(shards)
+    ]
+    if max_workers is None:
+        max_workers = min(len(tasks), os.cpu_count() or 1)
+    logger.info(f"Building {len(participants)} participants in {len(tasks)} shards with {max_workers} processes")
+    
+    if max_workers <= 1 or len(tasks) <= 1:
+        results = [_build_shard_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_build_shard_task, tasks))
+    
+    # 按分片序号合并，保证结果与进程完成顺序无关
+    results.sort(key=lambda result: result[0])
+    df = pd.concat([result[1] for result in results], ignore_index=True)
+    longs = [result[2] for result in results if result[2] is not None]
+    long = pd.concat(longs, ignore_index=True) if longs else None
+    if missing_log is not None:
+        for result in results:
+            missing_log.extend(result[3])
+    
+    df, long = sort_participant_rows(df, long)
+    measures = None if long is None else SessionMeasures(df.set_index('participant_id'), long, {})
+    return df, measures
+
+
+def shard_path(shard_dir: Path, index: int, count: int) -> Path:
+    """
+    返回第 index 个分片（共 count 个）的部分输出路径。
+    """
+    return Path(shard_dir) / SHARD_FILENAME.format(index=index, count=count)
+
+
+def shard_missing_path(shard_dir: Path, index: int, count: int) -> Path:
+    """
+    返回第 index 个分片（共 count 个）的缺失数据记录路径。
+    """
+    return Path(shard_dir) / SHARD_MISSING_FILENAME.format(index=index, count=count)
+
+
+def write_shard(
+    df: pd.DataFrame,
+    shard_dir: Path,
+    index: int,
+    count: int,
+    missing_log: Optional[MissingDataLog] = None
+) -> Path:
+    """
+    写出一个分片的部分 participants 表（先写临时文件再原子替换，避免合并时读到半个文件）。
+    
+    提供 missing_log 时另外写出该分片的缺失数据记录（先于部分表写出，合并时部分表存在即说明记录完整）。
+    """
+    path = shard_path(shard_dir, index, count)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if missing_log is not None:
+        missing_path = shard_missing_path(shard_dir, index, count)
+        tmp_path = missing_path.with_name(missing_path.name + '.tmp')
+        missing_log.frame().to_csv(tmp_path, sep='\t', index=False, encoding='utf-8')
+        os.replace(tmp_path, missing_path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    df.to_csv(tmp_path, sep='\t', index=False, encoding='utf-8')
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote shard {index + 1}/{count} ({len(df)} participants) to {path}")
+    return path
+
+
+def merge_shards(
+    shard_dir: Path,
+    count: int,
+    missing_log: Optional[MissingDataLog] = None
+) -> pd.DataFrame:
+    """
+    读取全部 count 个分片的部分输出并合并为按 participant_id 排序的表。
+    
+    提供 missing_log 时同时并入各分片的缺失数据记录。
+    
+    异常:
+        FileNotFoundError: 有分片的部分输出（或提供 missing_log 时的缺失数据记录）不存在
+        ValueError: 各分片的列不一致，或同一受试者出现在多个分片中
+    """
+    paths = [shard_path(shard_dir, index, count) for index in range(count)]
+    if missing_log is not None:
+        paths += [shard_missing_path(shard_dir, index, count) for index in range(count)]
+    missing = [path.name for path in paths if not path.exists()]
+    if missing:
+        raise FileNotFoundError(f"Missing {len(missing)} of {len(paths)} shard outputs in {shard_dir}: {missing}")
+    if missing_log is not None:
+        for path in paths[count:]:
+            missing_log.add_frame(pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False))
+        paths = paths[:count]
+    
+    frames = [pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False) for path in paths]
+    # 空分片（受试者少于分片数）只有表头，不参与列检查
+    columns = [list(frame.columns) for frame in frames if len(frame)]
+    if any(frame_columns != columns[0] for frame_columns in columns):
+        raise ValueError(f"Shard outputs in {shard_dir} have different columns")
+    df = pd.concat([frame for frame in frames if len(frame)], ignore_index=True)
+    duplicated = df.loc[df['participant_id'].duplicated(), 'participant_id'].tolist()
+    if duplicated:
+        raise ValueError(f"Participants found in more than one shard: {duplicated[:10]}")
+    
+    df, _ = sort_participant_rows(df)
+    logger.info(f"Merged {count} shards: {len(df)} participants")
     return df
 
 
-def main():
+def write_participants_table(
+    df: pd.DataFrame,
+    output_file: Path,
+    output_formats: Tuple[str, ...] = ('tsv',),
+    bids_dir: Optional[Path] = None
+) -> List[Path]:
+    """
+    按 output_formats 写出 participants 表。
+    
+    'tsv' 写到 output_file（BIDS 的 participants.tsv）；'parquet' 写到同名 .parquet 文件
+    （需要 pyarrow；位于 bids_dir 根目录时加入 .bidsignore）。
+    
+    返回:
+        List[Path]: 写出的文件
+    """
+    output_file = Path(output_file)
+    paths = []
+    for output_format in output_formats:
+        if output_format == 'tsv':
+            # 将 DataFrame 保存为制表符分隔的 TSV 文件，不包含行索引，使用 UTF-8 编码
+            df.to_csv(output_file, sep='\t', index=False, encoding='utf-8')
+            paths.append(output_file)
+        elif output_format == 'parquet':
+            path = output_file.with_suffix('.parquet')
+            df.to_parquet(path, index=False)
+            if bids_dir is not None and path.parent.resolve() == Path(bids_dir).resolve():
+                ensure_bidsignore(path.parent, path.name)
+            paths.append(path)
+        else:
+            raise ValueError(f"Unknown output format: {output_format} (expected one of {OUTPUT_FORMATS})")
+    return paths
+
+
+def generate_participants(
+    bids_dir: Path,
+    clinical_dir: Path,
+    output_file: Optional[Path] = None,
+    cache_dir: Optional[Path] = CLINICAL_CACHE_DIR,
+    output_formats: Tuple[str, ...] = ('tsv',),
+    load_workers: Optional[int] = LOAD_WORKERS,
+    shards: int = SHARD_COUNT,
+    workers: Optional[int] = SHARD_WORKERS,
+    shard: Optional[int] = None,
+    merge: bool = False,
+    shard_dir: Optional[Path] = None,
+    backend: Optional[str] = None,
+    incremental: bool = INCREMENTAL_UPDATE,
+    long_outputs: bool = WRITE_LONG_OUTPUTS,
+    write_issues: bool = WRITE_MISSING_ISSUES,
+    recorder: Optional[StageRecorder] = None
+) -> Optional[pd.DataFrame]:
     """
-    主函数：生成 BIDS 兼容的 participants.tsv 文件。
+    生成 BIDS 兼容的 participants.tsv（可在其他进程/调度器中直接调用，不依赖路径常量）。
     
     功能概述：
       1. 从 BIDS 数据目录中扫描所有受试者及其 session；
       2. 依次处理各类临床/人口学字段（如年龄、性别、EDSS、T25FW 等）；
       3. 将所有字段合并到一个 DataFrame 中；
       4. 按照预定义顺序排列列；
-      5. 保存为制表符分隔的 TSV 文件。
+      5. 按 output_formats 保存，并在旁边记录源指纹。
     
-    依赖全局变量（应在脚本其他位置定义）：
-      - BIDS_DATA_DIR: BIDS 格式数据根目录（Path 对象）
-      - CLINICAL_DATA_DIR: 临床 Excel 数据所在目录（Path 对象）
-      - OUTPUT_FILE: 输出文件路径（如 Path("participants.tsv")）
-      - logger: 已配置的日志记录器
+    incremental 为 True 且上次运行留下了指纹时，只重算发生变化的行和列
+    （见 update_participants_table）。
+    
+    shards > 1 时按受试者分片，在进程池中分别计算后合并（见 build_participants_sharded）。
+    多节点运行时每个节点传入 shard=K 只计算一个分片并写出部分输出，全部完成后再用
+    merge=True 合并为 participants.tsv（同时写出长格式文件）。
+    
+    同一进程中可以对不同数据集并发调用；临床表注册中心按临床数据目录共享，
+    同一目录只加载一次（cache_dir 以第一次调用为准）。
+    
+    参数:
+        bids_dir (Path): BIDS 数据根目录
+        clinical_dir (Path): 临床 Excel 数据所在目录
+        output_file (Path, 可选): 输出路径（默认 <bids_dir>/participants.tsv）
+        cache_dir (Path, 可选): 临床 Excel 的 Parquet 缓存目录（None 表示不缓存）
+        output_formats (Tuple[str, ...]): 输出格式，见 OUTPUT_FORMATS
+        load_workers (int, 可选): 并行加载工作簿的进程数（None → min(工作簿数, CPU 核数)；1 → 串行）
+        shards (int): 按受试者分片的数量
+        workers (int, 可选): 分片计算的并行进程数（None → min(分片数, CPU 核数)）
+        shard (int, 可选): 多节点模式下本节点计算的分片序号（从 0 开始）
+        merge (bool): 多节点模式：合并 shard_dir 中全部分片的部分输出
+        shard_dir (Path, 可选): 分片部分输出的目录（默认 output_file 所在目录）
+        backend (str, 可选): session 级量表的匹配实现（默认 MEASURE_BACKEND）
+        incremental (bool): 是否增量更新
+        long_outputs (bool): 是否同时写出长格式的 sessions.tsv、phenotype/*.tsv 和 Parquet
+        write_issues (bool): 是否把缺失数据记录写入 <bids_dir>/issues.tsv
+        recorder (StageRecorder, 可选): 各阶段的计时记录器（默认不统计内存峰值；
+            tracemalloc 是进程全局的，并发调用时不应开启）
+    
+    返回:
+        pd.DataFrame 或 None: 生成的 participants 表（多节点模式下为本分片的行）；
+            BIDS 目录中没有受试者时返回 None
     """
+    bids_dir = Path(bids_dir)
+    clinical_dir = Path(clinical_dir)
+    output_file = Path(output_file) if output_file is not None else bids_dir / "participants.tsv"
+    shard_dir = Path(shard_dir) if shard_dir is not None else output_file.parent
+    if recorder is None:
+        recorder = StageRecorder(trace_memory=False)
+    missing_log = MissingDataLog()
+    registry = get_table_registry(clinical_dir, cache_dir)
     
-    logger.info("Starting participants.tsv generation...")
+    logger.info(f"Starting participants.tsv generation for {bids_dir}...")
     
     # 从 BIDS 目录结构中自动提取所有受试者 ID 及其对应的 session 日期列表
     # 返回格式：{'sub-001': ['2023-01-15', '2023-06-20'], 'sub-002': [...], ...}
-    participants = get_participants_and_sessions(BIDS_DATA_DIR)
+    with recorder.stage('scan_sessions') as record:
+        participants = get_participants_and_sessions(bids_dir)
+        record['rows'] = sum(len(sessions) for sessions in participants.values())
     
     # 如果未找到任何受试者，记录错误并退出
     if not participants:
         logger.error("No participants found in BIDS directory!")
-        return
-    
-    # 初始化空的 pandas DataFrame，用于逐步添加各字段
-    df = pd.DataFrame()
-    
-    # ———————— 逐个处理各字段 ————————
-    
-    logger.info("Processing participant_id field...")
-    # 生成 'participant_id' 列（如 sub-001, sub-002...）
-    df = process_participant_id_field(participants)
-    
-    logger.info("Processing session field...")
-    # 生成 'session' 列，每个受试者对应多个 session，值为逗号分隔的日期字符串
-    df = process_session_field(participants, df)
-    
-    logger.info("Processing age field...")
-    # 从临床数据中提取每个 session 对应的年龄（可能基于出生日期和 session 日期动态计算）
-    df = process_age_field(participants, df, CLINICAL_DATA_DIR)
-    
-    logger.info("Processing sex field...")
-    # 提取性别信息（通常为静态字段，但按 session 重复填充以保持结构一致）
-    df = process_sex_field(df, CLINICAL_DATA_DIR)
-    
-    logger.info("Processing is_ms field...")
-    # 标记是否为多发性硬化症患者（MS vs HC），通常为二元标签（如 'yes'/'no' 或 1/0）
-    df = process_is_ms_field(df, CLINICAL_DATA_DIR)
-    
-    logger.info("Processing sdmt field...")
-    # SDMT（Symbol Digit Modalities Test）认知测试得分
-    df = process_sdmt_field(participants, df, CLINICAL_DATA_DIR)
-    
-    logger.info("Processing 9hpt fields...")
-    # 9-Hole Peg Test（九孔 peg 测试）：分别处理优势手（dominant）和非优势手（non-dominant）
-    # 同时可能包含 'handedness'（利手）字段
-    df = process_9hpt_fields(participants, df, CLINICAL_DATA_DIR)
-    
-    logger.info("Processing edss field...")
-    # EDSS（Expanded Disability Status Scale）残疾评分
-    df = process_edss_field(participants, df, CLINICAL_DATA_DIR)
+        return None
     
-    logger.info("Processing t25fw field...")
-    # T25FW（Timed 25-Foot Walk）行走时间测试
-    df = process_t25fw_field(participants, df, CLINICAL_DATA_DIR)
+    if shard is not None:
+        # 多节点模式：只计算本节点的分片
+        shard_participants = partition_participants(participants, shards)[shard]
+        with recorder.stage('build_shard') as record:
+            if shard_participants:
+                df, _ = build_participants_table(
+                    shard_participants, clinical_dir, backend=backend, missing_log=missing_log
+                )
+                df = order_participant_columns(df)
+            else:
+                # 受试者少于分片数时写出只有表头的空分片，合并时会被跳过
+                df = pd.DataFrame(columns=['participant_id'])
+            write_shard(df, shard_dir, shard, shards, missing_log)
+            record['rows'] = len(df)
+        missing_log.log_summary()
+        return df
     
-    logger.info("Processing education field...")
-    # 教育年限（如 12 年、16 年等）
-    df = process_education_field(participants, df, CLINICAL_DATA_DIR)
+    with recorder.stage('fingerprint'):
+        fingerprint = compute_fingerprint(participants, clinical_dir)
+    
+    df = None
+    measures = None
+    changed = True
+    if merge:
+        with recorder.stage('merge_shards') as record:
+            df = merge_shards(shard_dir, shards, missing_log)
+            record['rows'] = len(df)
+        if set(df['participant_id']) != set(participants):
+            raise ValueError(
+                f"Shard outputs in {shard_dir} do not cover the participants in {bids_dir}; "
+                "rerun the shards after the BIDS directory changed"
+            )
+    elif incremental:
+        with recorder.stage('incremental_update') as record:
+            result = update_participants_table(
+                participants, clinical_dir, output_file, fingerprint,
+                backend=backend, missing_log=missing_log
+            )
+            record['rows'] = None if result is None else len(result[0])
+        if result is None:
+            logger.info("No usable previous run found, regenerating all rows")
+        else:
+            df, changed = result
+    
+    if df is None:
+        # 在进程池中并行加载所有临床工作簿（各字段函数随后直接从注册中心取表）
+        with recorder.stage('load_tables') as record:
+            registry.preload(max_workers=load_workers)
+            record['rows'] = sum(stat['rows'] for stat in registry.load_stats.values())
+        if shards > 1:
+            with recorder.stage('build_shards') as record:
+                df, measures = build_participants_sharded(
+                    participants, clinical_dir, shards, max_workers=workers,
+                    backend=backend, missing_log=missing_log, cache_dir=cache_dir
+                )
+                record['rows'] = len(df)
+        else:
+            df, measures = build_participants_table(
+                participants, clinical_dir, recorder=recorder, backend=backend,
+                missing_log=missing_log
+            )
     
     # ———————— 列顺序标准化 ————————
     
-    # 定义最终 TSV 文件的列顺序，确保符合 BIDS 或项目规范
-    column_order = [
-        'participant_id', 'session', 'age', 'sex', 'is_ms', 'sdmt',
-        '9hpt_dom', '9hpt_ndom', 'handedness', 'edss', 't25fw', 'education'
-    ]
-    
-    # 按指定顺序重排 DataFrame 的列
-    # 注意：若某列不存在会报错，因此需确保所有字段处理函数都已正确执行
-    df = df[column_order]
+    df = order_participant_columns(df)
     
     # ———————— 保存结果 ————————
     
-    # 将 DataFrame 保存为制表符分隔的 TSV 文件，不包含行索引，使用 UTF-8 编码
-    df.to_csv(OUTPUT_FILE, sep='\t', index=False, encoding='utf-8')
+    if changed:
+        with recorder.stage('write_tsv') as record:
+            write_participants_table(df, output_file, output_formats, bids_dir)
+            record['rows'] = len(df)
+    else:
+        logger.info("Sources unchanged, participants.tsv is up to date")
+    save_fingerprint(output_file, fingerprint)
+    
+    # 同时写出长格式文件：每个 (受试者, session) 一行，数值列带类型
+    if long_outputs and changed:
+        logger.info("Writing long-format session and phenotype outputs...")
+        with recorder.stage('long_outputs') as record:
+            if measures is None:
+                # 增量更新或合并分片时长表需要所有受试者的 session 级量表
+                measures = compute_session_measures(
+                    participants, df['participant_id'].tolist(), clinical_dir,
+                    backend=backend
+                )
+            # 长表中的 age 用 float 年龄（participants.tsv 中的是两位小数的字符串）
+            birth_table = get_table_registry(clinical_dir).get('sDOB')
+            session_ages = (
+                compute_session_ages(participants, df['participant_id'].tolist(), birth_table)
+                if birth_table is not None else None
+            )
+            session_table = write_long_outputs(
+                df, measures.long, session_ages, bids_dir,
+                {spec.key: output_columns(spec) for spec in resolve_instrument_specs()}
+            )
+            record['rows'] = len(session_table)
+    
+    # 所有字段的缺失记录：每个字段一行计数，完整记录批量写入 issues.tsv（替换上次的记录；
+    # 合并分片时为各分片写出的记录）；来源未变化时上次的记录仍然有效
+    missing_log.log_summary()
+    if write_issues and changed:
+        with recorder.stage('write_issues') as record:
+            record['rows'] = missing_log.write_issues(bids_dir / 'issues.tsv', bids_dir)
+    
+    # 汇总各临床表的加载耗时和内存占用
+    registry.log_summary()
     
     # 记录成功日志
-    logger.info(f"Successfully generated participants.tsv at {OUTPUT_FILE}")
+    logger.info(f"Successfully generated participants.tsv at {output_file}")
     logger.info(f"Total participants: {len(df)}")
+    return df
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    解析命令行参数（未指定的选项使用文件开头的常量作为默认值）。
+    """
+    parser = argparse.ArgumentParser(
+        description='从BIDS目录和临床数据生成participants.tsv'
+    )
+    parser.add_argument(
+        '--bids_dir',
+        type=str,
+        default=None,
+        help=f'BIDS数据集目录路径 (默认: {BIDS_DATA_DIR})'
+    )
+    parser.add_argument(
+        '--clinical_dir',
+        type=str,
+        default=None,
+        help=f'临床Excel数据目录路径 (默认: {CLINICAL_DATA_DIR})'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help=f'输出文件路径 (默认: <bids_dir>/participants.tsv；未指定 --bids_dir 时为 {OUTPUT_FILE})'
+    )
+    parser.add_argument(
+        '--format',
+        choices=OUTPUT_FORMATS,
+        nargs='+',
+        default=['tsv'],
+        help="输出格式，可同时指定多个；parquet 写到与输出文件同名的 .parquet 文件 (默认: tsv)"
+    )
+    parser.add_argument(
+        '--cache_dir',
+        type=str,
+        default=str(CLINICAL_CACHE_DIR) if CLINICAL_CACHE_DIR else None,
+        help=f'临床Excel的Parquet缓存目录 (默认: {CLINICAL_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help='不使用临床表的Parquet缓存'
+    )
+    parser.add_argument(
+        '--load_workers',
+        type=int,
+        default=LOAD_WORKERS,
+        help='并行加载工作簿的进程数 (默认: min(工作簿数, CPU核数)；1 → 串行)'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        default=INCREMENTAL_UPDATE,
+        help='增量模式：只重算session列表变化的受试者和内容变化的工作簿对应的列'
+    )
+    parser.add_argument(
+        '--no_long_outputs',
+        action='store_true',
+        help='不写出长格式的 sessions.tsv、phenotype/*.tsv 和 Parquet'
+    )
+    parser.add_argument(
+        '--no_issues',
+        action='store_true',
+        help='不把缺失数据记录写入 issues.tsv'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        metavar='DIR',
+        help='为每个处理阶段写出 cProfile 结果（<DIR>/<序号>_<阶段>.prof）'
+    )
+    parser.add_argument(
+        '--stage_report',
+        type=str,
+        nargs='?',
+        const='',
+        default=str(STAGE_REPORT_FILE) if STAGE_REPORT_FILE else None,
+        help='写出各阶段耗时/内存报告 JSON；不带路径时写到输出文件旁的 <输出文件名>_stages.json (默认: 不写)'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default=MEASURE_BACKEND,
+        help=f'session级量表的匹配实现 (默认: {MEASURE_BACKEND})；polars 需要安装 polars，输出与 pandas 相同'
+    )
+    parser.add_argument(
+        '--trace_memory',
+        action='store_true',
+        default=TRACE_STAGE_MEMORY,
+        help='用 tracemalloc 统计各阶段的内存峰值（会使处理明显变慢）'
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=SHARD_COUNT,
+        help=f'按受试者分片计算的分片数；>1 时结果按 participant_id 排序 (默认: {SHARD_COUNT})'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=SHARD_WORKERS,
+        help='分片计算的并行进程数 (默认: min(分片数, CPU核数))'
+    )
+    parser.add_argument(
+        '--shard',
+        type=int,
+        default=None,
+        metavar='K',
+        help='多节点模式：只计算第 K 个分片（从 0 开始，共 --shards 个），写出部分输出到 --shard_dir'
+    )
+    parser.add_argument(
+        '--merge_shards',
+        action='store_true',
+        help='多节点模式：合并 --shard_dir 中全部 --shards 个部分输出，写出 participants.tsv'
+    )
+    parser.add_argument(
+        '--shard_dir',
+        type=str,
+        default=None,
+        help='分片部分输出的目录 (默认: 输出文件所在目录)'
+    )
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        parser.error(f'--shard must be between 0 and {args.shards - 1}')
+    if args.shard is not None and args.merge_shards:
+        parser.error('--shard and --merge_shards are mutually exclusive')
+    return args
+
+
+def configure_logging():
+    """
+    配置命令行运行时的日志：同时写入 participants_generation.log 和控制台。
+    """
+    logging.basicConfig(
+        level=logging.INFO,  # 设置日志级别为 INFO，会记录 INFO 及以上级别的日志（如 WARNING、ERROR）
+        format='%(asctime)s - %(levelname)s - %(message)s',  # 日志格式：时间 - 日志级别 - 消息内容
+        handlers=[
+            logging.FileHandler('participants_generation.log', encoding='utf-8'),  # 将日志写入文件，使用 UTF-8 编码支持中文等字符
+            logging.StreamHandler()  # 同时将日志输出到控制台（标准输出）
+        ]
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    命令行入口：解析参数后调用 generate_participants。
+    
+    每个阶段的墙钟/CPU 时间和行数在结束时汇总到日志（--trace_memory 时另有 tracemalloc 内存峰值），
+    指定 --stage_report 时写入 JSON；--profile 另外为每个阶段写出 cProfile 结果。
+    """
+    configure_logging()
+    args = parse_args(argv)
+    
+    bids_dir = Path(args.bids_dir) if args.bids_dir else BIDS_DATA_DIR
+    if args.output:
+        output_file = Path(args.output)
+    else:
+        output_file = bids_dir / "participants.tsv" if args.bids_dir else OUTPUT_FILE
+    
+    recorder = StageRecorder(
+        trace_memory=args.trace_memory,
+        profile_dir=Path(args.profile) if args.profile else None
+    )
+    try:
+        generate_participants(
+            bids_dir,
+            Path(args.clinical_dir) if args.clinical_dir else CLINICAL_DATA_DIR,
+            output_file,
+            cache_dir=None if args.no_cache or not args.cache_dir else Path(args.cache_dir),
+            output_formats=tuple(args.format),
+            load_workers=args.load_workers,
+            shards=args.shards,
+            workers=args.workers,
+            shard=args.shard,
+            merge=args.merge_shards,
+            shard_dir=Path(args.shard_dir) if args.shard_dir else None,
+            backend=args.backend,
+            incremental=args.incremental,
+            long_outputs=WRITE_LONG_OUTPUTS and not args.no_long_outputs,
+            write_issues=WRITE_MISSING_ISSUES and not args.no_issues,
+            recorder=recorder
+        )
+    finally:
+        # 汇总各阶段的耗时（出错时同样写出已完成阶段的报告）
+        recorder.stop()
+        recorder.log_summary()
+        if args.stage_report is not None:
+            recorder.write_json(
+                Path(args.stage_report) if args.stage_report
+                else output_file.with_name(f"{output_file.stem}_stages.json")
+            )
+    
     logger.info("Generation complete!")
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Typed, in-memory query API over the participants outputs.
+
+participants.tsv 把每个 session 的值用逗号拼接在一个单元格里，分析服务每次请求都要重新拆分。
+ParticipantsTable 只加载一次，把数据保存为每个 (受试者, session) 一行的定长数组：
+
+    数值字段（age、sdmt、9hpt_dom、9hpt_ndom、edss、t25fw、education、*_offset_days）→ float64 数组
+    文本字段（sex、handedness 等）→ 整数编码数组 + 类别表
+    is_ms → bool 数组
+    (participant_id, session_date) → 行号 的字典索引
+
+因此 get(participant_id, session_date, field) 是一次字典查找加一次数组取值，
+按 is_ms、年龄范围、EDSS 阈值等筛选队列是整列的向量化比较。
+
+优先读取 participants.py 写出的 participants_sessions.parquet（带类型的长表）；
+没有 Parquet 时拆分 participants.tsv（拆分后个数与 session 数不一致的单元格，
+如含德式小数逗号的 EDSS，该受试者的这一字段全部记为缺失）。
+
+用法:
+    table = ParticipantsTable.load(Path('/data/bids_data'))
+    table.get('sub-500000017', '20180212', 'edss')
+    cohort = table.filter(is_ms=True, age=(30, 50), edss=(None, 4.0))
+"""
+
+import logging
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from session_outputs import SESSIONS_PARQUET_FILENAME, to_numeric_values, unpack_session_column
+
+logger = logging.getLogger(__name__)
+
+# participants.tsv 中每个 session 一个值（逗号拼接）的数值列
+SESSION_NUMERIC_FIELDS = ('age', 'sdmt', '9hpt_dom', '9hpt_ndom', 'edss', 't25fw', 'education')
+
+# participants.tsv 中每个受试者一个值的文本列
+PARTICIPANT_TEXT_FIELDS = ('sex', 'handedness')
+
+# 不作为查询字段的列
+_KEY_COLUMNS = ('participant_id', 'session_id', 'session_date')
+
+SessionDate = Union[str, date, datetime, np.datetime64, pd.Timestamp]
+Range = Tuple[Optional[float], Optional[float]]
+
+
+def session_key(session_date: SessionDate) -> str:
+    """
+    将 session 日期标准化为 'YYYYMMDD'（接受 'YYYYMMDD'、'YYYY-MM-DD'、date/datetime/Timestamp）。
+    """
+    if isinstance(session_date, str) and len(session_date) == 8 and session_date.isdigit():
+        return session_date
+    return pd.Timestamp(session_date).strftime('%Y%m%d')
+
+
+class ParticipantsTable:
+    """
+    以数组存储的 participants 长表（每个 (受试者, session) 一行），支持 O(1) 取值和向量化筛选。
+
+    属性:
+        participant_ids (np.ndarray): 每行的 participant_id（object 数组）
+        session_dates (np.ndarray): 每行的 session 日期（datetime64[D]）
+        numeric (Dict[str, np.ndarray]): 数值字段 → float64 数组（缺失为 NaN）
+        categorical (Dict[str, Tuple[np.ndarray, np.ndarray]]): 文本字段 → (int16 编码, 类别数组)，
+            编码 -1 表示缺失
+        is_ms (np.ndarray): bool 数组（'1' 为 True，其余为 False）
+    """
+
+    def __init__(self, participant_ids: np.ndarray, session_dates: np.ndarray,
+                 numeric: Dict[str, np.ndarray],
+                 categorical: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                 is_ms: np.ndarray):
+        self.participant_ids = participant_ids
+        self.session_dates = session_dates.astype('datetime64[D]')
+        self.numeric = numeric
+        self.categorical = categorical
+        self.is_ms = is_ms
+
+        session_keys = pd.DatetimeIndex(self.session_dates).strftime('%Y%m%d')
+        self._rows: Dict[Tuple[str, str], int] = {
+            key: row for row, key in enumerate(zip(participant_ids, session_keys))
+        }
+
+    # ———————— 构造 ————————
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'ParticipantsTable':
+        """
+        由长表构造（列 participant_id、session_date 以及各字段；即 participants_sessions.parquet 的内容）。
+
+        数值列转为 float64，is_ms 转为 bool，其余列按文本编码。
+        """
+        numeric, categorical = {}, {}
+        is_ms = np.zeros(len(frame), dtype=bool)
+        for column in frame.columns:
+            if column in _KEY_COLUMNS:
+                continue
+            values = frame[column]
+            if column == 'is_ms':
+                is_ms = (values.astype(str) == '1').to_numpy()
+            elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                numeric[column] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                codes, categories = pd.factorize(values.where(values.notna(), None))
+                categorical[column] = (codes.astype(np.int16), np.asarray(categories, dtype=object))
+
+        session_dates = pd.to_datetime(frame['session_date'], format='%Y%m%d') \
+            if not pd.api.types.is_datetime64_any_dtype(frame['session_date']) else frame['session_date']
+        return cls(
+            frame['participant_id'].to_numpy(dtype=object),
+            session_dates.to_numpy(dtype='datetime64[D]'),
+            numeric, categorical, is_ms
+        )
+
+    @classmethod
+    def from_parquet(cls, path: Path) -> 'ParticipantsTable':
+        """
+        读取 participants_sessions.parquet（session_outputs.write_sessions_parquet 的输出）。
+        """
+        return cls.from_frame(pd.read_parquet(path))
+
+    @classmethod
+    def from_tsv(cls, path: Path) -> 'ParticipantsTable':
+        """
+        读取并拆分 participants.tsv。
+
+        session 级字段按 session 列的顺序拆开；拆分后个数与 session 数不一致的受试者
+        （如 EDSS 值本身带小数逗号）该字段全部记为缺失。sex、handedness、is_ms 按受试者重复。
+        """
+        packed = pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False)
+        participants = {
+            participant_id: sessions.split(',') if sessions else []
+            for participant_id, sessions in zip(packed['participant_id'], packed['session'])
+        }
+        counts = [len(participants[participant_id]) for participant_id in packed['participant_id']]
+
+        frame = pd.DataFrame({
+            'participant_id': np.repeat(packed['participant_id'].to_numpy(dtype=object), counts),
+            'session_date': [date for dates in participants.values() for date in dates],
+        })
+        for column in packed.columns:
+            if column in SESSION_NUMERIC_FIELDS or column.endswith('_offset_days'):
+                frame[column] = to_numeric_values(
+                    unpack_session_column(participants, packed, column)
+                ).to_numpy()
+            elif column in PARTICIPANT_TEXT_FIELDS or column == 'is_ms':
+                frame[column] = np.repeat(
+                    packed[column].replace('', None).to_numpy(dtype=object), counts
+                )
+        return cls.from_frame(frame)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ParticipantsTable':
+        """
+        加载 BIDS 根目录下的 participants 输出（优先 Parquet），或直接加载给定的 .parquet / .tsv 文件。
+        """
+        path = Path(path)
+        if path.is_dir():
+            parquet_path = path / SESSIONS_PARQUET_FILENAME
+            if parquet_path.exists():
+                try:
+                    return cls.from_parquet(parquet_path)
+                except Exception as e:
+                    logger.warning(f"Could not read {parquet_path.name}, falling back to participants.tsv: {e}")
+            path = path / 'participants.tsv'
+        if path.suffix == '.parquet':
+            return cls.from_parquet(path)
+        return cls.from_tsv(path)
+
+    # ———————— 查询 ————————
+
+    def __len__(self) -> int:
+        return len(self.participant_ids)
+
+    @property
+    def fields(self) -> List[str]:
+        """
+        所有可查询的字段名。
+        """
+        return list(self.numeric) + list(self.categorical) + ['is_ms']
+
+    def row(self, participant_id: str, session_date: SessionDate) -> Optional[int]:
+        """
+        返回 (受试者, session) 的行号（不存在时为 None）。
+        """
+        return self._rows.get((participant_id, session_key(session_date)))
+
+    def get(self, participant_id: str, session_date: SessionDate, field: str):
+        """
+        返回某个 session 的字段值：数值字段为 float（缺失为 None），文本字段为 str 或 None，is_ms 为 bool。
+
+        参数:
+            participant_id (str): 如 'sub-500000017'
+            session_date: 'YYYYMMDD'、'YYYY-MM-DD' 或日期对象
+            field (str): 字段名（见 fields）
+
+        返回:
+            字段值；受试者或 session 不存在时为 None
+
+        异常:
+            KeyError: 字段名不存在
+        """
+        row = self.row(participant_id, session_date)
+        if field in self.numeric:
+            if row is None:
+                return None
+            value = self.numeric[field][row]
+            return None if np.isnan(value) else float(value)
+        if field in self.categorical:
+            if row is None:
+                return None
+            codes, categories = self.categorical[field]
+            code = codes[row]
+            return None if code < 0 else categories[code]
+        if field == 'is_ms':
+            return None if row is None else bool(self.is_ms[row])
+        raise KeyError(f"Unknown field: {field}")
+
+    def between(self, field: str, low: Optional[float] = None, high: Optional[float] = None) -> np.ndarray:
+        """
+        数值字段在 [low, high] 内（含端点；None 表示不限）的行掩码，缺失值为 False。
+        """
+        if field not in self.numeric:
+            raise KeyError(f"Unknown numeric field: {field}")
+        values = self.numeric[field]
+        mask = ~np.isnan(values)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+        return mask
+
+    def isin(self, field: str, values: Iterable[str]) -> np.ndarray:
+        """
+        文本字段取值属于 values 的行掩码。
+        """
+        if field not in self.categorical:
+            raise KeyError(f"Unknown text field: {field}")
+        codes, categories = self.categorical[field]
+        wanted = np.flatnonzero(np.isin(categories, list(values)))
+        return np.isin(codes, wanted)
+
+    def mask(self, is_ms: Optional[bool] = None,
+             participant_ids: Optional[Iterable[str]] = None,
+             **conditions: Union[Range, str, Iterable[str]]) -> np.ndarray:
+        """
+        组合多个条件（逻辑与）的行掩码。
+
+        参数:
+            is_ms (bool, 可选): 只保留 MS（True）或非 MS（False）
+            participant_ids (Iterable[str], 可选): 只保留这些受试者
+            **conditions: 字段名 → 条件：数值字段为 (low, high) 区间（含端点，None 表示不限），
+                文本字段为单个取值或取值列表，如 age=(30, 50)、edss=(None, 4.0)、sex='female'
+
+        返回:
+            np.ndarray: bool 数组
+        """
+        result = np.ones(len(self), dtype=bool)
+        if is_ms is not None:
+            result &= self.is_ms == is_ms
+        if participant_ids is not None:
+            result &= np.isin(self.participant_ids, list(participant_ids))
+        for field, condition in conditions.items():
+            if field in self.numeric:
+                low, high = condition
+                result &= self.between(field, low, high)
+            else:
+                result &= self.isin(field, [condition] if isinstance(condition, str) else condition)
+        return result
+
+    def take(self, rows: np.ndarray) -> 'ParticipantsTable':
+        """
+        按行号或 bool 掩码取子表（各数组为副本）。
+        """
+        return ParticipantsTable(
+            self.participant_ids[rows],
+            self.session_dates[rows],
+            {field: values[rows] for field, values in self.numeric.items()},
+            {field: (codes[rows], categories) for field, (codes, categories) in self.categorical.items()},
+            self.is_ms[rows]
+        )
+
+    def filter(self, is_ms: Optional[bool] = None,
+               participant_ids: Optional[Iterable[str]] = None,
+               **conditions: Union[Range, str, Iterable[str]]) -> 'ParticipantsTable':
+        """
+        返回满足条件的子表（参数同 mask）。
+        """
+        return self.take(self.mask(is_ms, participant_ids, **conditions))
+
+    def sessions(self) -> List[Tuple[str, str]]:
+        """
+        返回所有行的 (participant_id, 'YYYYMMDD') 列表。
+        """
+        dates = pd.DatetimeIndex(self.session_dates).strftime('%Y%m%d')
+        return list(zip(self.participant_ids, dates))
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        转为 pandas 长表（文本字段为 category 类型）。
+        """
+        frame = pd.DataFrame({
+            'participant_id': self.participant_ids,
+            'session_date': self.session_dates.astype('datetime64[ns]'),
+            'is_ms': self.is_ms,
+        })
+        for field, values in self.numeric.items():
+            frame[field] = values
+        for field, (codes, categories) in self.categorical.items():
+            frame[field] = pd.Categorical.from_codes(codes, categories=categories)
+        return frame
+
+    def memory_usage(self) -> int:
+        """
+        各数组占用的字节数（不含 object 数组中字符串本身和行索引字典）。
+        """
+        arrays = [self.participant_ids, self.session_dates, self.is_ms]
+        arrays += list(self.numeric.values())
+        arrays += [codes for codes, _ in self.categorical.values()]
+        return sum(array.nbytes for array in arrays)
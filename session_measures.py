@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Session-level clinical measures for participants.py.
+
+每个临床量表（SDMT、9HPT、EDSS、T25FW、Education）由一个 InstrumentSpec 描述：
+工作簿、ID 列、评估日期列及其解析器、需要取出的数值列。
+
+所有受试者的所有 session 先展开成一张长表 (participant_id, session_date)，
+再与每个量表的 (标准化 ID, assessment_date, 数值列) 做一次向量化 merge，
+最后按受试者把各 session 的值用逗号拼接回 participants.tsv 的宽格式。
+
+默认匹配语义与原来的逐行循环一致：评估日期与 session 日期为同一天才算匹配；
+同一天有多条记录时取原表中的第一条（设置了 aggregate 的量表改为由该函数合并同一天的记录）；值为空/NaN 时输出 ''，否则输出 str(value)。
+
+为 spec 设置 tolerance_days 后改为最近访视匹配：用按日期排序的 merge_asof 为每个 session
+找 ±N 天内最近的评估（direction 为 'backward' / 'forward' 时只看 session 之前 / 之后），
+并额外输出 <key>_offset_days 列（评估日期 − session 日期，单位：天），便于分析时按偏移筛选。
+
+匹配步骤有两个实现（backend）：'pandas'（默认，match_sessions）和 'polars'
+（session_measures_polars.match_sessions_polars，需要安装 polars），两者输出完全相同。
+"""
+
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from clinical_tables import ASSESSMENT_DATE_COLUMN, ClinicalTable, ClinicalTableRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentSpec(NamedTuple):
+    """
+    单个临床量表的描述。
+
+    属性:
+        key (str): 表注册中心中的键（即 participants.EXCEL_FILES 的键），也用于日志
+        file (str): Excel 文件名
+        id_column (str): 受试者 ID 列名
+        date_column (str): 评估日期列名
+        date_parser (str): 日期解析器名称（见 clinical_tables.DATE_PARSERS）
+        value_columns (Dict[str, str]): 匹配后取出的列，{输出列名: 源列名}
+        derive (Callable 或 None): 由匹配到的原始值计算输出列的函数；
+            为 None 时每个 value_columns 直接格式化为字符串输出
+        derived_columns (Tuple[str, ...]): derive 产生的输出列名（derive 为 None 时不需要）
+        aggregate (Callable 或 None): 把同一受试者同一天的多条记录合并为一条的函数；
+            输入输出均为列 _id、_date 加 value_columns 的 DataFrame，输出每个 (_id, _date) 一行。
+            为 None 时取原表中的第一条
+        participant_columns (Tuple[str, ...]): 每个受试者只取第一个非空 session 值的输出列
+            （如 handedness），其余输出列按 session 用逗号拼接
+        tolerance_days (int 或 None): None 表示只接受同一天的评估；
+            否则接受与 session 相差不超过该天数的最近评估
+        direction (str): 'nearest'（前后皆可）、'backward'（只取 session 当天及之前）
+            或 'forward'（只取 session 当天及之后），仅在设置 tolerance_days 时生效
+    """
+    key: str
+    file: str
+    id_column: str
+    date_column: str
+    date_parser: str
+    value_columns: Dict[str, str]
+    derive: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None
+    derived_columns: Tuple[str, ...] = ()
+    aggregate: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None
+    participant_columns: Tuple[str, ...] = ()
+    tolerance_days: Optional[int] = None
+    direction: str = 'nearest'
+
+
+class SessionMeasures(NamedTuple):
+    """
+    join_session_measures 的结果。
+
+    属性:
+        wide (pd.DataFrame): 以 participant_id 为索引、每个输出列为逗号分隔字符串的宽表
+        long (pd.DataFrame): 每个 (participant_id, session_date) 一行的长表，输出列为单个字符串值
+        missing (Dict[str, List[str]]): {量表键: 未匹配的 'participant_session' 列表}
+    """
+    wide: pd.DataFrame
+    long: pd.DataFrame
+    missing: Dict[str, List[str]]
+
+
+# merge_asof 支持的方向
+MATCH_DIRECTIONS = ('nearest', 'backward', 'forward')
+
+# 可选的匹配实现
+BACKENDS = ('pandas', 'polars')
+
+
+def offset_column(spec: InstrumentSpec) -> str:
+    """
+    返回量表的日期偏移列名（如 'sdmt_offset_days'）。
+    """
+    return f"{spec.key}_offset_days"
+
+
+def output_columns(spec: InstrumentSpec) -> List[str]:
+    """
+    返回量表在 participants.tsv 中产生的列名。
+    """
+    columns = list(spec.value_columns) if spec.derive is None else list(spec.derived_columns)
+    if spec.tolerance_days is not None:
+        columns.append(offset_column(spec))
+    return columns
+
+
+def format_values(values: pd.Series) -> pd.Series:
+    """
+    将原始值格式化为输出字符串：空值/NaN/'' → ''，其余 → str(value)。
+    """
+    return values.map(lambda value: '' if pd.isna(value) or value == '' else str(value))
+
+
+def build_session_frame(
+    participants: Dict[str, List[str]],
+    participant_ids: List[str]
+) -> pd.DataFrame:
+    """
+    将 {participant_id: [session_date, ...]} 展开为长表，每个 (受试者, session) 一行。
+
+    参数:
+        participants (Dict[str, List[str]]): participant_id → session 日期列表（YYYYMMDD）
+        participant_ids (List[str]): 受试者顺序（与 participants.tsv 的行顺序一致）
+
+    返回:
+        pd.DataFrame: 列为 participant_id、numeric_id、session_date、session_ts，
+            行顺序为受试者顺序 × session 顺序
+    """
+    pairs = [
+        (participant_id, session_date)
+        for participant_id in participant_ids
+        for session_date in participants[participant_id]
+    ]
+    sessions = pd.DataFrame(pairs, columns=['participant_id', 'session_date'])
+    sessions['numeric_id'] = sessions['participant_id'].str.replace('sub-', '', regex=False)
+    sessions['session_ts'] = pd.to_datetime(
+        sessions['session_date'], format='%Y%m%d'
+    ).astype('datetime64[ns]')
+    return sessions
+
+
+def collapse_same_day(candidates: pd.DataFrame, spec: InstrumentSpec) -> pd.DataFrame:
+    """
+    将候选记录（列 _id、_date 加 value_columns）收敛为每个 (_id, _date) 一行：
+    spec.aggregate 为 None 时只保留原表中的第一条（与原逐行查找的 break 语义一致），
+    否则交给 spec.aggregate 合并。
+    """
+    if spec.aggregate is None:
+        return candidates.drop_duplicates(['_id', '_date'], keep='first')
+    return spec.aggregate(candidates)
+
+
+def match_sessions(
+    sessions: pd.DataFrame,
+    table: ClinicalTable,
+    spec: InstrumentSpec
+) -> pd.DataFrame:
+    """
+    将 session 长表与一个量表按 (ID, 日期) 做左连接。
+
+    spec.tolerance_days 为 None 时按同一天精确匹配；否则用 merge_asof 匹配
+    spec.direction 方向上 tolerance_days 天以内最近的评估。
+
+    参数:
+        sessions (pd.DataFrame): build_session_frame 的结果
+        table (ClinicalTable): 已建好 assessment_date 列的量表
+        spec (InstrumentSpec): 量表描述
+
+    返回:
+        pd.DataFrame: 与 sessions 同索引，包含 value_columns 中的输出列（未匹配为 NaN）、
+            布尔列 matched 以及 offset_days（评估日期 − session 日期，未匹配为 NaN）
+    """
+    source = table.df
+    candidates = pd.DataFrame({
+        '_id': table.normalized_ids,
+        '_date': source[ASSESSMENT_DATE_COLUMN],
+    })
+    for name, column in spec.value_columns.items():
+        candidates[name] = source[column]
+
+    candidates = collapse_same_day(candidates.dropna(subset=['_date']), spec)
+
+    if spec.tolerance_days is None:
+        matched = sessions[['numeric_id', 'session_ts']].merge(
+            candidates,
+            how='left',
+            left_on=['numeric_id', 'session_ts'],
+            right_on=['_id', '_date'],
+            sort=False,
+        )
+        matched.index = sessions.index
+    else:
+        if spec.direction not in MATCH_DIRECTIONS:
+            raise ValueError(f"Unknown match direction for {spec.key}: {spec.direction}")
+        # merge_asof 要求两侧都按日期排序；by 保证只在同一受试者内匹配
+        left = sessions[['numeric_id', 'session_ts']].sort_values('session_ts', kind='stable')
+        right = candidates.rename(columns={'_id': 'numeric_id'})
+        right['session_ts'] = right['_date']
+        right = right.sort_values('session_ts', kind='stable')
+        matched = pd.merge_asof(
+            left.reset_index(),
+            right,
+            on='session_ts',
+            by='numeric_id',
+            direction=spec.direction,
+            tolerance=pd.Timedelta(days=spec.tolerance_days),
+        ).set_index('index').reindex(sessions.index)
+        matched['session_ts'] = sessions['session_ts']
+
+    matched['matched'] = matched['_date'].notna()
+    matched['offset_days'] = (matched['_date'] - matched['session_ts']).dt.days
+    return matched[list(spec.value_columns) + ['matched', 'offset_days']]
+
+
+def get_matcher(backend: str) -> Callable[[pd.DataFrame, ClinicalTable, InstrumentSpec], pd.DataFrame]:
+    """
+    返回 backend 对应的匹配函数（'polars' 在此时才导入 polars）。
+    """
+    if backend == 'pandas':
+        return match_sessions
+    if backend == 'polars':
+        from session_measures_polars import match_sessions_polars
+        return match_sessions_polars
+    raise ValueError(f"Unknown backend: {backend} (expected one of {BACKENDS})")
+
+
+def join_session_measures(
+    participants: Dict[str, List[str]],
+    participant_ids: List[str],
+    registry: ClinicalTableRegistry,
+    specs: List[InstrumentSpec],
+    backend: str = 'pandas'
+) -> SessionMeasures:
+    """
+    一次性为所有受试者生成所有量表的 session 级字段。
+
+    参数:
+        participants (Dict[str, List[str]]): participant_id → session 日期列表
+        participant_ids (List[str]): 输出行顺序
+        registry (ClinicalTableRegistry): 临床表注册中心
+        specs (List[InstrumentSpec]): 要处理的量表
+        backend (str): 匹配实现，'pandas' 或 'polars'（见 BACKENDS）
+
+    返回:
+        SessionMeasures: 宽表、长表和未匹配的 session
+            （量表文件无法加载时该量表的输出列在宽表和长表中全部为 ''）
+    """
+    matcher = get_matcher(backend)
+    sessions = build_session_frame(participants, participant_ids)
+    result = pd.DataFrame(index=pd.Index(participant_ids, name='participant_id'))
+    long = sessions[['participant_id', 'session_date']].copy()
+    missing: Dict[str, List[str]] = {}
+
+    for spec in specs:
+        table = registry.get(spec.key)
+        if table is None:
+            for column in output_columns(spec):
+                result[column] = ''
+                long[column] = ''
+            continue
+
+        matched = matcher(sessions, table, spec)
+        if spec.derive is None:
+            values = pd.DataFrame({
+                column: format_values(matched[column]) for column in spec.value_columns
+            }, index=matched.index)
+        else:
+            values = spec.derive(matched[list(spec.value_columns)])[list(spec.derived_columns)]
+        if spec.tolerance_days is not None:
+            values[offset_column(spec)] = matched['offset_days'].map(
+                lambda days: '' if pd.isna(days) else str(int(days))
+            )
+
+        for column in output_columns(spec):
+            long[column] = values[column]
+
+        values['participant_id'] = sessions['participant_id']
+        grouped = values.groupby('participant_id', sort=False)
+        for column in output_columns(spec):
+            if column in spec.participant_columns:
+                # 取第一个非空值（全部为空时为 ''）
+                first = values[column].where(values[column] != '').groupby(
+                    values['participant_id'], sort=False
+                ).first()
+                result[column] = first.reindex(result.index).fillna('')
+            else:
+                result[column] = grouped[column].agg(','.join).reindex(result.index)
+
+        unmatched = sessions.loc[~matched['matched']]
+        missing[spec.key] = (unmatched['participant_id'] + '_' + unmatched['session_date']).tolist()
+
+    # 没有任何 session 的受试者（理论上不会出现）保持与原实现一致的空字符串
+    return SessionMeasures(result.fillna(''), long, missing)
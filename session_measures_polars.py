@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Polars backend for session_measures.match_sessions.
+
+与 session_measures.match_sessions 输入输出完全相同，但 ID 标准化、
+(ID, 日期) 去重和 session 连接都写成一个 Polars lazy 查询，由 Polars 多线程执行。
+
+评估日期直接取 ClinicalTable 已解析好的 assessment_date 列，与 pandas 后端共用同一个解析器。
+查询只返回每个 session 匹配到的原表行号和评估日期（设置了 aggregate 的量表先用 pandas 合并
+同一天的记录，再以合并结果的行号参与连接）；数值列仍从原 pandas 表按行号取出，
+因此缺失值补齐、int → float 提升等类型行为与 pandas 后端的 merge 完全一致，
+participants.tsv 的输出逐字节相同（可用 benchmark_participants.py --check_backends 验证）。
+
+需要安装 polars；session_measures 只在选择 'polars' 后端时才导入本模块。
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from clinical_tables import ASSESSMENT_DATE_COLUMN, ClinicalTable
+from session_measures import MATCH_DIRECTIONS, InstrumentSpec, collapse_same_day
+
+logger = logging.getLogger(__name__)
+
+_DATETIME = pl.Datetime('ns')
+
+
+def to_polars(values: pd.Series) -> pl.Series:
+    """
+    将 pandas 列转为 Polars 列；混合类型的 object 列（如同时含数字和字符串的 ID 列）
+    先把非空值转为 str（与 pandas 后端标准化 ID 时的 astype(str) 一致）。
+    """
+    try:
+        return pl.from_pandas(values)
+    except (TypeError, ValueError, pl.exceptions.PolarsError):
+        return pl.from_pandas(values.where(values.isna(), values.astype(str)))
+
+
+def _join_asof(left: pl.LazyFrame, candidates: pl.LazyFrame, tolerance_days: int, strategy: str) -> pl.LazyFrame:
+    """
+    在同一受试者内做按日期的 asof 连接（两侧先按日期全局排序）。
+    """
+    return left.sort('session_ts').join_asof(
+        candidates.sort('session_ts'),
+        on='session_ts',
+        by='numeric_id',
+        strategy=strategy,
+        tolerance=f"{tolerance_days}d",
+        # 已全局排序；带 by 分组时 Polars 无法自行检查，会发出警告
+        check_sortedness=False,
+    )
+
+
+def match_sessions_polars(
+    sessions: pd.DataFrame,
+    table: ClinicalTable,
+    spec: InstrumentSpec
+) -> pd.DataFrame:
+    """
+    session_measures.match_sessions 的 Polars 实现（参数和返回值相同）。
+    """
+    if spec.tolerance_days is not None and spec.direction not in MATCH_DIRECTIONS:
+        raise ValueError(f"Unknown match direction for {spec.key}: {spec.direction}")
+
+    source = table.df
+    # 取值用的表（列名为输出列名），按 _row 行号取值
+    value_source = source[list(spec.value_columns.values())].reset_index(drop=True)
+    value_source.columns = list(spec.value_columns)
+
+    raw = pl.DataFrame([
+        to_polars(source[table.id_column]).alias('_raw_id'),
+        to_polars(source[ASSESSMENT_DATE_COLUMN]).alias('_date'),
+    ])
+    keys = (
+        raw.lazy()
+        .with_row_index('_row')
+        .select(
+            '_row',
+            pl.col('_raw_id').cast(pl.Utf8).str.strip_chars().alias('numeric_id'),
+            pl.col('_date').cast(_DATETIME),
+        )
+        .drop_nulls('_date')
+    )
+    if spec.aggregate is None:
+        # 同一受试者同一天有多条记录时只保留原表中的第一条
+        keys = keys.unique(['numeric_id', '_date'], keep='first', maintain_order=True)
+    else:
+        # 合并函数是 pandas 代码：把键和数值列交给它，合并结果的行号代替原表行号参与连接
+        key_frame = keys.collect()
+        candidates = value_source.take(key_frame['_row'].to_numpy()).reset_index(drop=True)
+        candidates.insert(0, '_id', key_frame['numeric_id'].to_numpy())
+        candidates.insert(1, '_date', key_frame['_date'].to_numpy())
+        value_source = collapse_same_day(candidates, spec).reset_index(drop=True)
+        keys = pl.DataFrame({
+            '_row': np.arange(len(value_source), dtype=np.uint32),
+            'numeric_id': value_source['_id'].to_numpy(dtype=object),
+            '_date': value_source['_date'].to_numpy(),
+        }).lazy().with_columns(pl.col('numeric_id').cast(pl.Utf8), pl.col('_date').cast(_DATETIME))
+        value_source = value_source[list(spec.value_columns)]
+    candidates = keys.with_columns(pl.col('_date').alias('session_ts'))
+
+    left = pl.DataFrame({
+        '_pos': np.arange(len(sessions)),
+        'numeric_id': sessions['numeric_id'].to_numpy(dtype=object),
+        'session_ts': sessions['session_ts'].to_numpy(),
+    }).lazy().with_columns(pl.col('numeric_id').cast(pl.Utf8), pl.col('session_ts').cast(_DATETIME))
+
+    if spec.tolerance_days is None:
+        joined = left.join(candidates, on=['numeric_id', 'session_ts'], how='left')
+    elif spec.direction == 'nearest':
+        # Polars 的 nearest 在前后等距时取之后的评估，pandas merge_asof 取之前的；
+        # 分别做 backward / forward 连接，等距时取 backward，与 pandas 后端一致
+        backward = _join_asof(left, candidates, spec.tolerance_days, 'backward')
+        forward = _join_asof(left, candidates, spec.tolerance_days, 'forward').select(
+            '_pos', pl.col('_row').alias('_row_forward'), pl.col('_date').alias('_date_forward')
+        )
+        distance_backward = (pl.col('session_ts') - pl.col('_date')).abs()
+        distance_forward = (pl.col('_date_forward') - pl.col('session_ts')).abs()
+        use_forward = pl.col('_date_forward').is_not_null() & (
+            pl.col('_date').is_null() | (distance_forward < distance_backward)
+        )
+        joined = backward.join(forward, on='_pos', how='left').with_columns(
+            pl.when(use_forward).then(pl.col('_row_forward')).otherwise(pl.col('_row')).alias('_row'),
+            pl.when(use_forward).then(pl.col('_date_forward')).otherwise(pl.col('_date')).alias('_date'),
+        )
+    else:
+        joined = _join_asof(left, candidates, spec.tolerance_days, spec.direction)
+
+    result = (
+        joined
+        .with_columns((pl.col('_date') - pl.col('session_ts')).dt.total_days().alias('offset_days'))
+        .sort('_pos')
+        .select('_row', '_date', 'offset_days')
+        .collect()
+    )
+
+    # 按行号取值；未匹配的 session 用不存在的行号 -1，reindex 后为 NaN（类型提升与 merge 相同）
+    rows = result['_row'].cast(pl.Int64).fill_null(-1).to_numpy()
+    values = value_source.reindex(rows)
+    values.index = sessions.index
+
+    values['matched'] = result['_date'].is_not_null().to_numpy()
+    values['offset_days'] = result['offset_days'].cast(pl.Float64).to_numpy()
+    return values
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Long-format outputs for participants.py.
+
+participants.tsv 把每个 session 的值用逗号拼接在一个单元格里（如 age = '41.20,42.18'），
+下游每次都要自己拆分并与 session 列对齐。这里把同样的数据另外写成长格式：
+
+    <bids>/sub-<id>/sub-<id>_sessions.tsv      每个 session 一行：session_id、session_date、age
+    <bids>/phenotype/<量表>.tsv                 每个有数据的 (受试者, session) 一行：量表各列
+    <bids>/participants_sessions.parquet       每个 (受试者, session) 一行：全部字段（带类型）
+
+数值列在这些文件中是真正的数值（EDSS 的德式小数逗号 '2,5' 转为 2.5），缺失值在 TSV 中写为 'n/a'。
+age 取 participants.compute_session_ages 计算的 float（不经过 participants.tsv 的两位小数字符串），
+Parquet 中保留完整精度，只在写 sessions.tsv 时保留两位小数。
+"""
+
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from bids_index import ensure_bidsignore
+
+logger = logging.getLogger(__name__)
+
+# 长格式 Parquet 文件名（位于 BIDS 根目录，并写入 .bidsignore）
+SESSIONS_PARQUET_FILENAME = 'participants_sessions.parquet'
+
+# 表型数据目录（BIDS 规范的 phenotype/）
+PHENOTYPE_DIRNAME = 'phenotype'
+
+# TSV 中的缺失值（BIDS 规范）
+NA_REP = 'n/a'
+
+# session 目录名：ses-<编号>_<日期>
+_SESSION_DIR_PATTERN = re.compile(r'^ses-(\d+)_(\d{8})$')
+
+
+def to_numeric_values(values: pd.Series) -> pd.Series:
+    """
+    将输出字符串转为数值：'' → NaN，小数逗号转为小数点，无法解析（如 EDSS 的 '-'）→ NaN。
+    """
+    text = values.astype(str).str.replace(',', '.', regex=False)
+    return pd.to_numeric(text.where(text != ''), errors='coerce')
+
+
+def unpack_session_column(
+    participants: Dict[str, List[str]],
+    participant_df: pd.DataFrame,
+    column: str
+) -> pd.Series:
+    """
+    将 participants.tsv 中逗号拼接的列拆成每个 session 一个值。
+
+    只适用于值本身不含逗号的列（如 age）；拆分后个数与该受试者的 session 数不一致
+    （如整列为 ''）时，该受试者的所有 session 都为 ''。
+
+    返回:
+        pd.Series: 顺序与 build_session_frame 的长表一致（受试者顺序 × session 顺序）
+    """
+    values = []
+    for participant_id, packed in zip(participant_df['participant_id'], participant_df[column]):
+        n_sessions = len(participants[participant_id])
+        parts = str(packed).split(',')
+        values.extend(parts if len(parts) == n_sessions else [''] * n_sessions)
+    return pd.Series(values, dtype=object)
+
+
+def session_labels(bids_dir: Path, participant_id: str) -> Dict[str, str]:
+    """
+    返回受试者 {session 日期: session 目录标签}，如 {'20180212': 'ses-01_20180212'}。
+    """
+    labels = {}
+    subject_dir = bids_dir / participant_id
+    if subject_dir.is_dir():
+        for item in subject_dir.iterdir():
+            match = _SESSION_DIR_PATTERN.match(item.name)
+            if match and item.is_dir():
+                labels[match.group(2)] = item.name
+    return labels
+
+
+def build_session_table(
+    participant_df: pd.DataFrame,
+    session_values: pd.DataFrame,
+    session_ages: Optional[pd.DataFrame],
+    bids_dir: Path,
+    text_columns: tuple = ('handedness',)
+) -> pd.DataFrame:
+    """
+    合成每个 (受试者, session) 一行的带类型长表。
+
+    参数:
+        participant_df (pd.DataFrame): participants.tsv 对应的宽表（含 sex、is_ms）
+        session_values (pd.DataFrame): session_measures.join_session_measures 返回的长表
+        session_ages (pd.DataFrame 或 None): participants.compute_session_ages 的结果
+            （participant_id、session_date、age 为 float）；None 表示没有出生日期，age 全为 NaN
+        bids_dir (Path): BIDS 根目录（用于查找 session 目录标签）
+        text_columns (tuple): 保持为字符串的量表列，其余量表列转为数值
+
+    返回:
+        pd.DataFrame: 列为 participant_id、session_id、session_date（datetime64）、age、
+            sex、is_ms 以及各量表列；*_offset_days 列为可空整数
+    """
+    table = session_values.reset_index(drop=True)
+    labels = {
+        participant_id: session_labels(bids_dir, participant_id)
+        for participant_id in participant_df['participant_id']
+    }
+    session_id = [
+        labels[participant_id].get(session_date)
+        for participant_id, session_date in zip(table['participant_id'], table['session_date'])
+    ]
+    measure_columns = [
+        column for column in table.columns if column not in ('participant_id', 'session_date')
+    ]
+
+    result = pd.DataFrame({
+        'participant_id': table['participant_id'],
+        'session_id': pd.Series(session_id, dtype=object),
+        'session_date': pd.to_datetime(table['session_date'], format='%Y%m%d'),
+    })
+    if session_ages is not None:
+        # 同一天的 session 年龄相同，按 (受试者, 日期) 对齐
+        ages = session_ages.drop_duplicates(['participant_id', 'session_date']).set_index(
+            ['participant_id', 'session_date']
+        )['age']
+        result['age'] = ages.reindex(pd.MultiIndex.from_arrays(
+            [table['participant_id'], table['session_date']]
+        )).to_numpy(dtype=float)
+    else:
+        result['age'] = float('nan')
+    static = participant_df.set_index('participant_id')[['sex', 'is_ms']]
+    result = result.join(static.replace('', pd.NA), on='participant_id')
+
+    for column in measure_columns:
+        if column in text_columns:
+            result[column] = table[column].replace('', pd.NA)
+        elif column.endswith('_offset_days'):
+            result[column] = to_numeric_values(table[column]).astype('Int64')
+        else:
+            result[column] = to_numeric_values(table[column])
+    return result
+
+
+def write_sessions_files(session_table: pd.DataFrame, bids_dir: Path) -> int:
+    """
+    为每个受试者写 sub-<id>/sub-<id>_sessions.tsv（session_id、session_date、age）。
+
+    返回:
+        int: 写入的文件数（受试者目录不存在时跳过）
+    """
+    written = 0
+    for participant_id, rows in session_table.groupby('participant_id', sort=False):
+        subject_dir = bids_dir / participant_id
+        if not subject_dir.is_dir():
+            continue
+        sessions = pd.DataFrame({
+            'session_id': rows['session_id'],
+            'session_date': rows['session_date'].dt.strftime('%Y-%m-%d'),
+            'age': rows['age'].round(2),
+        })
+        sessions.to_csv(
+            subject_dir / f"{participant_id}_sessions.tsv",
+            sep='\t', index=False, na_rep=NA_REP, encoding='utf-8'
+        )
+        written += 1
+    return written
+
+
+def write_phenotype_files(
+    session_table: pd.DataFrame,
+    bids_dir: Path,
+    instrument_columns: Dict[str, List[str]]
+) -> List[Path]:
+    """
+    为每个量表写 phenotype/<量表>.tsv，只包含该量表至少有一个值的 session。
+
+    参数:
+        session_table (pd.DataFrame): build_session_table 的结果
+        bids_dir (Path): BIDS 根目录
+        instrument_columns (Dict[str, List[str]]): 量表键 → 输出列（如 {'sdmt': ['sdmt']}）
+
+    返回:
+        List[Path]: 写入的文件路径
+    """
+    phenotype_dir = bids_dir / PHENOTYPE_DIRNAME
+    phenotype_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for key, columns in instrument_columns.items():
+        columns = [column for column in columns if column in session_table.columns]
+        value_columns = [column for column in columns if not column.endswith('_offset_days')]
+        rows = session_table.loc[
+            session_table[value_columns].notna().any(axis=1),
+            ['participant_id', 'session_id'] + columns
+        ]
+        path = phenotype_dir / f"{key}.tsv"
+        rows.to_csv(path, sep='\t', index=False, na_rep=NA_REP, encoding='utf-8')
+        paths.append(path)
+    return paths
+
+
+def write_sessions_parquet(session_table: pd.DataFrame, path: Path) -> Optional[Path]:
+    """
+    将长表写为 Parquet（需要 pyarrow；失败时记录警告并返回 None）。
+    """
+    try:
+        session_table.to_parquet(path, index=False)
+    except Exception as e:
+        logger.warning(f"Could not write {path.name}: {e}")
+        return None
+    return path
+
+
+def write_long_outputs(
+    participant_df: pd.DataFrame,
+    session_values: pd.DataFrame,
+    session_ages: Optional[pd.DataFrame],
+    bids_dir: Path,
+    instrument_columns: Dict[str, List[str]]
+) -> pd.DataFrame:
+    """
+    写出所有长格式文件（sessions.tsv、phenotype/*.tsv、participants_sessions.parquet）。
+
+    session_ages 见 build_session_table。
+
+    返回:
+        pd.DataFrame: 写出的带类型长表
+    """
+    bids_dir = Path(bids_dir)
+    session_table = build_session_table(participant_df, session_values, session_ages, bids_dir)
+
+    n_sessions_files = write_sessions_files(session_table, bids_dir)
+    phenotype_paths = write_phenotype_files(session_table, bids_dir, instrument_columns)
+    parquet_path = write_sessions_parquet(session_table, bids_dir / SESSIONS_PARQUET_FILENAME)
+    if parquet_path is not None:
+        ensure_bidsignore(bids_dir, SESSIONS_PARQUET_FILENAME)
+
+    logger.info(
+        f"Long-format outputs: {n_sessions_files} sessions.tsv files, "
+        f"{len(phenotype_paths)} phenotype files, "
+        f"{len(session_table)} rows in {SESSIONS_PARQUET_FILENAME if parquet_path else '(no parquet)'}"
+    )
+    return session_table
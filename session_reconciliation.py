@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Reconcile BIDS sessions against MRI Acquisition Date.xlsx.
+
+把 BIDS 数据集中的 session（sub-<mpi>/ses-<编号>_<日期>）与临床导出的 MRI 采集日期表
+（列 'mpi'、'acq_date'）按 (受试者, 日期) 做一次向量化外连接，并为每条记录标注状态：
+
+    matched                  目录日期与采集记录一致
+    shifted                  目录日期与同一受试者某条未匹配的采集记录相差不超过 shift_tolerance_days 天
+                             （目录日期可能录错，按采集日期更正）
+    extra                    BIDS 中有、采集表中没有的 session
+    missing                  采集表中有、BIDS 中没有的 session
+    subject_not_in_bids      采集表中的受试者在 BIDS 中没有任何 session
+    subject_not_in_workbook  BIDS 中的受试者不在采集表中
+
+shifted 的配对在同一受试者内用 merge_asof 取最近的未匹配采集日期，每条采集记录最多配对一个目录。
+
+输出：
+    session_reconciliation.tsv    每条记录一行（见 REPORT_COLUMNS）
+    session_date_corrections.tsv  shifted 记录的 (participant_id, folder_date, corrected_date)，
+                                  可传给 organize_to_bids.py --session_corrections，
+                                  由 build_session_mapping 按更正后的日期编号和命名 session
+    --write_issues 时另把所有未匹配记录追加到 BIDS 根目录的 issues.tsv
+
+使用方法:
+    python session_reconciliation.py --bids_dir ./bids_data --clinical_dir ./clinical_data --output_dir .
+"""
+
+import argparse
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from bids_issues import append_issues
+from clinical_tables import load_excel_file, normalize_id_column
+
+logger = logging.getLogger(__name__)
+
+# 采集日期表及其列（原表的列名带尾随空格，读取后去除）
+ACQUISITION_FILE = 'MRI Acquisition Date.xlsx'
+ID_COLUMN = 'mpi'
+DATE_COLUMN = 'acq_date'
+
+# 目录日期与采集日期最多相差多少天时视为 shifted
+SHIFT_TOLERANCE_DAYS = 30
+
+# 输出文件名
+REPORT_FILENAME = 'session_reconciliation.tsv'
+CORRECTIONS_FILENAME = 'session_date_corrections.tsv'
+
+# 报告的列
+REPORT_COLUMNS = ['participant_id', 'session', 'folder_date', 'acq_date', 'status', 'offset_days']
+CORRECTIONS_COLUMNS = ['participant_id', 'folder_date', 'corrected_date']
+
+# 匹配 BIDS 目录：sub-<mpi> / ses-<编号>_<日期>
+_SUBJECT_DIR_PATTERN = re.compile(r'^sub-(\d+)$')
+_SESSION_DIR_PATTERN = re.compile(r'^ses-(\d+)_(\d{8})$')
+
+_DATE_FORMAT = '%Y%m%d'
+
+
+def load_bids_sessions(bids_dir: Path) -> pd.DataFrame:
+    """
+    扫描 BIDS 目录，返回所有 session（列 mpi、session、folder_date[datetime64]）。
+    """
+    rows = []
+    for subject_dir in Path(bids_dir).iterdir():
+        subject_match = _SUBJECT_DIR_PATTERN.match(subject_dir.name)
+        if not subject_match or not subject_dir.is_dir():
+            continue
+        for session_dir in subject_dir.iterdir():
+            session_match = _SESSION_DIR_PATTERN.match(session_dir.name)
+            if session_match and session_dir.is_dir():
+                rows.append((subject_match.group(1), session_dir.name, session_match.group(2)))
+
+    sessions = pd.DataFrame(rows, columns=['mpi', 'session', 'folder_date'])
+    sessions['folder_date'] = pd.to_datetime(sessions['folder_date'], format=_DATE_FORMAT)
+    logger.info(f"Found {len(sessions)} BIDS sessions for {sessions['mpi'].nunique()} participants")
+    return sessions
+
+
+def load_acquisition_dates(clinical_dir: Path, cache_dir: Optional[Path] = None) -> Optional[pd.DataFrame]:
+    """
+    读取采集日期表，返回去重后的 (mpi, acq_date[datetime64])；文件无法加载时返回 None。
+    """
+    df = load_excel_file(Path(clinical_dir) / ACQUISITION_FILE, cache_dir)
+    if df is None:
+        return None
+    df = df.rename(columns=lambda column: str(column).strip())
+
+    dates = pd.to_datetime(df[DATE_COLUMN], errors='coerce').dt.normalize()
+    acquisitions = pd.DataFrame({
+        'mpi': normalize_id_column(df[ID_COLUMN]),
+        'acq_date': dates,
+    })
+    invalid = dates.isna().sum()
+    if invalid:
+        logger.warning(f"Ignoring {invalid} rows without a valid {DATE_COLUMN} in {ACQUISITION_FILE}")
+    return acquisitions.dropna(subset=['acq_date']).drop_duplicates(ignore_index=True)
+
+
+def _pair_shifted(extra: pd.DataFrame, missing: pd.DataFrame, tolerance_days: int) -> pd.DataFrame:
+    """
+    在同一受试者内把未匹配的目录日期与最近的未匹配采集日期配对（每条采集记录最多配对一次）。
+
+    返回:
+        pd.DataFrame: 列 mpi、folder_date、acq_date
+    """
+    if extra.empty or missing.empty:
+        return pd.DataFrame(columns=['mpi', 'folder_date', 'acq_date'])
+
+    candidates = missing[['mpi', 'acq_date']].assign(_on=missing['acq_date']).sort_values('_on')
+    pairs = pd.merge_asof(
+        extra[['mpi', 'folder_date']].assign(_on=extra['folder_date']).sort_values('_on'),
+        candidates,
+        on='_on',
+        by='mpi',
+        direction='nearest',
+        tolerance=pd.Timedelta(days=tolerance_days),
+    ).dropna(subset=['acq_date'])
+
+    # 多个目录配到同一条采集记录时保留相差最小的一个
+    pairs['_distance'] = (pairs['folder_date'] - pairs['acq_date']).abs()
+    pairs = pairs.sort_values(['_distance', 'mpi', 'folder_date'], kind='stable')
+    pairs = pairs.drop_duplicates(['mpi', 'acq_date'], keep='first')
+    return pairs[['mpi', 'folder_date', 'acq_date']]
+
+
+def reconcile_sessions(
+    sessions: pd.DataFrame,
+    acquisitions: pd.DataFrame,
+    shift_tolerance_days: int = SHIFT_TOLERANCE_DAYS
+) -> pd.DataFrame:
+    """
+    将 BIDS session 与采集记录对齐并标注状态。
+
+    参数:
+        sessions (pd.DataFrame): load_bids_sessions 的结果
+        acquisitions (pd.DataFrame): load_acquisition_dates 的结果
+        shift_tolerance_days (int): shifted 配对允许的最大天数差
+
+    返回:
+        pd.DataFrame: 列见 REPORT_COLUMNS，按 participant_id 和日期排序
+    """
+    merged = sessions.merge(
+        acquisitions, left_on=['mpi', 'folder_date'], right_on=['mpi', 'acq_date'],
+        how='outer', indicator=True
+    )
+    in_bids = merged['mpi'].isin(sessions['mpi'])
+    in_workbook = merged['mpi'].isin(acquisitions['mpi'])
+
+    status = pd.Series('matched', index=merged.index, dtype=object)
+    status[merged['_merge'] == 'left_only'] = 'extra'
+    status[merged['_merge'] == 'right_only'] = 'missing'
+    status[~in_bids] = 'subject_not_in_bids'
+    status[~in_workbook] = 'subject_not_in_workbook'
+    merged['status'] = status
+
+    # 同一受试者内的 extra / missing 就近配对为 shifted
+    pairs = _pair_shifted(
+        merged.loc[status == 'extra'], merged.loc[status == 'missing'], shift_tolerance_days
+    )
+    if not pairs.empty:
+        pairs = pairs.assign(status='shifted')
+        is_paired_folder = pd.MultiIndex.from_frame(merged[['mpi', 'folder_date']]).isin(
+            pd.MultiIndex.from_frame(pairs[['mpi', 'folder_date']])
+        )
+        is_paired_acquisition = (status == 'missing') & pd.MultiIndex.from_frame(
+            merged[['mpi', 'acq_date']]
+        ).isin(pd.MultiIndex.from_frame(pairs[['mpi', 'acq_date']]))
+        shifted = merged.loc[(status == 'extra') & is_paired_folder].drop(columns=['acq_date', 'status'])
+        shifted = shifted.merge(pairs, on=['mpi', 'folder_date'])
+        merged = pd.concat(
+            [merged.loc[~((status == 'extra') & is_paired_folder) & ~is_paired_acquisition], shifted],
+            ignore_index=True
+        )
+
+    merged['participant_id'] = 'sub-' + merged['mpi']
+    merged['offset_days'] = (merged['folder_date'] - merged['acq_date']).dt.days.astype('Int64')
+    merged['_sort_date'] = merged['folder_date'].fillna(merged['acq_date'])
+    report = merged.sort_values(['participant_id', '_sort_date'], ignore_index=True)
+    for column in ('folder_date', 'acq_date'):
+        report[column] = report[column].dt.strftime(_DATE_FORMAT).fillna('')
+    report['session'] = report['session'].fillna('')
+    return report[REPORT_COLUMNS]
+
+
+def session_date_corrections(report: pd.DataFrame) -> pd.DataFrame:
+    """
+    返回 shifted 记录的日期更正表（列见 CORRECTIONS_COLUMNS）。
+    """
+    shifted = report.loc[report['status'] == 'shifted']
+    return pd.DataFrame({
+        'participant_id': shifted['participant_id'],
+        'folder_date': shifted['folder_date'],
+        'corrected_date': shifted['acq_date'],
+    }).reset_index(drop=True)
+
+
+def load_session_corrections(path: Path) -> Dict[Tuple[str, str], str]:
+    """
+    读取 session_date_corrections.tsv，返回 {(mpi, 目录日期): 更正日期}
+    （mpi 不带 'sub-' 前缀，与 organize_to_bids 中的 BIDS 受试者 ID 一致）。
+    """
+    corrections = pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False)
+    mpis = corrections['participant_id'].str.replace(r'^sub-', '', regex=True)
+    return dict(zip(zip(mpis, corrections['folder_date']), corrections['corrected_date']))
+
+
+def report_issues(report: pd.DataFrame):
+    """
+    生成未匹配记录的 issues.tsv 行：(type, participant_id, session, issue)。
+
+    受试者级的状态每个受试者只生成一行。
+    """
+    descriptions = {
+        'shifted': lambda row: f"Session folder date {row.folder_date} differs from MRI acquisition date "
+                               f"{row.acq_date} ({row.offset_days:+d} days)",
+        'extra': lambda row: f"Session {row.folder_date} not in {ACQUISITION_FILE}",
+        'missing': lambda row: f"MRI acquisition on {row.acq_date} has no BIDS session",
+    }
+    for row in report.loc[report['status'].isin(descriptions)].itertuples(index=False):
+        yield 'specific', row.participant_id, row.session, descriptions[row.status](row)
+
+    subject_level = report.loc[
+        report['status'].isin(['subject_not_in_bids', 'subject_not_in_workbook'])
+    ].drop_duplicates('participant_id')
+    for row in subject_level.itertuples(index=False):
+        if row.status == 'subject_not_in_bids':
+            issue = f"Participant has MRI acquisitions in {ACQUISITION_FILE} but no BIDS sessions"
+        else:
+            issue = f"Participant not in {ACQUISITION_FILE}"
+        yield 'specific', row.participant_id, '', issue
+
+
+def log_summary(report: pd.DataFrame):
+    """
+    记录各状态的记录数和受试者数。
+    """
+    counts = report.groupby('status')['participant_id'].agg(['size', 'nunique'])
+    for status, row in counts.iterrows():
+        logger.info(f"  {status:<24} {row['size']:>6} records, {row['nunique']:>5} participants")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description='将BIDS session与MRI采集日期表对账，生成差异报告和session日期更正表'
+    )
+    parser.add_argument(
+        '--bids_dir',
+        type=str,
+        default='/home/xingwang/Dresden/bids_data',
+        help='BIDS数据集目录路径'
+    )
+    parser.add_argument(
+        '--clinical_dir',
+        type=str,
+        default='/home/xingwang/Dresden_dataset/raw/clinical_data',
+        help=f'临床数据目录路径（包含 {ACQUISITION_FILE}）'
+    )
+    parser.add_argument(
+        '--output_dir',
+        type=str,
+        default='.',
+        help=f'输出目录（写出 {REPORT_FILENAME} 和 {CORRECTIONS_FILENAME}）'
+    )
+    parser.add_argument(
+        '--shift_tolerance_days',
+        type=int,
+        default=SHIFT_TOLERANCE_DAYS,
+        help=f'目录日期与采集日期相差不超过该天数时视为日期偏移 (默认: {SHIFT_TOLERANCE_DAYS})'
+    )
+    parser.add_argument(
+        '--write_issues',
+        action='store_true',
+        help='将所有未匹配的记录追加到 BIDS 根目录的 issues.tsv'
+    )
+
+    args = parser.parse_args()
+    bids_dir = Path(args.bids_dir)
+    output_dir = Path(args.output_dir)
+
+    acquisitions = load_acquisition_dates(Path(args.clinical_dir))
+    if acquisitions is None:
+        raise SystemExit(f"Could not load {ACQUISITION_FILE} from {args.clinical_dir}")
+    sessions = load_bids_sessions(bids_dir)
+
+    report = reconcile_sessions(sessions, acquisitions, args.shift_tolerance_days)
+    log_summary(report)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report.to_csv(output_dir / REPORT_FILENAME, sep='\t', index=False)
+    corrections = session_date_corrections(report)
+    corrections.to_csv(output_dir / CORRECTIONS_FILENAME, sep='\t', index=False)
+    logger.info(
+        f"Wrote {output_dir / REPORT_FILENAME} and {len(corrections)} date corrections "
+        f"to {output_dir / CORRECTIONS_FILENAME}"
+    )
+
+    if args.write_issues:
+        append_issues(bids_dir / 'issues.tsv', report_issues(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Synthetic clinical workbooks and BIDS session tree for participants.py.
+
+真实的临床工作簿不能外传，因此这里按相同的表结构生成假数据：EXCEL_FILES 中的六个工作簿
+列名、工作表名、取值类型和日期格式都与原表一致（SDMT/9HPT/T25FW 的 RFC-2822 时间字符串、
+EDSS 的 Excel 日期单元格和德式小数逗号评分、Education 的 Unix 时间戳、sDOB 的 01.01.yyyy）。
+
+每个受试者有若干次 MRI session（ses-<编号>_<日期> 目录），每个量表对每个 session 独立地：
+约一半在同一天评估，约三分之一在 session 前后 60 天内评估，其余没有评估。
+
+使用方法:
+    python synthetic_clinical_data.py --output_dir ./synthetic --subjects 545 --seed 0
+
+    生成 <output_dir>/clinical_data/*.xlsx 和 <output_dir>/bids_data/sub-*/ses-*/
+"""
+
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 与 participants.EXCEL_FILES 相同的键和文件名
+WORKBOOK_FILES = {
+    'sDOB': 'sDOB_Gender_Year diagnosis.xlsx',
+    'sdmt': 'PST_SDMT.xlsx',
+    '9hpt': '9HPT.xlsx',
+    'edss': 'EDSS.xlsx',
+    't25fw': 'T25FW.xlsx',
+    'education': 'Education_MSType.xlsx',
+}
+
+# 原工作簿的工作表名
+SHEET_NAMES = {
+    'edss': 'EDSS Gesamtscores',
+}
+
+# 真实队列的受试者数（基准测试的 1× 规模）
+COHORT_SIZE = 545
+
+# 第一个受试者 ID（与真实数据的 ID Dresden 取值范围一致）
+FIRST_SUBJECT_ID = 500000017
+
+# EDSS 评分的取值（字符串，德式小数逗号；'-' 表示未评）
+EDSS_SCORES = ['0', '1', '1,5', '2', '2,5', '3', '3,5', '4', '4,5', '5', '5,5', '6', '6,5', '7', '-']
+
+MS_TYPES = ['Relapsing Remitting MS', 'Secondary Progressive MS', 'Primary Progressive MS', 'CIS']
+
+RFC2822_FORMAT = '%a, %d %b %Y %H:%M:%S +0000'
+
+
+class SyntheticCohort(NamedTuple):
+    """
+    generate_cohort 的结果。
+
+    属性:
+        sessions (pd.DataFrame): 每个 MRI session 一行：subject_id、session_number、session_date（datetime64）
+        workbooks (Dict[str, pd.DataFrame]): EXCEL_FILES 的键 → 工作簿内容
+    """
+    sessions: pd.DataFrame
+    workbooks: Dict[str, pd.DataFrame]
+
+
+def _generate_sessions(rng: np.random.Generator, n_subjects: int, max_sessions: int) -> pd.DataFrame:
+    """
+    为每个受试者生成 1..max_sessions 次 MRI session，间隔约 6–18 个月。
+    """
+    counts = rng.integers(1, max_sessions + 1, size=n_subjects)
+    subject_ids = np.repeat(FIRST_SUBJECT_ID + np.arange(n_subjects), counts)
+    session_number = np.concatenate([np.arange(1, count + 1) for count in counts])
+
+    first_day = rng.integers(0, 5 * 365, size=n_subjects)
+    gaps = rng.integers(180, 540, size=len(subject_ids))
+    gaps[session_number == 1] = 0
+    # 每个受试者内累加间隔
+    offsets = np.repeat(first_day, counts) + pd.Series(gaps).groupby(subject_ids).cumsum().to_numpy()
+
+    return pd.DataFrame({
+        'subject_id': subject_ids,
+        'session_number': session_number,
+        'session_date': pd.Timestamp('2017-01-01') + pd.to_timedelta(offsets, unit='D'),
+    })
+
+
+def _assessment_dates(rng: np.random.Generator, sessions: pd.DataFrame) -> pd.DataFrame:
+    """
+    为每个 session 抽样一次评估：50% 同一天，35% 在 ±60 天内，15% 没有评估。
+    评估时刻为当天 08:00–16:00 之间的随机时间。
+    """
+    draw = rng.random(len(sessions))
+    offset_days = np.where(draw < 0.5, 0, rng.integers(-60, 61, size=len(sessions)))
+    keep = draw < 0.85
+    seconds = rng.integers(8 * 3600, 16 * 3600, size=len(sessions))
+    started = (
+        sessions['session_date'].to_numpy()
+        + pd.to_timedelta(offset_days, unit='D').to_numpy()
+        + pd.to_timedelta(seconds, unit='s').to_numpy()
+    )
+    return pd.DataFrame({
+        'subject_id': sessions['subject_id'].to_numpy(),
+        'started': pd.to_datetime(started),
+    }).loc[keep].reset_index(drop=True)
+
+
+def _module_columns(rng: np.random.Generator, started: pd.Series) -> Dict[str, object]:
+    """
+    SDMT/9HPT/T25FW 共有的评估/模块时间列。
+    """
+    n = len(started)
+    assessment_minutes = rng.integers(20, 40, size=n)
+    module_start = rng.integers(5, 15, size=n)
+    module_seconds = rng.integers(40, 400, size=n)
+    ended = started + pd.to_timedelta(assessment_minutes, unit='m')
+    module_started = started + pd.to_timedelta(module_start, unit='m')
+    module_ended = module_started + pd.to_timedelta(module_seconds, unit='s')
+    return {
+        'Assessment Started At': started.dt.strftime(RFC2822_FORMAT),
+        'Assessment Ended At': ended.dt.strftime(RFC2822_FORMAT),
+        'Module Started At': module_started.dt.strftime(RFC2822_FORMAT),
+        'Module Ended At': module_ended.dt.strftime(RFC2822_FORMAT),
+        'Module Duration': module_seconds,
+        'Canceled': 'false',
+        'Cancel Reason': None,
+    }
+
+
+def _generate_sdmt(rng: np.random.Generator, sessions: pd.DataFrame) -> pd.DataFrame:
+    visits = _assessment_dates(rng, sessions)
+    n = len(visits)
+    return pd.DataFrame({
+        'ID Dresden': visits['subject_id'],
+        **_module_columns(rng, visits['started']),
+        'Trial State': 'Completed',
+        'Total Number Correct': rng.integers(20, 80, size=n),
+        'Total Number Incorrect': rng.integers(0, 4, size=n),
+        'Practice': 'false',
+    })
+
+
+def _generate_9hpt(rng: np.random.Generator, sessions: pd.DataFrame) -> pd.DataFrame:
+    visits = _assessment_dates(rng, sessions)
+    n = len(visits)
+    dominant = np.where(rng.random(n) < 0.9, 'right', 'left')
+    left_time = rng.uniform(16, 40, size=n)
+    right_time = rng.uniform(16, 40, size=n)
+    module = _module_columns(rng, visits['started'])
+
+    # 每次评估两行：Trial Index 0 为右手，1 为左手
+    frame = pd.DataFrame({
+        'ID Dresden': visits['subject_id'],
+        **module,
+        'Pegs Dropped': rng.integers(0, 3, size=n),
+        'Dominant Hand': dominant,
+        'Left Hand Time': left_time,
+        'Right Hand Time': right_time,
+    })
+    right = frame.assign(**{'Hand Used': 'right', 'Trial Index': 0, 'Trial Duration': right_time})
+    left = frame.assign(**{'Hand Used': 'left', 'Trial Index': 1, 'Trial Duration': left_time})
+    combined = pd.concat([right, left]).sort_index(kind='stable').reset_index(drop=True)
+    return combined[[
+        'ID Dresden', 'Assessment Started At', 'Assessment Ended At', 'Module Started At',
+        'Module Ended At', 'Module Duration', 'Canceled', 'Cancel Reason', 'Pegs Dropped',
+        'Trial Duration', 'Dominant Hand', 'Left Hand Time', 'Right Hand Time', 'Hand Used',
+        'Trial Index',
+    ]]
+
+
+def _generate_t25fw(rng: np.random.Generator, sessions: pd.DataFrame) -> pd.DataFrame:
+    visits = _assessment_dates(rng, sessions)
+    n = len(visits)
+    return pd.DataFrame({
+        'ID Dresden': visits['subject_id'],
+        **_module_columns(rng, visits['started']),
+        'Walk Duration': rng.uniform(3, 12, size=n),
+        'AFO Choice': 'none',
+        'Walking Aid Choice': 'none',
+        'AFO Used': 'false',
+        'Walking Aid Used': 'false',
+        'Successful Trials': 1,
+        'Unsuccessful Trials': rng.integers(0, 3, size=n),
+    })
+
+
+def _generate_edss(rng: np.random.Generator, sessions: pd.DataFrame) -> pd.DataFrame:
+    visits = _assessment_dates(rng, sessions)
+    return pd.DataFrame({
+        'ID Dresden': visits['subject_id'],
+        # Excel 日期单元格（只有日期）
+        'Visitdate': visits['started'].dt.normalize(),
+        'scoreEdss': rng.choice(EDSS_SCORES, size=len(visits)),
+    })
+
+
+def _generate_education(rng: np.random.Generator, sessions: pd.DataFrame) -> pd.DataFrame:
+    visits = _assessment_dates(rng, sessions)
+    subject_ids = visits['subject_id'].to_numpy()
+    unique_ids, first_positions, inverse = np.unique(subject_ids, return_index=True, return_inverse=True)
+
+    # 教育年限每个受试者固定；MS 类型只在受试者的第一条记录中填写
+    education_years = rng.integers(9, 21, size=len(unique_ids))
+    ms_type = np.full(len(visits), None, dtype=object)
+    ms_type[first_positions] = rng.choice(MS_TYPES, size=len(unique_ids))
+
+    return pd.DataFrame({
+        'mpi': subject_ids,
+        'encdate': (visits['started'] - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1),
+        'educ': education_years[inverse],
+        'mstype': ms_type,
+    })
+
+
+def _generate_sdob(rng: np.random.Generator, n_subjects: int) -> pd.DataFrame:
+    birth_years = rng.integers(1950, 2001, size=n_subjects)
+    diagnosis_years = (birth_years + rng.integers(18, 45, size=n_subjects)).astype(float)
+    # 约 20% 为健康对照（无诊断年份）
+    diagnosis_years[rng.random(n_subjects) < 0.2] = np.nan
+    return pd.DataFrame({
+        'ID Dresden': FIRST_SUBJECT_ID + np.arange(n_subjects),
+        'Study date of Birth (sDOB: 01.01.yyyy)': pd.to_datetime(
+            pd.Series(birth_years).astype(str) + '-01-01'
+        ),
+        'Gender': rng.choice(['male', 'female'], size=n_subjects),
+        'Date of Diagnosis (year)': np.minimum(diagnosis_years, 2023),
+    })
+
+
+def generate_cohort(n_subjects: int = COHORT_SIZE, max_sessions: int = 7, seed: int = 0) -> SyntheticCohort:
+    """
+    生成一个与真实数据表结构一致的合成队列。
+
+    参数:
+        n_subjects (int): 受试者数
+        max_sessions (int): 每个受试者最多的 MRI session 数
+        seed (int): 随机种子（相同参数和种子生成完全相同的数据）
+
+    返回:
+        SyntheticCohort: session 列表和六个工作簿的 DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    sessions = _generate_sessions(rng, n_subjects, max_sessions)
+    workbooks = {
+        'sDOB': _generate_sdob(rng, n_subjects),
+        'sdmt': _generate_sdmt(rng, sessions),
+        '9hpt': _generate_9hpt(rng, sessions),
+        'edss': _generate_edss(rng, sessions),
+        't25fw': _generate_t25fw(rng, sessions),
+        'education': _generate_education(rng, sessions),
+    }
+    return SyntheticCohort(sessions, workbooks)
+
+
+def participants_from_sessions(sessions: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    将 session 表转为 participants.get_participants_and_sessions 的返回格式。
+    """
+    dates = sessions['session_date'].dt.strftime('%Y%m%d')
+    participants: Dict[str, List[str]] = {}
+    for subject_id, session_date in zip(sessions['subject_id'], dates):
+        participants.setdefault(f"sub-{subject_id}", []).append(session_date)
+    return {participant_id: sorted(dates) for participant_id, dates in participants.items()}
+
+
+def write_bids_session_tree(sessions: pd.DataFrame, bids_dir: Path) -> int:
+    """
+    创建 sub-<id>/ses-<编号>_<日期>/anat/ 空目录树（participants.py 只读取目录名）。
+
+    返回:
+        int: 创建的 session 目录数
+    """
+    bids_dir = Path(bids_dir)
+    dates = sessions['session_date'].dt.strftime('%Y%m%d')
+    for subject_id, session_number, session_date in zip(
+        sessions['subject_id'], sessions['session_number'], dates
+    ):
+        session_dir = bids_dir / f"sub-{subject_id}" / f"ses-{session_number:02d}_{session_date}"
+        (session_dir / 'anat').mkdir(parents=True, exist_ok=True)
+    return len(sessions)
+
+
+def write_workbooks(workbooks: Dict[str, pd.DataFrame], clinical_dir: Path) -> List[Path]:
+    """
+    将工作簿写为 .xlsx（文件名和工作表名与原始数据一致）。
+
+    注意：.xlsx 每个工作表最多 1,048,576 行，超大规模的基准测试应直接使用 DataFrame。
+    """
+    clinical_dir = Path(clinical_dir)
+    clinical_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for key, frame in workbooks.items():
+        path = clinical_dir / WORKBOOK_FILES[key]
+        frame.to_excel(path, sheet_name=SHEET_NAMES.get(key, 'Tabelle1'), index=False)
+        logger.info(f"Wrote {path.name}: {len(frame)} rows")
+        paths.append(path)
+    return paths
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description='生成与真实临床工作簿结构一致的合成数据和BIDS session目录树'
+    )
+    parser.add_argument(
+        '--output_dir',
+        type=str,
+        default='synthetic_data',
+        help='输出目录（生成 clinical_data/ 和 bids_data/）'
+    )
+    parser.add_argument(
+        '--subjects',
+        type=int,
+        default=COHORT_SIZE,
+        help=f'受试者数 (默认: {COHORT_SIZE}，即真实队列规模)'
+    )
+    parser.add_argument(
+        '--max_sessions',
+        type=int,
+        default=7,
+        help='每个受试者最多的MRI session数'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='随机种子'
+    )
+
+    args = parser.parse_args()
+    output_dir = Path(args.output_dir)
+
+    cohort = generate_cohort(args.subjects, args.max_sessions, args.seed)
+    write_workbooks(cohort.workbooks, output_dir / 'clinical_data')
+    n_sessions = write_bids_session_tree(cohort.sessions, output_dir / 'bids_data')
+    logger.info(f"Synthetic cohort: {args.subjects} subjects, {n_sessions} sessions in {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+并行流式校验 BIDS 目录中 NIfTI 文件的完整性
+
+对每个 .nii.gz 文件：
+    1. 以固定大小的块流式解压（输入和输出都限制块大小，恒定内存），由 zlib 校验 gzip 尾部的 CRC32 和 ISIZE；
+    2. 解析 NIfTI 头，检查解压后的长度是否不小于 vox_offset + 体数据字节数。
+
+中断的拷贝通常会留下截断的 .nii.gz，这类文件在第 1 步就会被发现。
+
+校验成功的文件会记录 (size, mtime) 到 BIDS 根目录下的 .verify_cache.tsv，
+再次运行时大小和修改时间都未变化的文件直接跳过。
+
+使用方法:
+    python verify_bids.py --bids_dir ./bids_data --output ./nifti_verify_failures.tsv --workers 8
+"""
+
+import argparse
+import csv
+import logging
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from nifti_header import NIFTI2_HEADER_SIZE, expected_data_size, parse_nifti_header
+
+# 校验缓存文件名（以 . 开头，BIDS 验证器会自动忽略）
+VERIFY_CACHE_FILENAME = '.verify_cache.tsv'
+
+# 每次读取的压缩数据块大小
+_READ_CHUNK_SIZE = 1024 * 1024
+
+# 每次解压最多产出的字节数（高压缩比的数据如大片 0 体素也保持恒定内存）
+_MAX_OUTPUT_SIZE = 4 * 1024 * 1024
+
+# 结果 TSV 的列
+FAILURE_COLUMNS = ['path', 'size', 'error']
+
+
+def verify_nifti_file(path) -> Optional[str]:
+    """
+    流式校验单个 NIfTI 文件
+
+    Args:
+        path: .nii 或 .nii.gz 文件路径
+
+    Returns:
+        None 表示文件完好；否则返回错误描述字符串
+    """
+    path = Path(path)
+    head = b''
+    total = 0
+
+    try:
+        with open(path, 'rb') as f:
+            if path.name.endswith('.gz'):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                pending = b''         # 尚未交给解压器的压缩数据
+                buffered = False      # 上次解压达到 _MAX_OUTPUT_SIZE，解压器内可能还有输出
+                while True:
+                    if decompressor.eof:
+                        # 一个 .gz 可能由多个 gzip 成员拼接而成，每个成员结束后用新的解压器继续；
+                        # 成员之后的 NUL 填充与 gzip 模块一样忽略
+                        pending = pending.lstrip(b'\x00')
+                        if not pending:
+                            pending = f.read(_READ_CHUNK_SIZE)
+                            if not pending:
+                                break
+                            continue
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    elif not pending and not buffered:
+                        pending = f.read(_READ_CHUNK_SIZE)
+                        if not pending:
+                            break
+                    data = decompressor.decompress(pending, _MAX_OUTPUT_SIZE)
+                    buffered = len(data) == _MAX_OUTPUT_SIZE
+                    total += len(data)
+                    if len(head) < NIFTI2_HEADER_SIZE:
+                        head += data[:NIFTI2_HEADER_SIZE - len(head)]
+                    pending = decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail
+                if not decompressor.eof:
+                    return f"gzip 流被截断（已解压 {total} 字节）"
+            else:
+                head = f.read(NIFTI2_HEADER_SIZE)
+                total = path.stat().st_size
+    except zlib.error as e:
+        # CRC32 / ISIZE 不匹配或压缩数据损坏
+        return f"gzip 数据损坏: {e}"
+    except OSError as e:
+        return f"无法读取文件: {e}"
+
+    try:
+        header = parse_nifti_header(head, str(path))
+    except ValueError as e:
+        return f"NIfTI 头非法: {e}"
+
+    expected = expected_data_size(header)
+    if total < expected:
+        return f"数据长度不足: 期望至少 {expected} 字节, 实际 {total} 字节"
+
+    return None
+
+
+def _verify_task(path: str) -> Tuple[str, Optional[str]]:
+    """
+    进程池工作函数
+    """
+    return path, verify_nifti_file(path)
+
+
+def load_verify_cache(cache_path: Path) -> Dict[str, Tuple[int, int]]:
+    """
+    读取校验缓存：{相对路径: (size, mtime_ns)}
+    """
+    cache = {}
+    if not cache_path.exists():
+        return cache
+    with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            try:
+                cache[row['path']] = (int(row['size']), int(row['mtime_ns']))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return cache
+
+
+def save_verify_cache(cache_path: Path, cache: Dict[str, Tuple[int, int]]):
+    """
+    写回校验缓存（先写临时文件再原子替换）
+    """
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write('path\tsize\tmtime_ns\n')
+        for rel_path in sorted(cache):
+            size, mtime_ns = cache[rel_path]
+            f.write(f"{rel_path}\t{size}\t{mtime_ns}\n")
+    os.replace(tmp_path, cache_path)
+
+
+def verify_bids_dataset(
+    bids_root,
+    output_path,
+    max_workers: Optional[int] = None,
+    use_cache: bool = True
+) -> List[Tuple[str, int, str]]:
+    """
+    并行校验 BIDS 目录中的所有 NIfTI 文件，并将失败的文件写入 TSV
+
+    Args:
+        bids_root: BIDS 数据集根目录
+        output_path: 失败文件列表 TSV 的输出路径
+        max_workers: 并行进程数（None → CPU 核数；1 → 串行）
+        use_cache: 是否跳过大小和修改时间与上次成功校验一致的文件
+
+    Returns:
+        List[Tuple[str, int, str]]: [(相对路径, 文件大小, 错误描述), ...]
+    """
+    root = Path(bids_root)
+    cache_path = root / VERIFY_CACHE_FILENAME
+    cache = load_verify_cache(cache_path) if use_cache else {}
+
+    nifti_files = sorted(root.rglob('*.nii.gz')) + sorted(root.rglob('*.nii'))
+    stats = {}
+    pending = []
+    for path in nifti_files:
+        rel_path = path.relative_to(root).as_posix()
+        stat = path.stat()
+        stats[rel_path] = (stat.st_size, stat.st_mtime_ns)
+        if cache.get(rel_path) != stats[rel_path]:
+            pending.append(str(path))
+
+    logging.info(
+        f" 共找到 {len(nifti_files)} 个 NIfTI 文件, "
+        f"跳过 {len(nifti_files) - len(pending)} 个已校验文件, 待校验 {len(pending)} 个"
+    )
+
+    if max_workers == 1:
+        results: Iterable = map(_verify_task, pending)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        # 单个文件较大（几十 MB），chunksize 取小值以保持负载均衡
+        results = executor.map(_verify_task, pending, chunksize=4)
+
+    failures = []
+    try:
+        for path, error in tqdm(results, total=len(pending), desc=" 校验 NIfTI"):
+            rel_path = Path(path).relative_to(root).as_posix()
+            if error is None:
+                cache[rel_path] = stats[rel_path]
+            else:
+                cache.pop(rel_path, None)
+                failures.append((rel_path, stats[rel_path][0], error))
+                logging.error(f" 校验失败 {rel_path}: {error}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # 只保留仍然存在的文件
+    cache = {rel_path: value for rel_path, value in cache.items() if rel_path in stats}
+    save_verify_cache(cache_path, cache)
+
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        f.write('\t'.join(FAILURE_COLUMNS) + '\n')
+        for rel_path, size, error in failures:
+            f.write(f"{rel_path}\t{size}\t{error}\n")
+
+    logging.info(f"校验完成: 失败 {len(failures)} 个, 结果已写入 {output_path}")
+    return failures
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('verify_bids.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(
+        description='并行流式校验BIDS目录中NIfTI文件的完整性 (gzip CRC/长度 + 头信息)'
+    )
+    parser.add_argument(
+        '--bids_dir',
+        type=str,
+        default='/home/xingwang/Dresden/bids_data',
+        help='BIDS数据集目录路径'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='nifti_verify_failures.tsv',
+        help='损坏文件列表的输出TSV路径'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='并行进程数 (默认: CPU核数)'
+    )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help='忽略校验缓存，重新校验所有文件'
+    )
+
+    args = parser.parse_args()
+
+    verify_bids_dataset(
+        args.bids_dir,
+        args.output,
+        max_workers=args.workers,
+        use_cache=not args.no_cache
+    )
+
+
+if __name__ == "__main__":
+    main()